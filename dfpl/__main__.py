@@ -1,17 +1,27 @@
 import dataclasses
 import logging
 import os.path
+import sys
 from argparse import Namespace
 from os import path
+from typing import Iterator, Tuple
 
 import chemprop as cp
+import pandas as pd
 
 from dfpl import autoencoder as ac
+from dfpl import bitfilter
 from dfpl import feedforwardNN as fNN
 from dfpl import fingerprint as fp
-from dfpl import options, predictions
+from dfpl import options, predictions, resources
 from dfpl import single_label_model as sl
 from dfpl import vae as vae
+from dfpl.dataset import lookup_dataset
+from dfpl.descriptors import descriptorNames
+from dfpl.features import FeatureStore, dense_rows
+from dfpl.fpcache import FingerprintCache
+from dfpl.molstore import molecule_store
+from dfpl.standardize import standardizer
 from dfpl.utils import createArgsFromJson, createDirectory, makePathAbsolute
 
 
@@ -23,9 +33,12 @@ def traindmpnn(opts: options.GnnOptions) -> None:
     Returns:
     - None
     """
+    threads = resources.configure_threads(opts.threads)
     # Load options from a JSON file and replace the relevant attributes in `opts`
     arguments = createArgsFromJson(jsonFile=opts.configFile)
     opts = cp.args.TrainArgs().parse_args(arguments)
+    # the data loading workers share the CPUs with the torch threads
+    opts.num_workers = min(opts.num_workers, threads)
     logging.info("Training DMPNN...")
     mean_score, std_score = cp.train.cross_validate(
         args=opts, train_func=cp.train.run_training
@@ -41,35 +54,136 @@ def predictdmpnn(opts: options.GnnOptions) -> None:
     Returns:
     - None
     """
+    threads = resources.configure_threads(opts.threads)
     # Load options and additional arguments from a JSON file
     arguments = createArgsFromJson(jsonFile=opts.configFile)
     opts = cp.args.PredictArgs().parse_args(arguments)
+    opts.num_workers = min(opts.num_workers, threads)
 
     cp.train.make_predictions(args=opts)
 
 
+def importDataChunks(
+    opts: options.Options,
+) -> Iterator[Tuple[pd.DataFrame, FeatureStore]]:
+    """
+    Imports the input file of the options and calculates its fingerprints. If opts.chunkSize
+    is positive, the file is streamed in chunks of that many rows, otherwise it is imported as
+    a whole. The format of the file is detected with fp.detectImportFunction.
+    :param opts: Options with the input file, fingerprint size, chunk size, cache, molecule
+        store, standardization and descriptor settings
+    :return: Iterator over the dataframe and the FeatureStore with the fingerprints and
+        descriptors of each chunk
+    """
+    # converted datasets are loaded without an import function
+    import_function = (
+        fp.importSmilesCSV
+        if fp.isConverted(opts.inputFile)
+        else fp.detectImportFunction(opts.inputFile)
+    )
+    cache = FingerprintCache(opts.cacheFile, opts.cacheSize) if opts.cacheFile else None
+    std = standardizer(opts.standardize, opts.standardizeCacheFile)
+    try:
+        if opts.chunkSize > 0:
+            yield from fp.iterDataFile(
+                opts.inputFile,
+                import_function=import_function,
+                fp_size=opts.fpSize,
+                chunk_size=opts.chunkSize,
+                cache=cache,
+                fp_type=opts.fpType,
+                counts=opts.fpCounts,
+                mol_store=molecule_store(opts.molStoreFile),
+                standardizer=std,
+                profile=opts.parseProfile,
+                descriptors=descriptorNames(opts.descriptors),
+            )
+        else:
+            yield fp.importDataFile(
+                opts.inputFile,
+                import_function=import_function,
+                fp_size=opts.fpSize,
+                cache=cache,
+                fp_type=opts.fpType,
+                counts=opts.fpCounts,
+                mol_store=molecule_store(opts.molStoreFile),
+                standardizer=std,
+                profile=opts.parseProfile,
+                descriptors=descriptorNames(opts.descriptors),
+            )
+    finally:
+        if cache is not None:
+            cache.close()
+        if std is not None:
+            std.close()
+
+
+def importData(opts: options.Options) -> Tuple[pd.DataFrame, FeatureStore]:
+    """
+    Imports the input file of the options as one dataset. Chunks of a streamed import are
+    collected so that only the packed fingerprints of the whole file are held in memory.
+    The training needs all rows at once, so its memory is not bounded by the chunk size.
+    :param opts: Options with the input file, fingerprint size, chunk size and cache settings
+    :return: The dataframe and the FeatureStore with the fingerprints
+    """
+    return fp.concatChunks(
+        importDataChunks(opts), opts.fpSize, opts.fpType, opts.fpCounts
+    )
+
+
+def filterBits(
+    features: FeatureStore, opts: options.Options
+) -> Tuple[FeatureStore, options.Options]:
+    """
+    Keeps the fingerprint bits whose frequency lies in the band of the options and saves
+    the kept bits next to the models that are trained on them.
+    :param features: FeatureStore with the fingerprints of the training data
+    :param opts: Options with the frequency band
+    :return: The projected FeatureStore and the options with the reduced fingerprint size
+    """
+    frequencies = bitfilter.bit_frequencies(features)
+    kept = bitfilter.select_bits(frequencies, opts.fpMinFrequency, opts.fpMaxFrequency)
+    logging.info(
+        f"Keeping {len(kept)} of {features.fp_size} bits with a frequency in "
+        f"[{opts.fpMinFrequency}, {opts.fpMaxFrequency}]"
+    )
+    if len(kept) == 0:
+        raise ValueError("No fingerprint bit lies in the frequency band")
+    for directory in [opts.outputDir] + ([opts.ecModelDir] if opts.trainAC else []):
+        logging.info(f"Saved bit filter {bitfilter.save(directory, kept, features)}")
+    return bitfilter.project(features, kept), dataclasses.replace(
+        opts, fpSize=len(kept)
+    )
+
+
 def train(opts: options.Options):
     """
     Run the main training procedure
     :param opts: Options defining the details of the training
     """
-    # import data from file and create DataFrame
-    if "tsv" in opts.inputFile:
-        df = fp.importDataFile(
-            opts.inputFile, import_function=fp.importDstoxTSV, fp_size=opts.fpSize
-        )
-    else:
-        df = fp.importDataFile(
-            opts.inputFile, import_function=fp.importSmilesCSV, fp_size=opts.fpSize
+    if descriptorNames(opts.descriptors) and opts.enableMultiLabel:
+        logging.warning(
+            "The multi-label models are trained on the fingerprints only, the descriptors "
+            f"{opts.descriptors!r} are not calculated"
         )
+        opts = dataclasses.replace(opts, descriptors="")
+    # import data from file and create DataFrame
+    df, features = importData(opts)
+    # predict checks that it calculates the fingerprints the models were trained on
+    for directory in [opts.outputDir] + ([opts.ecModelDir] if opts.trainAC else []):
+        fp.saveFingerprintRecord(directory, features)
+    if bitfilter.is_active(opts.fpMinFrequency, opts.fpMaxFrequency):
+        features, opts = filterBits(features, opts)
     # initialize (auto)encoders to None
     encoder = None
     autoencoder = None
     if opts.trainAC:
         if opts.aeType == "deterministic":
-            encoder, train_indices, test_indices = ac.train_full_ac(df, opts)
+            encoder, train_indices, test_indices = ac.train_full_ac(df, features, opts)
         elif opts.aeType == "variational":
-            encoder, train_indices, test_indices = vae.train_full_vae(df, opts)
+            encoder, train_indices, test_indices = vae.train_full_vae(
+                df, features, opts
+            )
         else:
             raise ValueError(f"Unknown autoencoder type: {opts.aeType}")
 
@@ -77,20 +191,22 @@ def train(opts: options.Options):
     if opts.compressFeatures:
         if not opts.trainAC:
             if opts.aeType == "variational":
-                (autoencoder, encoder) = vae.define_vae_model(opts=options.Options())
+                (autoencoder, encoder) = vae.define_vae_model(opts=opts)
             elif opts.aeType == "deterministic":
-                (autoencoder, encoder) = ac.define_ac_model(opts=options.Options())
+                (autoencoder, encoder) = ac.define_ac_model(opts=opts)
             else:
                 raise ValueError(f"Unknown autoencoder type: {opts.aeType}")
 
             if opts.ecWeightsFile != "":
                 encoder.load_weights(os.path.join(opts.ecModelDir, opts.ecWeightsFile))
         # compress the fingerprints using the autoencoder
-        df = ac.compress_fingerprints(df, encoder)
+        features = ac.compress_fingerprints(features, encoder)
+    features = sl.add_descriptor_input(features, opts)
     if opts.visualizeLatent and opts.trainAC:
         logging.info("Visualizing latent space")
         ac.visualize_fingerprints(
             df,
+            features,
             before_col="fp",
             after_col="fpcompressed",
             train_indices=train_indices,
@@ -99,11 +215,11 @@ def train(opts: options.Options):
         )
     # train single label models if requested
     if opts.trainFNN and not opts.enableMultiLabel:
-        sl.train_single_label_models(df=df, opts=opts)
+        sl.train_single_label_models(df=df, features=features, opts=opts)
 
     # train multi-label models if requested
     if opts.trainFNN and opts.enableMultiLabel:
-        fNN.train_nn_models_multi(df=df, opts=opts)
+        fNN.train_nn_models_multi(df=df, features=features, opts=opts)
 
 
 def predict(opts: options.Options) -> None:
@@ -111,42 +227,87 @@ def predict(opts: options.Options) -> None:
     Run prediction given specific options
     :param opts: Options defining the details of the prediction
     """
-    # import data from file and create DataFrame
-    if "tsv" in opts.inputFile:
-        df = fp.importDataFile(
-            opts.inputFile, import_function=fp.importDstoxTSV, fp_size=opts.fpSize
-        )
-    else:
-        df = fp.importDataFile(
-            opts.inputFile, import_function=fp.importSmilesCSV, fp_size=opts.fpSize
-        )
-
+    output_file = path.join(opts.outputDir, opts.outputFile)
+    # the training saves its fingerprint record and bit filter in its output directory,
+    # which holds the model
+    model_directories = [
+        opts.fnnModelDir,
+        path.dirname(path.normpath(opts.fnnModelDir)),
+    ] + ([opts.ecModelDir] if opts.compressFeatures else [])
+    bit_filter = bitfilter.find(model_directories)
+    encoder = None
     if opts.compressFeatures:
+        # the encoder was trained on the filtered fingerprints
+        encoder_opts = (
+            opts
+            if bit_filter is None
+            else dataclasses.replace(opts, fpSize=bitfilter.kept_size(bit_filter))
+        )
         # load trained model for autoencoder
         if opts.aeType == "deterministic":
-            (autoencoder, encoder) = ac.define_ac_model(opts=options.Options())
+            (autoencoder, encoder) = ac.define_ac_model(opts=encoder_opts)
         if opts.aeType == "variational":
-            (autoencoder, encoder) = vae.define_vae_model(opts=options.Options())
+            (autoencoder, encoder) = vae.define_vae_model(opts=encoder_opts)
         # Load trained model for autoencoder
         if opts.ecWeightsFile != "":
             encoder.load_weights(os.path.join(opts.ecModelDir, opts.ecWeightsFile))
         else:
             raise ValueError("No weights file specified for encoder")
-        df = ac.compress_fingerprints(df, encoder)
 
-    # Run predictions on the compressed fingerprints and store the results in a dataframe
-    df2 = predictions.predict_values(df=df, opts=opts)
+    model = None
+    write_header = True
+    # import data from file chunk by chunk, only one chunk is held in memory
+    for df, features in importDataChunks(opts):
+        if model is None:
+            fp.checkFingerprintRecord(
+                model_directories, features, fp.structure_column(df)
+            )
+        if bit_filter is not None:
+            features = bitfilter.apply(bit_filter, features)
+            opts = dataclasses.replace(opts, fpSize=features.fp_size)
+        if encoder is not None:
+            features = ac.compress_fingerprints(features, encoder)
+        features = sl.add_descriptor_input(features, opts)
+        if model is None:
+            model = predictions.load_prediction_model(features, opts)
 
-    # Extract the column names from the dataframe, excluding the 'fp' and 'fpcompressed' columns
-    names_columns = [c for c in df2.columns if c not in ["fp", "fpcompressed"]]
+        # Run predictions on the compressed fingerprints and store the results in a dataframe
+        df2 = predictions.predict_values(
+            df=df, features=features, opts=opts, model=model
+        )
 
-    # Save the predicted values to a CSV file in the output directory
-    df2[names_columns].to_csv(path_or_buf=path.join(opts.outputDir, opts.outputFile))
+        # mol blocks of SDF input span several lines, its molecules are identified by the
+        # name and data fields
+        df2 = df2.drop(columns="molblock", errors="ignore")
+        # Save the predicted values to a CSV file in the output directory
+        if not df2.empty:
+            df2.to_csv(
+                path_or_buf=output_file,
+                mode="w" if write_header else "a",
+                header=write_header,
+            )
+            write_header = False
+    if write_header:
+        pd.DataFrame().to_csv(path_or_buf=output_file)
 
     # Log successful completion of prediction and the file path where the results were saved
-    logging.info(
-        f"Prediction successful. Results written to '{path.join(opts.outputDir, opts.outputFile)}'"
+    logging.info(f"Prediction successful. Results written to '{output_file}'")
+
+
+def lookup(args: Namespace) -> None:
+    """
+    Writes the rows of a converted dataset that hold the requested identifiers as CSV,
+    with the packed (or count) fingerprint of each row as hex string
+    :param args: Command line arguments of the lookup mode
+    """
+    df, features = lookup_dataset(args.inputFile, args.ids, args.column)
+    if len(df) < len(set(args.ids)):
+        logging.warning(f"Found {len(df)} of {len(set(args.ids))} identifiers")
+    df = df.assign(
+        fp_valid=features.valid("fp"),
+        fp=[row.tobytes().hex() for row in dense_rows(features["fp"], slice(None))],
     )
+    df.to_csv(args.outputFile or sys.stdout)
 
 
 def createLogger(filename: str) -> None:
@@ -187,9 +348,39 @@ def main():
             if path.isdir(directory):
                 createLogger(path.join(directory, "convert.log"))
                 logging.info(f"Convert all data files in {directory}")
-                fp.convert_all(directory)
+                resources.configure_threads(prog_args.threads)
+                cache = (
+                    FingerprintCache(prog_args.cacheFile, prog_args.cacheSize)
+                    if prog_args.cacheFile
+                    else None
+                )
+                std = standardizer(
+                    prog_args.standardize, prog_args.standardizeCacheFile
+                )
+                try:
+                    fp.convert_all(
+                        directory,
+                        patterns=prog_args.pattern,
+                        cache=cache,
+                        chunk_size=prog_args.chunkSize,
+                        fp_type=prog_args.fpType,
+                        counts=prog_args.fpCounts,
+                        fp_size=prog_args.fpSize,
+                        parallel_files=prog_args.parallelFiles,
+                        mol_store=molecule_store(prog_args.molStoreFile),
+                        standardizer=std,
+                        profile=prog_args.parseProfile,
+                        descriptors=descriptorNames(prog_args.descriptors),
+                    )
+                finally:
+                    if cache is not None:
+                        cache.close()
+                    if std is not None:
+                        std.close()
             else:
                 raise ValueError("Input directory is not a directory")
+        elif prog_args.method == "lookup":
+            lookup(prog_args)
         elif prog_args.method == "traingnn":
             traingnn_opts = options.GnnOptions.fromCmdArgs(prog_args)
             createLogger("traingnn.log")
@@ -207,6 +398,7 @@ def main():
             logging.info(
                 f"The following arguments are received or filled with default values:\n{train_opts}"
             )
+            resources.configure_threads(train_opts.threads)
             train(train_opts)
         elif prog_args.method == "predict":
             predict_opts = options.Options.fromCmdArgs(prog_args)
@@ -225,6 +417,7 @@ def main():
             logging.info(
                 f"The following arguments are received or filled with default values:\n{prog_args}"
             )
+            resources.configure_threads(fixed_opts.threads)
             predict(fixed_opts)
     except AttributeError as e:
         print(e)
@@ -9,7 +9,6 @@ import pandas as pd
 import seaborn as sns
 import umap.umap_ as umap
 import wandb
-from sklearn.model_selection import train_test_split
 from tensorflow.keras import initializers, losses, optimizers
 from tensorflow.keras.layers import Dense, Input
 from tensorflow.keras.models import Model
@@ -17,7 +16,16 @@ from tensorflow.keras.models import Model
 from dfpl import callbacks
 from dfpl import history as ht
 from dfpl import options, settings
-from dfpl.utils import ae_scaffold_split, weight_split
+from dfpl.features import (
+    FeatureStore,
+    count_bits,
+    dense_rows,
+    fingerprint_width,
+    sum_scaled_counts,
+)
+from dfpl.layers import PackedAutoencoderSequence, decode_fingerprints
+from dfpl.molstore import molecule_store
+from dfpl.utils import ae_split_rows
 
 
 def define_ac_model(opts: options.Options, output_bias=None) -> Tuple[Model, Model]:
@@ -43,79 +51,50 @@ def define_ac_model(opts: options.Options, output_bias=None) -> Tuple[Model, Mod
         output_bias = initializers.Constant(output_bias)
 
     # get the number of meaningful hidden layers (latent space included)
-    hidden_layer_count = round(math.log2(input_size / encoding_dim))
-
-    # the input placeholder
-    input_vec = Input(shape=(input_size,))
-
-    # 1st hidden layer, that receives weights from input layer
-    # equals bottleneck layer, if hidden_layer_count==1!
-    if opts.aeActivationFunction != "selu":
-        encoded = Dense(
-            units=int(input_size / 2), activation=opts.aeActivationFunction
-        )(input_vec)
-    else:
-        encoded = Dense(
-            units=int(input_size / 2),
+    if not 0 < encoding_dim < input_size:
+        raise ValueError(
+            f"The encoded fingerprint size {encoding_dim} must be positive and smaller "
+            f"than the fingerprint size {input_size}"
+        )
+    hidden_layer_count = max(1, round(math.log2(input_size / encoding_dim)))
+    # the hidden layers halve the input, the bottle-neck layer has exactly encoding_dim
+    # units also if input_size is no power of two multiple of it
+    encoding_units = [
+        int(input_size / 2**i) for i in range(1, hidden_layer_count)
+    ] + [encoding_dim]
+
+    def dense(units: int) -> Dense:
+        if opts.aeActivationFunction != "selu":
+            return Dense(units=units, activation=opts.aeActivationFunction)
+        return Dense(
+            units=units,
             activation=opts.aeActivationFunction,
             kernel_initializer="lecun_normal",
-        )(input_vec)
-
-    if hidden_layer_count > 1:
-        # encoding layers, incl. bottle-neck
-        for i in range(1, hidden_layer_count):
-            factor_units = 2 ** (i + 1)
-            if opts.aeActivationFunction != "selu":
-                encoded = Dense(
-                    units=int(input_size / factor_units),
-                    activation=opts.aeActivationFunction,
-                )(encoded)
-            else:
-                encoded = Dense(
-                    units=int(input_size / factor_units),
-                    activation=opts.aeActivationFunction,
-                    kernel_initializer="lecun_normal",
-                )(encoded)
-
-        # 1st decoding layer
-        factor_units = 2 ** (hidden_layer_count - 1)
-        if opts.aeActivationFunction != "selu":
-            decoded = Dense(
-                units=int(input_size / factor_units),
-                activation=opts.aeActivationFunction,
-            )(encoded)
-        else:
-            decoded = Dense(
-                units=int(input_size / factor_units),
-                activation=opts.aeActivationFunction,
-                kernel_initializer="lecun_normal",
-            )(encoded)
-
-        # decoding layers
-        for i in range(hidden_layer_count - 2, 0, -1):
-            factor_units = 2**i
-            if opts.aeActivationFunction != "selu":
-                decoded = Dense(
-                    units=int(input_size / factor_units),
-                    activation=opts.aeActivationFunction,
-                )(decoded)
-            else:
-                decoded = Dense(
-                    units=int(input_size / factor_units),
-                    activation=opts.aeActivationFunction,
-                    kernel_initializer="lecun_normal",
-                )(decoded)
-
-        # output layer
-        decoded = Dense(
-            units=input_size, activation="sigmoid", bias_initializer=output_bias
-        )(decoded)
+        )
 
-    else:
-        # output layer
-        decoded = Dense(
-            units=input_size, activation="sigmoid", bias_initializer=output_bias
-        )(encoded)
+    # the input placeholder for the packed fingerprints which are unpacked batch-wise,
+    # count fingerprints are scaled batch-wise
+    input_vec = Input(
+        shape=(fingerprint_width(input_size, opts.fpCounts),),
+        dtype=settings.ac_fp_numpy_type,
+    )
+    input_bits = decode_fingerprints(input_size, opts.fpCounts)(input_vec)
+
+    # encoding layers, incl. bottle-neck
+    # the 1st hidden layer equals the bottle-neck layer, if hidden_layer_count==1!
+    encoded = input_bits
+    for units in encoding_units:
+        encoded = dense(units)(encoded)
+
+    # decoding layers mirror the encoding layers
+    decoded = encoded
+    for units in reversed(encoding_units[:-1]):
+        decoded = dense(units)(decoded)
+
+    # output layer
+    decoded = Dense(
+        units=input_size, activation="sigmoid", bias_initializer=output_bias
+    )(decoded)
 
     autoencoder = Model(input_vec, decoded)
     encoder = Model(input_vec, encoded)
@@ -133,14 +112,17 @@ def define_ac_model(opts: options.Options, output_bias=None) -> Tuple[Model, Mod
     return autoencoder, encoder
 
 
-def train_full_ac(df: pd.DataFrame, opts: options.Options) -> Model:
+def train_full_ac(
+    df: pd.DataFrame, features: FeatureStore, opts: options.Options
+) -> Model:
     """
     Trains an autoencoder on the given feature matrix X. The response matrix is only used to
     split the data into meaningful test and train sets.
 
     :param opts: Command line arguments as defined in options.py
     :param df: Pandas dataframe that contains the SMILES/InChI data for training the autoencoder
-    :return: The encoder model of the trained autoencoder
+    :param features: FeatureStore holding the packed fingerprints of df
+    :return: The encoder model of the trained autoencoder and the index labels of the training and test data
     """
 
     # If wandb tracking is enabled for autoencoder weights but not for the main program, initialize a new wandb run
@@ -151,125 +133,73 @@ def train_full_ac(df: pd.DataFrame, opts: options.Options) -> Model:
     save_path = os.path.join(opts.ecModelDir, "autoencoder_weights.h5")
     # Collect the callbacks for training
 
-    # Select all fingerprints that are valid and turn them into a numpy array
-    fp_matrix = np.array(
-        df[df["fp"].notnull()]["fp"].to_list(),
-        dtype=settings.ac_fp_numpy_type,
-        copy=settings.numpy_copy_values,
-    )
+    # The fingerprints stay in the FeatureStore, the splits only select row positions
+    fp_matrix = features["fp"]
     logging.info(
         f"Training AC on a matrix of shape {fp_matrix.shape} with type {fp_matrix.dtype}"
     )
 
     # When training the final AE, we don't want any test data. We want to train it on all available fingerprints.
     assert 0.0 <= opts.testSize <= 0.5
-    if opts.aeSplitType == "random":
-        logging.info("Training autoencoder using random split")
-        initial_indices = np.arange(fp_matrix.shape[0])
-        if opts.testSize > 0.0:
-            # Split data into test and training data
-            if opts.aeWabTracking:
-                x_train, x_test, train_indices, test_indices = train_test_split(
-                    fp_matrix, initial_indices, test_size=opts.testSize, random_state=42
-                )
-            else:
-                x_train, x_test, train_indices, test_indices = train_test_split(
-                    fp_matrix, initial_indices, test_size=opts.testSize, random_state=42
-                )
-        else:
-            x_train = fp_matrix
-            x_test = None
-    elif opts.aeSplitType == "scaffold_balanced":
-        logging.info("Training autoencoder using scaffold split")
-        train_indices = np.arange(fp_matrix.shape[0])
-        if opts.testSize > 0.0:
-            train_data, val_data, test_data = ae_scaffold_split(
-                df,
-                sizes=(1 - opts.testSize, 0.0, opts.testSize),
-                balanced=True,
-                seed=42,
-            )
-            x_train = np.array(
-                train_data[train_data["fp"].notnull()]["fp"].to_list(),
-                dtype=settings.ac_fp_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            x_test = np.array(
-                test_data[test_data["fp"].notnull()]["fp"].to_list(),
-                dtype=settings.ac_fp_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            train_indices = df[
-                df.index.isin(train_data[train_data["fp"].notnull()].index)
-            ].index.to_numpy()
-            test_indices = df[
-                df.index.isin(test_data[test_data["fp"].notnull()].index)
-            ].index.to_numpy()
-        else:
-            x_train = fp_matrix
-            x_test = None
-    elif opts.aeSplitType == "molecular_weight":
-        logging.info("Training autoencoder using molecular weight split")
-        train_indices = np.arange(fp_matrix.shape[0])
-        if opts.testSize > 0.0:
-            train_data, val_data, test_data = weight_split(
-                df, sizes=(1 - opts.testSize, 0.0, opts.testSize), bias="small"
-            )
-            x_train = np.array(
-                train_data[train_data["fp"].notnull()]["fp"].to_list(),
-                dtype=settings.ac_fp_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            x_test = np.array(
-                test_data[test_data["fp"].notnull()]["fp"].to_list(),
-                dtype=settings.ac_fp_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            df_sorted = df.sort_values(by="mol_weight", ascending=True)
-            # Get the sorted indices from the sorted DataFrame
-            sorted_indices = df_sorted.index.to_numpy()
-
-            # Find the corresponding indices for train_data, val_data, and test_data in the sorted DataFrame
-            train_indices = sorted_indices[df.index.isin(train_data.index)]
-            # val_indices = sorted_indices[df.index.isin(val_data.index)]
-            test_indices = sorted_indices[df.index.isin(test_data.index)]
-        else:
-            x_train = fp_matrix
-            x_test = None
-    else:
-        raise ValueError(f"Invalid split type: {opts.split_type}")
+    logging.info(f"Training autoencoder using {opts.aeSplitType} split")
+    train_rows, test_rows = ae_split_rows(
+        df,
+        features,
+        opts.aeSplitType,
+        opts.testSize,
+        mol_store=molecule_store(opts.molStoreFile),
+    )
+    train_indices = features.index[train_rows].to_numpy()
+    test_indices = features.index[test_rows].to_numpy()
 
-    # Calculate the initial bias aka the log ratio between 1's and 0'1 in all fingerprints
-    ids, counts = np.unique(x_train.flatten(), return_counts=True)
-    count_dict = dict(zip(ids, counts))
-    if count_dict[0] == 0:
+    # Calculate the initial bias aka the log ratio between 1's and 0'1 in all fingerprints.
+    # For count fingerprints the scaled counts are the reconstruction targets.
+    if opts.fpCounts:
+        ones = sum_scaled_counts(fp_matrix, train_rows)
+    else:
+        ones = count_bits(fp_matrix, train_rows)
+    zeros = len(train_rows) * opts.fpSize - ones
+    if zeros == 0:
         initial_bias = None
         logging.info("No zeroes in training labels. Setting initial_bias to None.")
     else:
-        initial_bias = np.log([count_dict[1] / count_dict[0]])
+        initial_bias = np.log([ones / zeros])
         logging.info(f"Initial bias for last sigmoid layer: {initial_bias[0]}")
 
     # Check if we're doing training/testing mode or full training mode
     if opts.testSize > 0.0:
         logging.info(f"AE training/testing mode with train- and test-samples")
-        logging.info(f"AC train data shape {x_train.shape} with type {x_train.dtype}")
-        logging.info(f"AC test data shape {x_test.shape} with type {x_test.dtype}")
+        logging.info(f"AC train data has {len(train_rows)} samples")
+        logging.info(f"AC test data has {len(test_rows)} samples")
     else:
         logging.info(f"AE full train mode without test-samples")
-        logging.info(f"AC train data shape {x_train.shape} with type {x_train.dtype}")
+        logging.info(f"AC train data has {len(train_rows)} samples")
 
     # Set up the model of the AC w.r.t. the input size and the dimension of the bottle neck (z!)
     (autoencoder, encoder) = define_ac_model(opts, output_bias=initial_bias)
     callback_list = callbacks.autoencoder_callback(checkpoint_path=save_path, opts=opts)
-    # Train the autoencoder on the training data
+    # Train the autoencoder on the training data. The packed fingerprints are unpacked per batch
     auto_hist = autoencoder.fit(
-        x_train,
-        x_train,
+        PackedAutoencoderSequence(
+            fp_matrix,
+            opts.fpSize,
+            opts.aeBatchSize,
+            rows=train_rows,
+            counts=opts.fpCounts,
+        ),
         callbacks=[callback_list],
         epochs=opts.aeEpochs,
-        batch_size=opts.aeBatchSize,
         verbose=opts.verbose,
-        validation_data=(x_test, x_test) if opts.testSize > 0.0 else None,
+        validation_data=PackedAutoencoderSequence(
+            fp_matrix,
+            opts.fpSize,
+            opts.aeBatchSize,
+            shuffle=False,
+            rows=test_rows,
+            counts=opts.fpCounts,
+        )
+        if opts.testSize > 0.0
+        else None,
     )
 
     # Store the autoencoder training history and plot the metrics
@@ -287,33 +217,37 @@ def train_full_ac(df: pd.DataFrame, opts: options.Options) -> Model:
     return encoder, train_indices, test_indices
 
 
-def compress_fingerprints(dataframe: pd.DataFrame, encoder: Model) -> pd.DataFrame:
+def compress_fingerprints(features: FeatureStore, encoder: Model) -> FeatureStore:
     """
-    Adds a column of the compressed version of the fingerprints to the original dataframe.
+    Adds the compressed version of the fingerprints as feature "fpcompressed" to the FeatureStore.
 
-    :param dataframe: Dataframe containing a column named 'fp' with the fingerprints
+    :param features: FeatureStore holding the packed fingerprints
     :param encoder: The trained autoencoder that is used for compressing the fingerprints
-    :return: The input dataframe extended by a column containing the compressed version of the fingerprints
+    :return: The input FeatureStore extended by the compressed fingerprints
     """
     logging.info("Adding compressed fingerprints")
-    idx = dataframe[dataframe["fp"].notnull()].index
-    fp_matrix = np.array(
-        dataframe[dataframe["fp"].notnull()]["fp"].to_list(),
-        dtype=settings.ac_fp_numpy_type,
-        copy=settings.numpy_copy_values,
-    )
+    fp_matrix = features["fp"]
+    valid = features.valid("fp")
+    rows = np.flatnonzero(valid)
     logging.info(
         f"Using input matrix of shape {fp_matrix.shape} with type {fp_matrix.dtype}"
     )
-    logging.info("Compressed fingerprints are added to input dataframe.")
-    dataframe["fpcompressed"] = pd.DataFrame(
-        {"fpcompressed": [s for s in encoder.predict(fp_matrix)]}, idx
+    compressed = np.zeros(
+        (len(features), encoder.output_shape[-1]),
+        dtype=settings.nn_fp_compressed_numpy_type,
     )
-    return dataframe
+    # Compress chunk-wise so that only one chunk of fingerprints is gathered at a time
+    for start in range(0, len(rows), settings.compress_chunk_size):
+        chunk = rows[start : start + settings.compress_chunk_size]
+        compressed[chunk] = encoder.predict(dense_rows(fp_matrix, chunk))
+    features.set("fpcompressed", compressed, valid.copy())
+    logging.info("Compressed fingerprints are added to the feature store.")
+    return features
 
 
 def visualize_fingerprints(
     df: pd.DataFrame,
+    features: FeatureStore,
     before_col: str,
     after_col: str,
     train_indices: np.ndarray,
@@ -336,11 +270,6 @@ def visualize_fingerprints(
     # Concatenate the sampled train and test data
     df_sampled = pd.concat([train_data_sampled, test_data_sampled])
 
-    # Convert the boolean values in the after_col column to floats
-    df_sampled[after_col] = df_sampled[after_col].apply(
-        lambda x: np.array(x, dtype=float)
-    )
-
     df_sampled.loc[train_data_sampled.index, "set"] = "train"
     df_sampled.loc[test_data_sampled.index, "set"] = "test"
     # Apply UMAP
@@ -348,7 +277,9 @@ def visualize_fingerprints(
         n_neighbors=15, min_dist=0.1, metric="euclidean", random_state=42
     )
     # Filter out the rows with invalid arrays
-    umap_results = umap_model.fit_transform(df_sampled[after_col].tolist())
+    umap_results = umap_model.fit_transform(
+        features.get(after_col, df_sampled.index).astype(float)
+    )
     # Add UMAP results to the DataFrame
     df_sampled["umap_x"] = umap_results[:, 0]
     df_sampled["umap_y"] = umap_results[:, 1]
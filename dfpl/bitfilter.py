@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Unsupervised selection of fingerprint bits by their frequency in the training data.
+
+Bits that are (nearly) always off or always on carry little information but are full
+input columns of the networks. The bit filter keeps only the bits whose frequency lies
+in a band and is saved next to the trained models, so that predict projects the
+fingerprints onto the same bits.
+"""
+import logging
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+
+from dfpl import settings
+from dfpl.features import (
+    FeatureMatrix,
+    FeatureStore,
+    SparseFingerprints,
+    dense_rows,
+    pack_fingerprints,
+    packed_width,
+    structure_features,
+    unpack_fingerprints,
+    use_sparse,
+)
+
+file_name = "bit_filter.npz"
+
+
+def bit_frequencies(
+    features: FeatureStore, chunk_size: int = settings.compress_chunk_size
+) -> np.ndarray:
+    """
+    Fraction of the valid fingerprints in which each position is set, calculated in one
+    pass over chunks of rows. Count fingerprints count as set where the count is positive.
+    :param features: FeatureStore holding the fingerprints
+    :param chunk_size: Number of rows that are unpacked at once
+    :return: float64 array with one frequency per position
+    """
+    matrix = features["fp"]
+    rows = np.flatnonzero(features.valid("fp"))
+    if len(rows) == 0:
+        return np.zeros(features.fp_size)
+    if isinstance(matrix, SparseFingerprints):
+        selected = matrix[rows]
+        ones = np.bincount(
+            selected.indices[: selected.indptr[-1]], minlength=features.fp_size
+        )
+        return ones / len(rows)
+    ones = np.zeros(features.fp_size, dtype=np.int64)
+    for start in range(0, len(rows), chunk_size):
+        chunk = matrix[rows[start : start + chunk_size]]
+        if features.counts:
+            ones += (chunk > 0).sum(axis=0)
+        else:
+            bits = unpack_fingerprints(chunk, features.fp_size, np.uint8)
+            ones += bits.sum(axis=0, dtype=np.int64)
+    return ones / len(rows)
+
+
+def select_bits(
+    frequencies: np.ndarray, min_frequency: float, max_frequency: float
+) -> np.ndarray:
+    """
+    Positions whose frequency lies in [min_frequency, max_frequency]
+    :return: Sorted int64 array of the kept positions
+    """
+    return np.flatnonzero(
+        (frequencies >= min_frequency) & (frequencies <= max_frequency)
+    )
+
+
+def is_active(min_frequency: float, max_frequency: float) -> bool:
+    """Whether a frequency band can remove bits at all"""
+    return min_frequency > 0.0 or max_frequency < 1.0
+
+
+def _project_matrix(
+    matrix: FeatureMatrix,
+    fp_size: int,
+    kept: np.ndarray,
+    counts: bool,
+    chunk_size: int = settings.compress_chunk_size,
+) -> FeatureMatrix:
+    if counts:
+        return np.asarray(matrix)[:, kept]
+    if isinstance(matrix, SparseFingerprints):
+        # new position of each old position, -1 for removed bits
+        new_position = np.full(fp_size, -1, dtype=np.int64)
+        new_position[kept] = np.arange(len(kept))
+        mapped = new_position[matrix.indices[matrix.indptr[0] : matrix.indptr[-1]]]
+        keep = mapped >= 0
+        rows = np.repeat(np.arange(len(matrix)), np.diff(matrix.indptr))[keep]
+        indptr = np.zeros(len(matrix) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(matrix)), out=indptr[1:])
+        projected = SparseFingerprints(
+            indptr,
+            mapped[keep].astype(SparseFingerprints.index_dtype(len(kept))),
+            len(kept),
+        )
+        return projected if use_sparse(len(kept)) else projected.to_packed()
+    projected = np.zeros((matrix.shape[0], packed_width(len(kept))), dtype=np.uint8)
+    for start in range(0, matrix.shape[0], chunk_size):
+        bits = unpack_fingerprints(
+            dense_rows(matrix, slice(start, start + chunk_size)), fp_size
+        )
+        projected[start : start + len(bits)] = pack_fingerprints(bits[:, kept])
+    return projected
+
+
+def project(features: FeatureStore, kept: np.ndarray) -> FeatureStore:
+    """
+    A store whose fingerprints only hold the kept positions, in their original order.
+    Other features than features.structure_features are not taken over.
+    :param features: FeatureStore holding the fingerprints
+    :param kept: Positions to keep, see select_bits
+    """
+    return FeatureStore(
+        features.index,
+        _project_matrix(features["fp"], features.fp_size, kept, features.counts),
+        features.valid("fp"),
+        len(kept),
+        features.fp_type,
+        features.counts,
+    ).take_over(features, structure_features)
+
+
+def save(directory: str, kept: np.ndarray, features: FeatureStore) -> str:
+    """
+    Saves the kept positions and the fingerprint they apply to into directory
+    :return: Path of the saved file
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, file_name)
+    np.savez(
+        path,
+        kept=kept,
+        fp_size=features.fp_size,
+        fp_type=str(features.fp_type),
+        counts=features.counts,
+    )
+    return path
+
+
+def find(directories: Iterable[str]) -> Optional[str]:
+    """The first bit filter file in directories, None if there is none"""
+    for directory in directories:
+        path = os.path.join(directory, file_name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def kept_size(path: str) -> int:
+    """Number of bits a saved filter keeps, the fingerprint size of the filtered features"""
+    with np.load(path) as saved:
+        return len(saved["kept"])
+
+
+def apply(path: str, features: FeatureStore) -> FeatureStore:
+    """
+    Projects features onto the bits of a saved filter
+    :param path: Bit filter file written by save
+    :param features: FeatureStore with the fingerprints the filter was selected on
+    :return: The projected FeatureStore
+    """
+    with np.load(path) as saved:
+        if (
+            int(saved["fp_size"]) != features.fp_size
+            or str(saved["fp_type"]) != str(features.fp_type)
+            or bool(saved["counts"]) != features.counts
+        ):
+            raise ValueError(
+                f"The bit filter {path} was selected on {saved['fp_type']} fingerprints of "
+                f"{saved['fp_size']} {'counts' if saved['counts'] else 'bits'}"
+            )
+        kept = saved["kept"]
+    logging.info(f"Keeping {len(kept)} of {features.fp_size} bits of filter {path}")
+    return project(features, kept)
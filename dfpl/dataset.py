@@ -0,0 +1,627 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mappable on-disk dataset format written by `dfpl convert`.
+
+A dataset is a directory holding
+- meta.json: number of rows, fingerprint size and type, the settings the fingerprints
+  were calculated with and the table columns
+- fp.npy / fp_valid.npy: the packed fingerprint matrix and its validity flags. Wide bit
+  fingerprints (see dfpl.features.use_sparse) are stored as fp_indptr.npy and
+  fp_indices.npy instead, the arrays of dfpl.features.SparseFingerprints
+- index.npy: the index of the dataframe
+- row_hash.npy: optionally a 64 bit hash of the structure of each row, which lets a
+  conversion reuse the fingerprints of unchanged rows
+- one .npy file per numeric column (int64 or uint64 for integer columns, float64 for
+  all others), and a data/offsets/null triple per string column
+  holding the UTF-8 bytes of all strings, their start offsets and missing values
+- a .keys.npy hash table per identifier column (see key_columns) that maps the hash of
+  an identifier to its row, so that single compounds are found without loading the
+  dataset, see KeyIndex
+
+All arrays are opened with np.load(mmap_mode="r"), so the fingerprints are not read
+into memory on startup and their pages are shared between jobs on the same node.
+"""
+import json
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dfpl.features import FeatureStore, SparseFingerprints, dense_rows, use_sparse
+
+format_version = 1
+dataset_extension = ".dfpl"
+
+# Number of bytes that are copied at once when finishing an array file
+_copy_block_size = 64 * 1024 * 1024
+
+# Columns holding compound identifiers or InChIKeys (compared in lower case) that get a
+# key index, see KeyIndex
+key_columns = ["id", "cid", "toxid", "key", "inchikey"]
+
+# Slot of a key index: hash of the identifier and its row, -1 for empty slots
+_slot_dtype = np.dtype([("hash", np.uint64), ("row", np.int64)])
+
+
+def is_dataset(path: str) -> bool:
+    """Whether path is a dataset directory written by DatasetWriter"""
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, "meta.json"))
+
+
+def _key_strings(values: Sequence) -> List[Optional[str]]:
+    """
+    Identifiers as strings, None for missing values. Integral numbers are written without
+    decimals, so that a CID read as float because of missing values matches "2244".
+    """
+    keys = []
+    for value in values:
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            keys.append(None)
+        elif isinstance(value, (float, np.floating)) and float(value).is_integer():
+            keys.append(str(int(value)))
+        else:
+            keys.append(str(value))
+    return keys
+
+
+def _key_hashes(keys: List[Optional[str]]) -> np.ndarray:
+    """64 bit hashes of identifiers, never 0 which marks missing identifiers"""
+    missing = np.array([key is None for key in keys], dtype=bool)
+    hashes = pd.util.hash_array(
+        np.array(["" if key is None else key for key in keys], dtype=object)
+    )
+    hashes[hashes == 0] = 1
+    hashes[missing] = 0
+    return hashes
+
+
+def _hash_table(hashes: np.ndarray) -> np.ndarray:
+    """
+    Open addressing hash table with linear probing that maps hashes to their row. It has
+    at least twice as many slots as rows, so that a lookup probes few slots. Of rows with
+    the same identifier, the first one is found first.
+    :param hashes: Hash of the identifier of each row, 0 for rows without identifier
+    :return: Array of _slot_dtype whose length is a power of two
+    """
+    rows = np.flatnonzero(hashes)
+    size = 1 << max(1, int(2 * len(rows)).bit_length())
+    mask = np.uint64(size - 1)
+    table = np.zeros(size, dtype=_slot_dtype)
+    table["row"] = -1
+    slots = (hashes[rows] & mask).astype(np.int64)
+    pending = np.arange(len(rows))
+    while len(pending) > 0:
+        free = pending[table["row"][slots[pending]] < 0]
+        # of the rows probing the same free slot, the first one takes it
+        taken, first = np.unique(slots[free], return_index=True)
+        winners = free[first]
+        table["hash"][taken] = hashes[rows[winners]]
+        table["row"][taken] = rows[winners]
+        pending = np.setdiff1d(pending, winners, assume_unique=True)
+        slots[pending] = (slots[pending] + 1) % size
+    return table
+
+
+class _ArrayFile:
+    """
+    Appends rows of a fixed dtype and row shape to a raw file and turns it into a .npy
+    file when finished, so that arrays of unknown length can be written chunk by chunk.
+    """
+
+    def __init__(self, path: str, dtype: np.dtype, row_shape: Tuple[int, ...] = ()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = row_shape
+        self.rows = 0
+        self.file = open(path + ".tmp", "wb")
+
+    def append(self, values: np.ndarray) -> None:
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        self.file.write(values.tobytes())
+        self.rows += values.shape[0]
+
+    def convert(self, dtype: np.dtype) -> None:
+        """Converts the rows appended so far to another dtype"""
+        self.file.close()
+        values = np.fromfile(self.path + ".tmp", dtype=self.dtype)
+        self.dtype = np.dtype(dtype)
+        self.file = open(self.path + ".tmp", "wb")
+        self.file.write(values.astype(self.dtype).tobytes())
+
+    def finish(self) -> None:
+        self.file.close()
+        target = np.lib.format.open_memmap(
+            self.path, mode="w+", dtype=self.dtype, shape=(self.rows,) + self.row_shape
+        )
+        if target.size > 0:
+            flat = target.reshape(-1).view(np.uint8)
+            with open(self.path + ".tmp", "rb") as source:
+                for start in range(0, flat.size, _copy_block_size):
+                    block = source.read(_copy_block_size)
+                    flat[start : start + len(block)] = np.frombuffer(block, np.uint8)
+            target.flush()
+        del target
+        os.remove(self.path + ".tmp")
+
+
+class DatasetWriter:
+    """
+    Writes a dataframe and its FeatureStore chunk by chunk into a dataset directory.
+    Integer columns are stored as int64 (uint64 if they are unsigned 64 bit integers), so
+    that large identifiers keep every digit. They are converted to float64 if a later chunk
+    holds other numbers, like other numeric columns. All other columns are stored as
+    strings. The dataset is written next to the target directory and
+    only replaces an existing dataset when it is closed.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        fp_size: int,
+        fp_type: Optional[str] = None,
+        counts: bool = False,
+        fingerprint_settings: Optional[Dict[str, str]] = None,
+    ):
+        """
+        :param directory: Target directory of the dataset
+        :param fp_size: Number of bits of the fingerprints
+        :param fp_type: Type of the fingerprints
+        :param counts: Whether the fingerprints are counts
+        :param fingerprint_settings: Further settings the fingerprints were calculated
+            with, e.g. the standardization. Fingerprints are only reused by a conversion
+            with the same settings, see open_stored_fingerprints.
+        """
+        self.target = directory.rstrip(os.sep)
+        self.directory = self.target + ".partial"
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+        self.fp_size = fp_size
+        self.fp_type = fp_type
+        self.counts = counts
+        self.fingerprint_settings = fingerprint_settings or {}
+        self.sparse = use_sparse(fp_size, counts)
+        self.fp = None
+        self.fp_indices = None
+        self.row_hash = None
+        self.fp_valid = _ArrayFile(self._path("fp_valid"), np.bool_)
+        self.index = _ArrayFile(self._path("index"), np.int64)
+        self.columns: List[Dict] = []
+        self.files: List[Dict[str, _ArrayFile]] = []
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name + ".npy")
+
+    def _add_column(self, name: str, series: pd.Series) -> None:
+        i = len(self.columns)
+        dtype = None
+        if pd.api.types.is_integer_dtype(series):
+            kind = "int"
+            dtype = np.uint64 if series.dtype == np.uint64 else np.int64
+            files = {"values": _ArrayFile(self._path(f"column_{i}"), dtype)}
+        elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(
+            series
+        ):
+            kind = "float"
+            files = {"values": _ArrayFile(self._path(f"column_{i}"), np.float64)}
+        else:
+            kind = "string"
+            files = {
+                "data": _ArrayFile(self._path(f"column_{i}.data"), np.uint8),
+                "offsets": _ArrayFile(self._path(f"column_{i}.offsets"), np.int64),
+                "null": _ArrayFile(self._path(f"column_{i}.null"), np.bool_),
+            }
+            files["offsets"].append(np.zeros(1, np.int64))
+        column = {"name": name, "kind": kind}
+        if dtype is not None:
+            column["dtype"] = np.dtype(dtype).name
+        if name.lower() in key_columns:
+            column["key_index"] = True
+            files["key_hash"] = _ArrayFile(
+                self._path(f"column_{i}.key_hash"), np.uint64
+            )
+        self.columns.append(column)
+        self.files.append(files)
+
+    def append(
+        self,
+        df: pd.DataFrame,
+        features: FeatureStore,
+        row_hash: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        Appends a chunk. All chunks need the same columns.
+        :param df: Identifiers and targets of the chunk
+        :param features: FeatureStore aligned to df
+        :param row_hash: Optional uint64 hash of the structure of each row. It needs to be
+            given for all chunks or none.
+        """
+        if self.fp is None:
+            for name in df.columns:
+                self._add_column(name, df[name])
+            if self.sparse:
+                self.fp = _ArrayFile(self._path("fp_indptr"), np.int64)
+                self.fp.append(np.zeros(1, np.int64))
+                self.fp_indices = _ArrayFile(
+                    self._path("fp_indices"),
+                    SparseFingerprints.index_dtype(self.fp_size),
+                )
+            else:
+                self.fp = _ArrayFile(
+                    self._path("fp"), np.uint8, features["fp"].shape[1:]
+                )
+            if row_hash is not None:
+                self.row_hash = _ArrayFile(self._path("row_hash"), np.uint64)
+        if [column["name"] for column in self.columns] != list(df.columns):
+            raise ValueError("All chunks of a dataset need the same columns")
+        if (row_hash is None) != (self.row_hash is None):
+            raise ValueError("Row hashes need to be given for all chunks or none")
+        if row_hash is not None:
+            self.row_hash.append(row_hash)
+        fp = features.get("fp", df.index)
+        if self.sparse:
+            if not isinstance(fp, SparseFingerprints):
+                fp = SparseFingerprints.from_packed(fp, self.fp_size)
+            self.fp.append(fp.indptr[1:] - fp.indptr[0] + self.fp_indices.rows)
+            self.fp_indices.append(fp.indices[fp.indptr[0] : fp.indptr[-1]])
+        else:
+            self.fp.append(fp)
+        self.fp_valid.append(features.valid("fp", df.index))
+        self.index.append(df.index.to_numpy())
+        for column, files in zip(self.columns, self.files):
+            series = df[column["name"]]
+            if "key_hash" in files:
+                files["key_hash"].append(_key_hashes(_key_strings(series)))
+            if column["kind"] == "string":
+                null = series.isna().to_numpy()
+                encoded = [
+                    b"" if missing else str(value).encode()
+                    for value, missing in zip(series, null)
+                ]
+                lengths = np.fromiter(map(len, encoded), np.int64, len(encoded))
+                end = files["data"].rows
+                files["data"].append(np.frombuffer(b"".join(encoded), np.uint8))
+                files["offsets"].append(end + np.cumsum(lengths))
+                files["null"].append(null)
+            else:
+                if not pd.api.types.is_numeric_dtype(
+                    series
+                ) and not pd.api.types.is_bool_dtype(series):
+                    raise ValueError(
+                        f"Column {column['name']} changes its type between chunks"
+                    )
+                if column["kind"] == "int" and not pd.api.types.is_integer_dtype(
+                    series
+                ):
+                    column["kind"] = "float"
+                    del column["dtype"]
+                    files["values"].convert(np.float64)
+                files["values"].append(series.to_numpy(files["values"].dtype))
+
+    def close(self) -> None:
+        """
+        Finishes all array files, writes meta.json and moves the dataset to its target
+        directory. A previous dataset in the target directory is replaced.
+        """
+        for array in [
+            self.fp,
+            self.fp_indices,
+            self.fp_valid,
+            self.index,
+            self.row_hash,
+        ]:
+            if array is not None:
+                array.finish()
+        for i, files in enumerate(self.files):
+            for array in files.values():
+                array.finish()
+            if "key_hash" in files:
+                hashes = np.load(files["key_hash"].path)
+                np.save(self._path(f"column_{i}.keys"), _hash_table(hashes))
+                os.remove(files["key_hash"].path)
+        meta = {
+            "format": format_version,
+            "rows": self.index.rows,
+            "fp_size": self.fp_size,
+            "fp_type": self.fp_type,
+            "counts": self.counts,
+            "fingerprint_settings": self.fingerprint_settings,
+            "sparse": self.sparse,
+            "row_hash": self.row_hash is not None,
+            "columns": self.columns,
+        }
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=1)
+        _replace_directory(self.directory, self.target)
+
+
+def _replace_directory(source: str, target: str) -> None:
+    """
+    Renames source to target. An existing target is renamed out of the way first, so that
+    target is never a partially written directory. Processes that still have files of
+    the old directory memory-mapped keep reading them.
+    """
+    if not os.path.exists(target):
+        os.rename(source, target)
+        return
+    old = target + ".old"
+    if os.path.exists(old):
+        shutil.rmtree(old)
+    os.rename(target, old)
+    os.rename(source, target)
+    shutil.rmtree(old)
+
+
+def save_dataset(directory: str, df: pd.DataFrame, features: FeatureStore) -> None:
+    """Writes a dataframe and its FeatureStore into a dataset directory"""
+    writer = DatasetWriter(
+        directory, features.fp_size, features.fp_type, features.counts
+    )
+    writer.append(df, features)
+    writer.close()
+
+
+class StoredFingerprints:
+    """
+    Fingerprints of an existing dataset looked up by the hash of the structure of a row.
+    Used to only calculate the fingerprints of added or changed rows when a data file is
+    converted again.
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: Dataset directory written with row hashes
+        """
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.fp = _load_fingerprints(directory, json.load(f))
+        self.valid = np.load(os.path.join(directory, "fp_valid.npy"), mmap_mode="r")
+        row_hash = np.load(os.path.join(directory, "row_hash.npy"))
+        self.order = np.argsort(row_hash, kind="stable")
+        self.sorted_hash = row_hash[self.order]
+
+    def lookup(self, row_hash: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :param row_hash: Hashes of the structures to look up
+        :return: Matrix of packed fingerprints, boolean array marking valid fingerprints and
+            boolean array marking the hashes that were found
+        """
+        positions = np.searchsorted(self.sorted_hash, row_hash)
+        positions[positions == len(self.sorted_hash)] = 0
+        found = (
+            self.sorted_hash[positions] == row_hash
+            if len(self.sorted_hash) > 0
+            else np.zeros(len(row_hash), bool)
+        )
+        rows = self.order[positions[found]]
+        fp = np.zeros((len(row_hash),) + self.fp.shape[1:], dtype=np.uint8)
+        valid = np.zeros(len(row_hash), dtype=bool)
+        # gather in increasing row order to read the memory-mapped file sequentially
+        row_order = np.argsort(rows, kind="stable")
+        found_rows = np.flatnonzero(found)[row_order]
+        fp[found_rows] = dense_rows(self.fp, rows[row_order])
+        valid[found_rows] = self.valid[rows[row_order]]
+        return fp, valid, found
+
+
+def open_stored_fingerprints(
+    directory: str,
+    fp_size: int,
+    fp_type: Optional[str],
+    counts: bool = False,
+    fingerprint_settings: Optional[Dict[str, str]] = None,
+) -> Optional[StoredFingerprints]:
+    """
+    Opens the fingerprints of an existing dataset for reuse.
+    :param directory: Dataset directory
+    :param fp_size: Number of bits of the fingerprints that are needed
+    :param fp_type: Type of the fingerprints that are needed
+    :param counts: Whether count fingerprints are needed
+    :param fingerprint_settings: Further settings of the fingerprints that are needed, see
+        DatasetWriter
+    :return: The stored fingerprints, or None if there is no dataset with row hashes and
+        matching fingerprints in directory
+    """
+    if not is_dataset(directory):
+        return None
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    if (
+        meta["format"] != format_version
+        or not meta.get("row_hash", False)
+        or meta["fp_size"] != fp_size
+        or meta["fp_type"] != fp_type
+        or meta.get("counts", False) != counts
+        or meta.get("fingerprint_settings") != (fingerprint_settings or {})
+    ):
+        return None
+    return StoredFingerprints(directory)
+
+
+def _load_fingerprints(directory: str, meta: dict):
+    """The memory-mapped packed fingerprints or SparseFingerprints of a dataset"""
+
+    def load(name: str) -> np.ndarray:
+        return np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+
+    if meta.get("sparse", False):
+        return SparseFingerprints(
+            load("fp_indptr"), load("fp_indices"), meta["fp_size"]
+        )
+    return load("fp")
+
+
+def _load_strings(data: np.ndarray, offsets: np.ndarray, null: np.ndarray) -> list:
+    raw = data.tobytes()
+    if not (data >= 0x80).any():
+        # ASCII only, byte offsets are character offsets
+        text = raw.decode("ascii")
+        values = [text[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    else:
+        values = [
+            raw[start:end].decode() for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+    return [None if missing else value for value, missing in zip(values, null)]
+
+
+def load_dataset(directory: str) -> Tuple[pd.DataFrame, FeatureStore]:
+    """
+    Opens a dataset directory. The fingerprint matrix is memory-mapped read-only.
+    :param directory: Dataset directory written by DatasetWriter
+    :return: The dataframe with identifiers and targets and the FeatureStore
+    """
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["format"] != format_version:
+        raise ValueError(f"Unsupported dataset format {meta['format']} in {directory}")
+    return _load_rows(directory, meta)
+
+
+def _load_rows(
+    directory: str, meta: dict, rows: Optional[np.ndarray] = None
+) -> Tuple[pd.DataFrame, FeatureStore]:
+    """
+    The dataframe and FeatureStore of a dataset or of some of its rows.
+    :param rows: Row positions to read, None memory-maps all rows
+    """
+
+    def load(name: str) -> np.ndarray:
+        array = np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+        return array if rows is None else array[rows]
+
+    index = pd.Index(np.asarray(load("index")))
+    data = {}
+    for i, column in enumerate(meta["columns"]):
+        if column["kind"] == "string" and rows is None:
+            data[column["name"]] = _load_strings(
+                load(f"column_{i}.data"),
+                load(f"column_{i}.offsets"),
+                load(f"column_{i}.null"),
+            )
+        elif column["kind"] == "string":
+            # only the strings of the selected rows are decoded
+            path = os.path.join(directory, f"column_{i}")
+            strings = np.load(path + ".data.npy", mmap_mode="r")
+            offsets = np.load(path + ".offsets.npy", mmap_mode="r")
+            data[column["name"]] = [
+                None
+                if missing
+                else strings[offsets[row] : offsets[row + 1]].tobytes().decode()
+                for row, missing in zip(rows, load(f"column_{i}.null"))
+            ]
+        elif column["kind"] == "int":
+            # datasets of earlier versions store integer columns as float64
+            data[column["name"]] = np.asarray(
+                load(f"column_{i}"), dtype=column.get("dtype", "int64")
+            )
+        else:
+            data[column["name"]] = np.asarray(load(f"column_{i}"))
+    df = pd.DataFrame(data, index=index, columns=[c["name"] for c in meta["columns"]])
+    fp = _load_fingerprints(directory, meta)
+    features = FeatureStore(
+        index,
+        fp if rows is None else fp[rows],
+        load("fp_valid"),
+        meta["fp_size"],
+        meta["fp_type"],
+        meta.get("counts", False),
+    )
+    return df, features
+
+
+class KeyIndex:
+    """
+    Finds the rows of compounds in a dataset by an identifier like toxid or cid, or by
+    InChIKey, without loading the dataset. Every lookup probes the memory-mapped hash table
+    of the identifier column and reads the identifier of the candidate row to rule out
+    hash collisions, which touches a few pages per identifier.
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: Dataset directory written by DatasetWriter
+        """
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.columns = {
+            column["name"]: i
+            for i, column in enumerate(self.meta["columns"])
+            if column.get("key_index", False)
+        }
+        if not self.columns:
+            raise ValueError(
+                f"{directory} has no key index, convert it again to build one"
+            )
+        self.arrays: Dict[str, np.ndarray] = {}
+
+    def _load(self, name: str) -> np.ndarray:
+        if name not in self.arrays:
+            self.arrays[name] = np.load(
+                os.path.join(self.directory, name + ".npy"), mmap_mode="r"
+            )
+        return self.arrays[name]
+
+    def _key(self, i: int, row: int) -> Optional[str]:
+        """The identifier in column i of a row"""
+        if self.meta["columns"][i]["kind"] == "string":
+            if self._load(f"column_{i}.null")[row]:
+                return None
+            offsets = self._load(f"column_{i}.offsets")
+            data = self._load(f"column_{i}.data")
+            return data[offsets[row] : offsets[row + 1]].tobytes().decode()
+        # numbers keep their type, so that large integer identifiers are compared exactly
+        return _key_strings([self._load(f"column_{i}")[row].item()])[0]
+
+    def rows(self, ids: Sequence, column: Optional[str] = None) -> np.ndarray:
+        """
+        Rows of identifiers.
+        :param ids: Identifiers, numbers are matched like their string without decimals
+        :param column: Identifier column to search. If None, all indexed columns are
+            searched in the order of the dataset.
+        :return: Row of each identifier, -1 if it is not found
+        """
+        if column is not None and column not in self.columns:
+            raise ValueError(
+                f"{self.directory} has no key index for column {column}, "
+                f"indexed columns are {list(self.columns)}"
+            )
+        keys = _key_strings(ids)
+        hashes = _key_hashes(keys)
+        result = np.full(len(keys), -1, dtype=np.int64)
+        for name, i in self.columns.items():
+            if column is not None and name != column:
+                continue
+            table = self._load(f"column_{i}.keys")
+            mask = len(table) - 1
+            for j, (key, key_hash) in enumerate(zip(keys, hashes)):
+                if key is None or result[j] >= 0:
+                    continue
+                slot = int(key_hash) & mask
+                while table[slot]["row"] >= 0:
+                    if table[slot]["hash"] == key_hash:
+                        row = int(table[slot]["row"])
+                        if self._key(i, row) == key:
+                            result[j] = row
+                            break
+                    slot = (slot + 1) & mask
+        return result
+
+
+def lookup_dataset(
+    directory: str, ids: Sequence, column: Optional[str] = None
+) -> Tuple[pd.DataFrame, FeatureStore]:
+    """
+    Reads the rows of a dataset that hold the given identifiers, see KeyIndex. Only these
+    rows are read from the memory-mapped files.
+    :param directory: Dataset directory written by DatasetWriter
+    :param ids: Identifiers like toxid or cid values or InChIKeys
+    :param column: Identifier column to search, None searches all indexed columns
+    :return: The dataframe and FeatureStore of the found rows in the order of ids. An
+        identifier that is not found or repeats an earlier one has no row.
+    """
+    key_index = KeyIndex(directory)
+    rows = key_index.rows(ids, column)
+    rows = pd.unique(rows[rows >= 0])
+    return _load_rows(directory, key_index.meta, rows)
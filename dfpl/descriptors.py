@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Physico-chemical 2D descriptors of molecules calculated with RDKit"""
+import time
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from rdkit import Chem, rdBase
+from rdkit.Chem import Descriptors
+
+from dfpl.molstore import MoleculeStore, parseStructure
+
+# All descriptors RDKit calculates from the 2D structure, by name
+descriptor_functions = dict(Descriptors.descList)
+# Descriptors of the "default" set
+default_descriptors = [
+    "MolWt",
+    "ExactMolWt",
+    "MolLogP",
+    "MolMR",
+    "TPSA",
+    "NumHDonors",
+    "NumHAcceptors",
+    "NumRotatableBonds",
+    "HeavyAtomCount",
+    "RingCount",
+    "NumAromaticRings",
+    "FractionCSP3",
+]
+
+# Number of molecules that are looked up in the molecule store at once
+_batch_rows = 1024
+
+
+def descriptorNames(value: str) -> List[str]:
+    """
+    Descriptor names of an option value.
+    :param value: Comma-separated names of descriptor_functions, "default" for
+        default_descriptors or "all" for every descriptor. Empty disables the descriptors.
+    :return: List of descriptor names in the given order
+    """
+    if value.strip() in ("", "none"):
+        return []
+    if value.strip() == "default":
+        return list(default_descriptors)
+    if value.strip() == "all":
+        return list(descriptor_functions)
+    names = [name.strip() for name in value.split(",")]
+    unknown = [name for name in names if name not in descriptor_functions]
+    if unknown:
+        raise ValueError(
+            f"Unknown descriptors {unknown}, use names of "
+            "rdkit.Chem.Descriptors.descList, 'default' or 'all'"
+        )
+    return names
+
+
+def descriptorKind(accessor: str, names: Sequence[str]) -> str:
+    """
+    Describes the descriptors that are calculated for a kind of structure. It is part of
+    the key in the fingerprint cache. The RDKit version is part of it, since descriptor
+    implementations change between versions.
+    """
+    return f"{accessor}:descriptors:{rdBase.rdkitVersion}:{','.join(names)}"
+
+
+@lru_cache(maxsize=None)
+def _functions(names: Tuple[str, ...]) -> List[Callable[[Chem.Mol], float]]:
+    return [descriptor_functions[name] for name in names]
+
+
+def _fillDescriptors(
+    functions: List[Callable[[Chem.Mol], float]], mol: Chem.Mol, row: np.ndarray
+) -> None:
+    """Writes the descriptors of mol into row, NaN where one cannot be calculated"""
+    for j, function in enumerate(functions):
+        try:
+            row[j] = function(mol)
+        # the Python implementations of some descriptors fail on unusual molecules in
+        # many ways, a failing descriptor must not invalidate the others
+        except Exception:
+            row[j] = np.nan
+    # values beyond the float32 range are treated as missing
+    row[~np.isfinite(row)] = np.nan
+
+
+def calculateDescriptors(
+    structures: Sequence[str],
+    accessor: str,
+    names: Sequence[str],
+    out: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    started: Optional[np.ndarray] = None,
+    mol_store: Optional[MoleculeStore] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates descriptors of a list of structures into one float32 matrix.
+    :param structures: SMILES or InChI strings or mol blocks
+    :param accessor: "smiles", "inchi" or "molblock", the kind of structures
+    :param names: Names of descriptor_functions, one column per name
+    :param out: Optional preallocated matrix and validity array that are filled instead of
+        allocating new ones
+    :param started: Optional float64 array that receives the time.monotonic() at which the
+        calculation of each structure started, see fingerprint.calculateFingerprintSet
+    :param mol_store: Optional molecule store. Stored molecules are loaded instead of
+        parsed, and newly parsed molecules are added to it.
+    :return: float32 matrix with the descriptors of each structure, NaN where a descriptor
+        could not be calculated, and a boolean array marking the structures that could be
+        parsed. Rows of structures that could not be parsed are NaN.
+    """
+    functions = _functions(tuple(names))
+    if out is None:
+        matrix = np.empty((len(structures), len(names)), dtype=np.float32)
+        valid = np.zeros(len(structures), dtype=bool)
+    else:
+        matrix, valid = out
+    matrix[:] = np.nan
+    for start in range(0, len(structures), _batch_rows):
+        batch = structures[start : start + _batch_rows]
+        if mol_store is not None:
+            binaries, stored = mol_store.lookup(batch, accessor)
+            parsed = {}
+        for i, structure in enumerate(batch):
+            if started is not None:
+                started[start + i] = time.monotonic()
+            if mol_store is not None and stored[i]:
+                mol = Chem.Mol(binaries[i]) if binaries[i] is not None else None
+            else:
+                mol = parseStructure(structure, accessor)
+                if mol_store is not None and isinstance(structure, str):
+                    parsed[structure] = mol.ToBinary() if mol is not None else None
+            valid[start + i] = mol is not None
+            if mol is not None:
+                with np.errstate(over="ignore", invalid="ignore"):
+                    _fillDescriptors(functions, mol, matrix[start + i])
+        if mol_store is not None and parsed:
+            mol_store.store(list(parsed), accessor, list(parsed.values()))
+    return matrix, valid
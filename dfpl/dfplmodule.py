@@ -22,6 +22,9 @@ from tensorflow.keras.layers import Dense, Dropout, Input
 from tensorflow.keras.models import Model, Sequential
 from tensorflow.keras.optimizers import SGD
 
+from dfpl import fingerprint
+from dfpl.molstore import parseStructure
+
 # GENERAL FUNCTIONS --------------------------------------------------------- #
 
 
@@ -72,7 +75,7 @@ def str2bool(v):
         raise argparse.ArgumentTypeError("Boolean value expected.")
 
 
-def smi2fp(smile, fptype, size=2048):
+def smi2fp(smile, fptype, size=2048, profile="strict"):
     """
     Convert a SMILES string to a fingerprint object of a certain type using functions
     from the RDKIT python library.
@@ -80,12 +83,25 @@ def smi2fp(smile, fptype, size=2048):
     :param smile: A single SMILES string
     :param fptype: The type of fingerprint to which the SMILES should be converted. Valid
                    values are: 'topological' (default), 'MACCS'
+    :param profile: 'strict' (default) canonicalizes and fully sanitizes the SMILES, 'fast'
+                    parses it once and only runs the sanitization steps the fingerprint
+                    needs. Meant for trusted, canonical SMILES.
     :return: A fingerprint object or None, if fingerprint object could not be created
     (Respective error message is provided in STDERR).
     """
     # generate a mol object from smiles string
 
     # print(smile)
+    # all other types are topological torsions, see _mol2fp
+    fp_kind = fptype if fptype in ("topological", "MACCS", "atompairs") else "torsions"
+    flags = fingerprint.sanitizeFlags(profile, [(fp_kind, size)])
+    if flags is not None:
+        mol = parseStructure(smile, "smiles", flags)
+        if mol is None:
+            print(f"[WARNING]: Not able to extract molecule from SMILES: {smile}")
+            return None
+        return _mol2fp(mol, smile, fptype, size)
+
     cs = None
     # first transform to canoncial smiles
     try:
@@ -106,7 +122,11 @@ def smi2fp(smile, fptype, size=2048):
         )
     if not mol:
         return None
+    return _mol2fp(mol, smile, fptype, size)
+
 
+def _mol2fp(mol, smile, fptype, size):
+    """Fingerprint object of a parsed molecule, see smi2fp"""
     # init fp, any better idea? e.g. calling a constructor?
     # fp = Chem.Mol  # FingerprintMols.FingerprintMol(mol)
 
@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+"""In-memory representation of fingerprint features"""
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from dfpl import settings
+
+# Number of set bits for every possible value of a byte
+_BYTE_POPCOUNT = np.unpackbits(
+    np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1
+).sum(axis=1, dtype=np.uint8)
+
+# Count fingerprints saturate at the largest uint8
+count_max = np.iinfo(np.uint8).max
+
+# Feature holding the float32 descriptors of the structures, see dfpl.descriptors
+descriptor_feature = "descriptors"
+# Features that do not depend on the fingerprint. They are taken over when the
+# fingerprints are folded or filtered.
+structure_features = [descriptor_feature]
+
+
+def packed_width(fp_size: int) -> int:
+    """
+    Number of bytes needed to store a fingerprint of fp_size bits with 8 bits per byte
+    :param fp_size: Number of bits in the fingerprint
+    :return: Number of bytes of the packed fingerprint
+    """
+    return (fp_size + 7) // 8
+
+
+def fingerprint_width(fp_size: int, counts: bool = False) -> int:
+    """
+    Number of bytes of a fingerprint in the feature matrix
+    :param fp_size: Number of bits or counts in the fingerprint
+    :param counts: Whether the fingerprint holds one uint8 count per position instead of bits
+    :return: fp_size for count fingerprints, packed_width(fp_size) otherwise
+    """
+    return fp_size if counts else packed_width(fp_size)
+
+
+def saturate_counts(counts: np.ndarray) -> np.ndarray:
+    """
+    Converts counts to uint8, counts above count_max are clipped to count_max.
+    """
+    return np.minimum(counts, count_max).astype(np.uint8)
+
+
+def scale_counts(counts: np.ndarray, dtype: np.dtype = np.float32) -> np.ndarray:
+    """
+    Scales uint8 counts logarithmically to [0, 1] as done by layers.ScaleCounts inside the
+    networks.
+    """
+    return (np.log1p(counts.astype(dtype)) / np.log1p(count_max)).astype(
+        dtype, copy=False
+    )
+
+
+def pack_fingerprints(bits: np.ndarray) -> np.ndarray:
+    """
+    Packs one fingerprint or a matrix of fingerprints (one per row) into uint8 with 8 bits per byte.
+    :param bits: Array of bits along the last axis. Any non-zero value is a set bit.
+    :return: uint8 array with the last axis shrunk to packed_width(fp_size)
+    """
+    return np.packbits(np.asarray(bits, dtype=bool), axis=-1)
+
+
+def unpack_fingerprints(
+    packed: np.ndarray, fp_size: int, dtype: np.dtype = np.bool_
+) -> np.ndarray:
+    """
+    Unpacks fingerprints that were packed with pack_fingerprints.
+    :param packed: uint8 array of packed fingerprints along the last axis
+    :param fp_size: Number of bits in the fingerprint
+    :param dtype: Data type of the returned bits
+    :return: Array of bits with fp_size elements along the last axis
+    """
+    return np.unpackbits(packed, axis=-1, count=fp_size).astype(dtype, copy=False)
+
+
+def sum_scaled_counts(
+    counts: np.ndarray, rows: Optional[np.ndarray] = None, chunk_size: int = 65536
+) -> float:
+    """
+    Sum of the scaled counts of count fingerprints, the counterpart of count_bits.
+    :param counts: uint8 matrix of count fingerprints
+    :param rows: Optional row positions to sum, all rows otherwise
+    :param chunk_size: Number of rows that are scaled at once
+    :return: Sum of scale_counts over all positions
+    """
+    if rows is None:
+        rows = np.arange(counts.shape[0])
+    # scale_counts of all possible uint8 values
+    scaled = scale_counts(np.arange(count_max + 1), np.float64)
+    return sum(
+        float(scaled[counts[rows[i : i + chunk_size]]].sum())
+        for i in range(0, len(rows), chunk_size)
+    )
+
+
+def use_sparse(fp_size: int, counts: bool = False) -> bool:
+    """
+    Whether fingerprints of fp_size bits are stored as SparseFingerprints
+    :param fp_size: Number of bits in the fingerprint
+    :param counts: Whether the fingerprints are count fingerprints, which are always dense
+    """
+    return not counts and fp_size >= settings.sparse_fp_min_size
+
+
+class SparseFingerprints:
+    """
+    Bit fingerprints in compressed sparse row (CSR) format: the positions of the set bits of
+    row i are indices[indptr[i]:indptr[i + 1]]. Memory scales with the number of set bits
+    instead of the fingerprint size. Like a matrix of packed fingerprints it has one row per
+    molecule and packed_width(fp_size) columns. Selecting rows gives SparseFingerprints
+    again, to_packed gives the packed rows, e.g. of one batch.
+    """
+
+    dtype = np.dtype(np.uint8)
+    ndim = 2
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, fp_size: int):
+        """
+        :param indptr: int64 array of n_rows + 1 offsets into indices, starting with 0
+        :param indices: Positions of the set bits of all rows
+        :param fp_size: Number of bits in the fingerprint
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.fp_size = fp_size
+
+    @staticmethod
+    def index_dtype(fp_size: int) -> np.dtype:
+        return np.dtype(np.uint16 if fp_size <= 1 << 16 else np.uint32)
+
+    @property
+    def shape(self):
+        return len(self), packed_width(self.fp_size)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def __getitem__(self, key) -> "SparseFingerprints":
+        # sklearn selects rows as x[rows, ...]
+        if isinstance(key, tuple) and len(key) == 2 and key[1] is Ellipsis:
+            key = key[0]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                return SparseFingerprints(
+                    self.indptr[start : stop + 1] - self.indptr[start],
+                    self.indices[self.indptr[start] : self.indptr[stop]],
+                    self.fp_size,
+                )
+            key = np.arange(start, stop, step)
+        rows = np.atleast_1d(np.asarray(key))
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        starts = np.asarray(self.indptr[rows])
+        lengths = np.asarray(self.indptr[rows + 1]) - starts
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return SparseFingerprints(indptr, self.indices[positions], self.fp_size)
+
+    def to_packed(self) -> np.ndarray:
+        """The packed uint8 fingerprints of all rows, as written by pack_fingerprints"""
+        packed = np.zeros(self.shape, dtype=np.uint8)
+        indices = self.indices[self.indptr[0] : self.indptr[-1]].astype(np.int64)
+        rows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        # packbits stores the first bit in the most significant bit of a byte
+        np.bitwise_or.at(
+            packed.reshape(-1),
+            rows * packed.shape[1] + (indices >> 3),
+            (0x80 >> (indices & 7)).astype(np.uint8),
+        )
+        return packed
+
+    def count_bits(self, rows: Optional[np.ndarray] = None) -> int:
+        """Number of set bits of all rows or of the given row positions"""
+        if rows is None:
+            return int(self.indptr[-1] - self.indptr[0])
+        return int((self.indptr[rows + 1] - self.indptr[rows]).sum())
+
+    @classmethod
+    def from_packed(cls, packed: np.ndarray, fp_size: int) -> "SparseFingerprints":
+        """Converts packed fingerprints block-wise"""
+        indptr = np.zeros(packed.shape[0] + 1, dtype=np.int64)
+        indices = []
+        for start in range(0, packed.shape[0], settings.sparse_block_rows):
+            block = packed[start : start + settings.sparse_block_rows]
+            rows, positions = np.nonzero(unpack_fingerprints(block, fp_size))
+            indptr[start + 1 : start + len(block) + 1] = np.bincount(
+                rows, minlength=len(block)
+            )
+            indices.append(positions.astype(cls.index_dtype(fp_size)))
+        np.cumsum(indptr, out=indptr)
+        return cls(
+            indptr,
+            np.concatenate(indices)
+            if indices
+            else np.zeros(0, cls.index_dtype(fp_size)),
+            fp_size,
+        )
+
+    @classmethod
+    def concat(cls, matrices: List["SparseFingerprints"]) -> "SparseFingerprints":
+        offsets = np.cumsum([0] + [m.count_bits() for m in matrices])
+        return cls(
+            np.concatenate(
+                [[0]]
+                + [m.indptr[1:] - m.indptr[0] + o for m, o in zip(matrices, offsets)]
+            ).astype(np.int64),
+            np.concatenate([m.indices[m.indptr[0] : m.indptr[-1]] for m in matrices]),
+            matrices[0].fp_size,
+        )
+
+
+FeatureMatrix = Union[np.ndarray, SparseFingerprints]
+
+
+def append_descriptors(matrix: FeatureMatrix, descriptors: np.ndarray) -> np.ndarray:
+    """
+    Network input of a feature matrix followed by descriptors, see layers.DescriptorInput.
+    Float features like compressed fingerprints are followed by the descriptor values.
+    Packed bits and uint8 counts stay uint8 and are followed by the bytes of the float32
+    descriptors, so that the fingerprints are still decoded inside the network.
+    :param matrix: Feature matrix, SparseFingerprints are not supported
+    :param descriptors: Descriptor matrix with the same rows
+    :return: Matrix of the concatenated rows
+    """
+    if isinstance(matrix, SparseFingerprints):
+        raise ValueError(
+            "Descriptors cannot be appended to sparse fingerprints, use a fingerprint "
+            f"size below {settings.sparse_fp_min_size}"
+        )
+    descriptors = np.ascontiguousarray(descriptors, dtype=np.float32)
+    if matrix.dtype == np.uint8:
+        return np.concatenate([matrix, descriptors.view(np.uint8)], axis=1)
+    return np.concatenate([matrix, descriptors.astype(matrix.dtype)], axis=1)
+
+
+def split_descriptors(matrix: np.ndarray, n_descriptors: int) -> np.ndarray:
+    """
+    The float32 descriptors at the end of a matrix built with append_descriptors
+    :param matrix: Matrix of concatenated rows
+    :param n_descriptors: Number of descriptors per row
+    """
+    if matrix.dtype == np.uint8:
+        return np.ascontiguousarray(matrix[:, -4 * n_descriptors :]).view(np.float32)
+    return matrix[:, -n_descriptors:].astype(np.float32)
+
+
+def dense_rows(matrix: FeatureMatrix, rows) -> np.ndarray:
+    """
+    Rows of a feature matrix as numpy array, SparseFingerprints are packed.
+    :param matrix: Feature matrix
+    :param rows: Row positions or slice
+    """
+    selected = matrix[rows]
+    if isinstance(selected, SparseFingerprints):
+        return selected.to_packed()
+    return selected
+
+
+def concat_matrices(matrices: List[FeatureMatrix]) -> FeatureMatrix:
+    """Concatenates the rows of feature matrices of the same kind"""
+    if isinstance(matrices[0], SparseFingerprints):
+        return SparseFingerprints.concat(matrices)
+    return np.concatenate(matrices)
+
+
+def fold_fingerprints(
+    matrix: FeatureMatrix, fp_size: int, target_size: int, counts: bool = False
+) -> FeatureMatrix:
+    """
+    Folds fingerprints of fp_size positions to target_size positions: position i of the
+    folded fingerprint is the OR (for counts the saturated sum) of all positions j with
+    j % target_size == i. Fingerprints that RDKit sets by hashing features modulo the size
+    are equal to the ones calculated with target_size directly.
+    :param matrix: Packed fingerprints, uint8 counts or SparseFingerprints
+    :param fp_size: Number of bits or counts in the fingerprints
+    :param target_size: Size of the folded fingerprints. fp_size needs to be a multiple
+        of it, and it needs to be a multiple of 8 for bit fingerprints.
+    :param counts: Whether matrix holds count fingerprints
+    :return: Folded fingerprints, SparseFingerprints if use_sparse(target_size)
+    """
+    if fp_size % target_size != 0 or (not counts and target_size % 8 != 0):
+        raise ValueError(
+            f"Fingerprints of {fp_size} bits cannot be folded to {target_size}"
+        )
+    if isinstance(matrix, SparseFingerprints):
+        rows = np.repeat(np.arange(len(matrix)), np.diff(matrix.indptr))
+        indices = matrix.indices[matrix.indptr[0] : matrix.indptr[-1]] % target_size
+        if not use_sparse(target_size):
+            return SparseFingerprints(matrix.indptr, indices, target_size).to_packed()
+        # bits of a row that fold onto the same position are merged
+        positions = np.unique(rows * target_size + indices)
+        indptr = np.zeros(len(matrix) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(positions // target_size, minlength=len(matrix)),
+            out=indptr[1:],
+        )
+        return SparseFingerprints(
+            indptr,
+            (positions % target_size).astype(
+                SparseFingerprints.index_dtype(target_size)
+            ),
+            target_size,
+        )
+    n_rows = matrix.shape[0]
+    if counts:
+        folded = np.zeros((n_rows, target_size), dtype=np.uint8)
+        for start in range(0, n_rows, settings.sparse_block_rows):
+            block = matrix[start : start + settings.sparse_block_rows]
+            sums = block.reshape(len(block), -1, target_size).sum(
+                axis=1, dtype=np.uint32
+            )
+            np.minimum(
+                sums,
+                count_max,
+                out=folded[start : start + len(block)],
+                casting="unsafe",
+            )
+        return folded
+    # bit i is in byte i // 8 at position i % 8, which folding keeps
+    return np.bitwise_or.reduce(
+        np.asarray(matrix).reshape(n_rows, -1, packed_width(target_size)), axis=1
+    )
+
+
+def count_bits(
+    packed: FeatureMatrix, rows: Optional[np.ndarray] = None, chunk_size: int = 65536
+) -> int:
+    """
+    Counts the set bits of packed fingerprints without unpacking them.
+    :param packed: uint8 array of packed fingerprints or SparseFingerprints
+    :param rows: Optional row positions to count, all rows otherwise
+    :param chunk_size: Number of rows that are counted at once
+    :return: Total number of set bits
+    """
+    if isinstance(packed, SparseFingerprints):
+        return packed.count_bits(rows)
+    if packed.ndim < 2:
+        return int(_BYTE_POPCOUNT[packed].sum(dtype=np.int64))
+    if rows is None:
+        rows = np.arange(packed.shape[0])
+    return sum(
+        int(_BYTE_POPCOUNT[packed[rows[i : i + chunk_size]]].sum(dtype=np.int64))
+        for i in range(0, len(rows), chunk_size)
+    )
+
+
+class FeatureStore:
+    """
+    Feature matrices of a dataset. Every feature (e.g. the packed fingerprints "fp" or the
+    autoencoder output "fpcompressed") is kept in a single 2D array whose rows are aligned
+    to the index of the dataframe holding the identifiers and targets. Rows for which the
+    feature could not be calculated are marked invalid. Count fingerprints are stored with
+    one uint8 per position instead of packed bits, wide bit fingerprints as
+    SparseFingerprints.
+    """
+
+    def __init__(
+        self,
+        index: pd.Index,
+        fp: FeatureMatrix,
+        fp_valid: np.ndarray,
+        fp_size: int,
+        fp_type: Optional[str] = None,
+        counts: bool = False,
+    ):
+        """
+        :param index: Index of the dataframe the rows of the matrices are aligned to
+        :param fp: Matrix of packed fingerprints or SparseFingerprints, one row per entry of
+            index
+        :param fp_valid: Boolean array marking rows of fp that hold a fingerprint
+        :param fp_size: Number of bits in the fingerprint
+        :param fp_type: Type of the fingerprint if known, see fingerprint.fp_types
+        :param counts: Whether fp holds uint8 count fingerprints instead of packed bits
+        """
+        if not index.is_unique:
+            raise ValueError("FeatureStore needs a unique dataframe index")
+        self.index = index
+        self.fp_size = fp_size
+        self.fp_type = fp_type
+        self.counts = counts
+        self.matrices: Dict[str, FeatureMatrix] = {}
+        self.valid_rows: Dict[str, np.ndarray] = {}
+        self.set("fp", fp, fp_valid)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.matrices
+
+    def __getitem__(self, name: str) -> FeatureMatrix:
+        """The full matrix of a feature without copying it"""
+        return self.matrices[name]
+
+    def set(self, name: str, matrix: FeatureMatrix, valid: np.ndarray) -> None:
+        """
+        Adds or replaces a feature.
+        :param name: Name of the feature
+        :param matrix: Matrix with one row per entry of the index
+        :param valid: Boolean array marking the rows that hold a value
+        """
+        if matrix.shape[0] != len(self.index) or valid.shape != (len(self.index),):
+            raise ValueError(
+                f"Feature '{name}' has {matrix.shape[0]} rows but the store has {len(self.index)}"
+            )
+        self.matrices[name] = matrix
+        self.valid_rows[name] = valid
+
+    def rows(self, labels: Optional[pd.Index] = None) -> np.ndarray:
+        """
+        Row positions in the matrices for the given dataframe index labels.
+        :param labels: Index labels, e.g. the index of a filtered dataframe. None selects all rows.
+        :return: Integer array of row positions
+        """
+        if labels is None:
+            return np.arange(len(self.index))
+        positions = self.index.get_indexer(labels)
+        if (positions < 0).any():
+            raise KeyError("Some index labels are not part of the feature store")
+        return positions
+
+    def valid(self, name: str, labels: Optional[pd.Index] = None) -> np.ndarray:
+        """
+        Boolean mask of the rows that hold a value for the feature. The mask is aligned to
+        labels so that it can directly be used to filter the dataframe.
+        :param name: Name of the feature
+        :param labels: Index labels. None selects all rows.
+        :return: Boolean array with one entry per label
+        """
+        if name not in self.valid_rows:
+            return np.zeros(len(self.index) if labels is None else len(labels), bool)
+        if labels is None:
+            return self.valid_rows[name]
+        return self.valid_rows[name][self.rows(labels)]
+
+    def get(self, name: str, labels: Optional[pd.Index] = None) -> FeatureMatrix:
+        """
+        Matrix rows of a feature for the given dataframe index labels. Selecting all rows or a
+        contiguous range of rows returns a view, any other selection gathers the rows.
+        SparseFingerprints stay sparse, see dense_rows.
+        :param name: Name of the feature
+        :param labels: Index labels. None selects all rows.
+        :return: Matrix with one row per label
+        """
+        matrix = self.matrices[name]
+        if labels is None:
+            return matrix
+        positions = self.rows(labels)
+        # contiguous rows can be sliced
+        if len(positions) > 0 and (np.diff(positions) == 1).all():
+            return matrix[positions[0] : positions[-1] + 1]
+        return matrix[positions]
+
+    def fold(self, fp_size: int) -> "FeatureStore":
+        """
+        A store with the fingerprints folded to fp_size, see fold_fingerprints. Other
+        features than structure_features are not taken over.
+        :param fp_size: Number of bits of the folded fingerprints
+        """
+        return FeatureStore(
+            self.index,
+            fold_fingerprints(self["fp"], self.fp_size, fp_size, self.counts),
+            self.valid("fp"),
+            fp_size,
+            self.fp_type,
+            self.counts,
+        ).take_over(self, structure_features)
+
+    def take_over(self, other: "FeatureStore", names: Sequence[str]) -> "FeatureStore":
+        """
+        Adds the features of another store with the same rows.
+        :param other: Store to take the features from
+        :param names: Names of the features, those missing in other are skipped
+        :return: This store
+        """
+        for name in names:
+            if name in other:
+                self.set(name, other[name], other.valid(name))
+        return self
+
+    @classmethod
+    def concat(cls, stores: List["FeatureStore"]) -> "FeatureStore":
+        """
+        Concatenates the stores of consecutive chunks of a dataset.
+        :param stores: FeatureStores with the same features and fingerprint size
+        :return: FeatureStore with the rows of all stores
+        """
+        index = stores[0].index.append([store.index for store in stores[1:]])
+        result = cls(
+            index,
+            concat_matrices([store["fp"] for store in stores]),
+            np.concatenate([store.valid("fp") for store in stores]),
+            stores[0].fp_size,
+            stores[0].fp_type,
+            stores[0].counts,
+        )
+        for name in stores[0].matrices:
+            if name != "fp":
+                result.set(
+                    name,
+                    concat_matrices([store[name] for store in stores]),
+                    np.concatenate([store.valid(name) for store in stores]),
+                )
+        return result
+
+    @classmethod
+    def from_column(cls, df: pd.DataFrame, fp_size: int, column: str = "fp"):
+        """
+        Creates a store from a dataframe column holding one packed fingerprint (or None) per row
+        as produced by fingerprint.addFPColumn. The column is removed from the dataframe.
+        """
+        valid = df[column].notnull().to_numpy()
+        fp = np.zeros((len(df), packed_width(fp_size)), dtype=np.uint8)
+        if valid.any():
+            fp[valid] = np.stack(df[column][valid].to_list())
+        df.drop(columns=column, inplace=True)
+        return cls(df.index, fp, valid, fp_size)
@@ -19,6 +19,9 @@ from tensorflow.keras.models import Model, Sequential
 from dfpl import callbacks as cb
 from dfpl import history as ht
 from dfpl import options, settings
+from dfpl.features import FeatureStore
+from dfpl.fingerprint import targetColumns
+from dfpl.layers import input_layers, model_inputs, validation_inputs
 
 
 def define_out_file_names(path_prefix: str, target: str, fold: int = -1) -> tuple:
@@ -67,7 +70,7 @@ def define_out_file_names(path_prefix: str, target: str, fold: int = -1) -> tupl
 
 
 def define_nn_multi_label_model(
-    input_size: int, output_size: int, opts: options.Options
+    input_size: int, output_size: int, opts: options.Options, packed_input: bool = False
 ) -> Model:
     lr_schedule = optimizers.schedules.ExponentialDecay(
         opts.aeLearningRate,
@@ -85,12 +88,11 @@ def define_nn_multi_label_model(
 
     nhl = int(math.log2(input_size) / 2 - 1)
 
-    model = Sequential()
+    model = Sequential(input_layers(input_size, packed_input, opts.fpCounts))
     # From input to 1st hidden layer
     model.add(
         Dense(
             units=int(input_size / 2),
-            input_dim=input_size,
             activation=opts.activationFunction,
             kernel_regularizer=regularizers.l2(opts.l2reg),
         )
@@ -136,6 +138,8 @@ def define_nn_model_multi(
     optimizer: str = "Adam",
     lr: float = 0.001,
     decay: float = 0.01,
+    packed_input: bool = False,
+    counts: bool = False,
 ) -> Model:
     if optimizer == "Adam":
         my_optimizer = optimizers.legacy.Adam(learning_rate=lr, decay=decay)
@@ -146,12 +150,11 @@ def define_nn_model_multi(
 
     nhl = int(math.log2(input_size) / 2 - 1)
 
-    model = Sequential()
+    model = Sequential(input_layers(input_size, packed_input, counts))
     # From input to 1st hidden layer
     model.add(
         Dense(
             units=int(input_size / 2),
-            input_dim=input_size,
             activation=activation,
             kernel_regularizer=regularizers.l2(l2reg),
         )
@@ -191,6 +194,9 @@ def validate_multi_model_on_test_data(
     y_test: np.ndarray,
     col_names: List[str],
     result_file: str,
+    input_size: int,
+    packed_input: bool = False,
+    counts: bool = False,
 ) -> List[Union[int, float, str]]:
     """
     Validate the multi label model on a test data set.
@@ -200,16 +206,22 @@ def validate_multi_model_on_test_data(
     :param y_test: The outcome matrix of the test data set
     :param col_names: The names of the columns that are targets
     :param result_file: The filename of the output file
+    :param input_size: Number of input features of the model
+    :param packed_input: Whether x_test holds packed fingerprints of input_size bits
+    :param counts: Whether x_test holds count fingerprints of input_size features
     :return: A pandas Dataframe containing the percentage of correct predictions for each target
     """
     # load checkpoint model with min(val_loss)
     trained_model = define_nn_model_multi(
-        input_size=x_test.shape[1], output_size=y_test.shape[1]
+        input_size=input_size,
+        output_size=y_test.shape[1],
+        packed_input=packed_input,
+        counts=counts,
     )
 
     # predict values with random model
     predictions_random = pd.DataFrame(
-        trained_model.predict(x_test), columns=[n for n in col_names]
+        trained_model.predict(**model_inputs(x_test)), columns=[n for n in col_names]
     )
 
     # load weights into random model
@@ -217,7 +229,7 @@ def validate_multi_model_on_test_data(
 
     # predict with trained model
     predictions = pd.DataFrame(
-        trained_model.predict(x_test), columns=[n for n in col_names]
+        trained_model.predict(**model_inputs(x_test)), columns=[n for n in col_names]
     )
 
     y_true = pd.DataFrame(y_test, columns=col_names)
@@ -237,40 +249,26 @@ def validate_multi_model_on_test_data(
     return [f1_random, f1_trained]
 
 
-def train_nn_models_multi(df: pd.DataFrame, opts: options.Options) -> None:
+def train_nn_models_multi(
+    df: pd.DataFrame, features: FeatureStore, opts: options.Options
+) -> None:
     # find target columns
-    names_y = [
-        c
-        for c in df.columns
-        if c not in ["cid", "id", "smiles", "fp", "inchi", "fpcompressed"]
-    ]
+    names_y = targetColumns(df)
     selector = df[names_y].notna().apply(np.logical_and.reduce, axis=1)
 
-    if opts.compressFeatures:
-        # get compressed fingerprints as numpy array
-        fpMatrix = np.array(
-            df[df["fpcompressed"].notnull() & selector]["fpcompressed"].to_list(),
-            dtype=settings.nn_multi_fp_compressed_numpy_type,
-            copy=settings.numpy_copy_values,
-        )
-        y = np.array(
-            df[df["fpcompressed"].notnull() & selector][names_y],
-            dtype=settings.nn_multi_target_numpy_type,
-            copy=settings.numpy_copy_values,
-        )
-    else:
-        # get fingerprints as numpy array
-        fpMatrix = np.array(
-            df[df["fp"].notnull() & selector]["fp"].to_list(),
-            dtype=settings.nn_multi_fp_numpy_type,
-            copy=settings.numpy_copy_values,
-        )
+    # get (compressed) fingerprints as numpy array from the FeatureStore
+    feature = "fpcompressed" if opts.compressFeatures else "fp"
+    df_selected = df[features.valid(feature, df.index) & selector]
+    fpMatrix = features.get(feature, df_selected.index)
+    y = np.array(
+        df_selected[names_y],
+        dtype=settings.nn_multi_target_numpy_type,
+        copy=settings.numpy_copy_values,
+    )
 
-        y = np.array(
-            df[df["fp"].notnull() & selector][names_y],
-            dtype=settings.nn_multi_target_numpy_type,
-            copy=settings.numpy_copy_values,
-        )
+    # uncompressed fingerprints are packed and unpacked inside the model
+    packed_input = not opts.compressFeatures
+    input_size = opts.fpSize if packed_input else fpMatrix.shape[1]
 
     if opts.kFolds > 0:
         # do a kfold cross validation for the autoencoder training
@@ -317,7 +315,10 @@ def train_nn_models_multi(df: pd.DataFrame, opts: options.Options) -> None:
 
             # use a dnn for multi-class prediction
             model = define_nn_model_multi(
-                input_size=fpMatrix[train].shape[1], output_size=y.shape[1]
+                input_size=input_size,
+                output_size=y.shape[1],
+                packed_input=packed_input,
+                counts=opts.fpCounts,
             )
 
             callback_list = cb.nn_callback(checkpoint_path=checkpoint_path, opts=opts)
@@ -326,13 +327,16 @@ def train_nn_models_multi(df: pd.DataFrame, opts: options.Options) -> None:
 
             # train and validate
             hist = model.fit(
-                fpMatrix[train],
-                y[train],
+                **model_inputs(
+                    fpMatrix[train],
+                    y[train],
+                    256,
+                    shuffle=True,
+                    validation_split=opts.testSize,
+                ),
                 callbacks=callback_list,
                 epochs=opts.epochs,
-                batch_size=256,
                 verbose=opts.verbose,
-                validation_split=opts.testSize,
             )
 
             trainTime = str(round((time() - start) / 60, ndigits=2))
@@ -356,6 +360,9 @@ def train_nn_models_multi(df: pd.DataFrame, opts: options.Options) -> None:
                 result_file=out_file_path.replace(
                     "trainingResults.txt", "predictionResults.csv"
                 ),
+                input_size=input_size,
+                packed_input=packed_input,
+                counts=opts.fpCounts,
             )
 
             idx = hist.history["val_loss"].index(min(hist.history["val_loss"]))
@@ -443,9 +450,12 @@ def train_nn_models_multi(df: pd.DataFrame, opts: options.Options) -> None:
 
     # measure the training time
     model = define_nn_multi_label_model(
-        input_size=fpMatrix.shape[1], output_size=y.shape[1], opts=opts
+        input_size=input_size,
+        output_size=y.shape[1],
+        opts=opts,
+        packed_input=packed_input,
     )
-    model.evaluate(X_test, y_test)
+    model.evaluate(**model_inputs(X_test, y_test))
 
     # model = define_nn_model_multi(input_size=fpMatrix.shape[1],
     #                               output_size=y.shape[1])
@@ -453,18 +463,16 @@ def train_nn_models_multi(df: pd.DataFrame, opts: options.Options) -> None:
     # train and validate
     start = time()
     hist = model.fit(
-        X_train,
-        y_train,
+        **model_inputs(X_train, y_train, opts.batchSize, shuffle=True),
         # callbacks=callback_list,
         epochs=opts.epochs,
-        batch_size=opts.batchSize,
         verbose=opts.verbose,
-        validation_data=(X_test, y_test),
+        validation_data=validation_inputs(X_test, y_test, opts.batchSize),
     )
     trainTime = str(round((time() - start) / 60, ndigits=2))
 
     # yhat = model.predict(X_test)
-    model.evaluate(X_test, y_test)
+    model.evaluate(**model_inputs(X_test, y_test))
 
     logging.info(
         "Computation time for training the full multi-label FNN: " + trainTime + " min"
@@ -1,138 +1,1846 @@
 # -*- coding: utf-8 -*-
 """Calculate fingerprints"""
+import csv
+import glob
+import itertools
+import json
 import logging
 import multiprocessing
+import multiprocessing.pool
 import os
-from functools import partial
+import queue
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
+from multiprocessing import resource_tracker, shared_memory
 from os.path import isfile, join
-from typing import Any, Callable, List
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 import pandas as pd
 from rdkit import Chem, DataStructs, RDLogger
-from rdkit.Chem import AllChem
+from rdkit.Chem import MACCSkeys, rdFingerprintGenerator
 
-# import settings
-from dfpl import settings
+from dfpl import resources, settings
+from dfpl.dataset import (
+    DatasetWriter,
+    StoredFingerprints,
+    dataset_extension,
+    is_dataset,
+    key_columns,
+    load_dataset,
+    open_stored_fingerprints,
+)
+from dfpl.descriptors import calculateDescriptors, descriptorKind
+from dfpl.features import (
+    FeatureMatrix,
+    FeatureStore,
+    SparseFingerprints,
+    count_max,
+    descriptor_feature,
+    fingerprint_width,
+    pack_fingerprints,
+    use_sparse,
+)
+from dfpl.fpcache import FingerprintCache
+from dfpl.molstore import (
+    MoleculeStore,
+    fast_sanitization,
+    molecule_store,
+    parseStructure,
+)
+from dfpl.readers import (
+    format_extension,
+    open_text,
+    read_sdf,
+    read_smi,
+    sdf_extensions,
+    smi_extensions,
+    strip_compression,
+)
+from dfpl.standardize import (
+    Standardizer,
+    standardizer_version,
+    standardizeStructures,
+)
 
 default_fp_size = 2048
+default_fp_type = "topological"
+fp_types = ["topological", "MACCS", "atompairs", "morgan"]
+# Types whose fingerprints are equal to the OR-folded (for counts the summed) fingerprints
+# of a larger size, see features.fold_fingerprints. Atom pair bit fingerprints simulate
+# counts with several bits per feature, which does not fold.
+foldable_fp_types = {
+    False: ["topological", "morgan"],
+    True: ["topological", "atompairs", "morgan"],
+}
+# Backends of calculateFingerprintSetParallel: "process" calculates in a process pool,
+# which isolates structures that crash or hang, "thread" in a thread pool of the calling
+# process and "auto" chooses by the batch size
+fp_backends = ["auto", "process", "thread"]
+# Parse profiles: "strict" sanitizes every molecule fully, "fast" only runs the
+# sanitization steps the fingerprint types need, see sanitizeFlags
+parse_profiles = ["strict", "fast"]
+# Fingerprint types whose atom invariants count pi electrons, so that their "fast" parse
+# needs conjugation and hybridization. Topological torsions are only calculated by
+# dfplmodule.smi2fp.
+pi_electron_fp_types = ["atompairs", "torsions"]
+morgan_radius = 2
+maccs_size = 167
+# File next to trained models that records the fingerprints they were trained on
+fingerprint_record = "fingerprint.json"
+# Fingerprints of models trained before the record was written, which depended on the
+# kind of the input structures and not on fpType
+legacy_fp_types = {"smiles": "morgan", "inchi": "topological"}
+# Column that receives the standardized SMILES the fingerprints are calculated from
+standardized_column = "standardized_smiles"
+# Extension of the descriptor matrices convertFile writes next to the datasets
+descriptors_extension = ".descriptors.npy"
+# Columns of the input data that are no training targets, compared in lower case: the
+# structures and their standardized SMILES, the mol blocks and names of SDF and SMILES
+# files, the identifiers and the fingerprint columns of data pickled by older versions
+non_target_columns = {
+    "smiles",
+    "inchi",
+    "molblock",
+    "name",
+    standardized_column,
+    "fp",
+    "fpcompressed",
+    *key_columns,
+}
+
+# Number of molecules whose bits are collected in one block before packing
+_batch_rows = 1024
+
+# Seconds between two checks of the fingerprint workers, see _runChunks
+_watchdog_interval = 0.5
 
 
-def addFPColumn(data_frame: pd.DataFrame, fp_size: int) -> pd.DataFrame:
+def targetColumns(data_frame: pd.DataFrame) -> List[str]:
     """
-    Adds a fingerprint to each row in the dataframe. This function works on
-    parallel chunks of the original dataframe.
-    :param data_frame: Input dataframe that needs to have a "smiles" or an "inchi" column
+    Columns of the input data the models are trained on, all except non_target_columns.
+    :param data_frame: Input dataframe
+    :return: Names of the target columns in the order of the dataframe
+    """
+    return [
+        column
+        for column in data_frame.columns
+        if str(column).lower() not in non_target_columns
+    ]
+
+
+def structure_column(data_frame: pd.DataFrame) -> str:
+    """
+    Name of the column holding the molecular structures.
+    :param data_frame: Input dataframe that needs to have a "smiles", an "inchi" or a
+        "molblock" column, the latter holds the mol blocks of SDF files
+    :return: "smiles", "inchi" or "molblock"
+    """
+    if "smiles" in data_frame:
+        return "smiles"
+    if "inchi" in data_frame:
+        return "inchi"
+    if "molblock" in data_frame:
+        return "molblock"
+    raise ValueError(
+        "Neither smiles nor inchi column in data-frame, nor a molblock column of an SDF file"
+    )
+
+
+@lru_cache(maxsize=None)
+def fingerprintGenerator(fp_type: str, fp_size: int) -> Any:
+    """
+    RDKit fingerprint generator for a fingerprint type. Generators are built once per process
+    and reused for every batch.
+    :param fp_type: One of fp_types
     :param fp_size: Number of bits in the fingerprint
-    :return: The dataframe with an additional "fp" column
-    """
-
-    def smile2fp(smile: str) -> Any:
-        """
-        Calculates one fingerprint from a SMILE
-        :param smile: Input SMILE
-        :return: List of bits if conversion is successfull,
-        None otherwise
-        """
-
-        # generate morgan fp (circular, ecfp)
-        # smile = df['smiles'][1]
-        # mol = Chem.MolFromSmiles(smile)
-        # from rdkit.Chem import AllChem
-        # morgan = AllChem.GetMorganFingerprintAsBitVect(mol, 2)
-        # npa = np.zeros((0,), dtype=np.bool)
-        # from rdkit import DataStructs
-        # DataStructs.ConvertToNumpyArray(morgan, npa)
-
-        npa = np.zeros((0,), dtype=np.bool_)
-        try:
-            DataStructs.ConvertToNumpyArray(
-                AllChem.GetMorganFingerprintAsBitVect(
-                    Chem.MolFromSmiles(smile), 2, nBits=fp_size
-                ),
-                npa,
-            )
-            return npa
-        except Exception:
-            return None
-
-        # try:
-        #     return np.array(
-        #         Chem.RDKFingerprint(Chem.MolFromSmiles(smile), fpSize=fp_size),
-        #         dtype=settings.df_fp_numpy_type, copy=settings.numpy_copy_values)
-        # except:
-        #     # Note: We don't need to log here since rdkit already logs
-        #     return None
-
-    def inchi2fp(inchi: str) -> Any:
-        """
-        Calculates one fingerprint from InChI
-        :param inchi: Input InChI
-        :return: List of bits if conversion is successfull,
-        None otherwise
-        """
-        try:
-            return np.array(
-                Chem.RDKFingerprint(Chem.MolFromInchi(inchi), fpSize=fp_size),
-                dtype=settings.df_fp_numpy_type,
-                copy=settings.numpy_copy_values,
+    :return: The generator, or None for MACCS keys which have no generator
+    """
+    if fp_type == "topological":
+        return rdFingerprintGenerator.GetRDKitFPGenerator(fpSize=fp_size)
+    if fp_type == "atompairs":
+        return rdFingerprintGenerator.GetAtomPairGenerator(fpSize=fp_size)
+    if fp_type == "morgan":
+        return rdFingerprintGenerator.GetMorganGenerator(
+            radius=morgan_radius, fpSize=fp_size
+        )
+    if fp_type == "MACCS":
+        if fp_size < maccs_size:
+            raise ValueError(
+                f"MACCS keys need a fingerprint size of at least {maccs_size}"
             )
-        except Exception:
-            # Note: We don't need to log here since rdkit already logs
-            return None
+        return None
+    raise ValueError(f"Unknown fingerprint type: {fp_type}")
 
-    if "smiles" in data_frame:
-        func = smile2fp
-        accessor = "smiles"
+
+def fingerprintComponents(fp_type: str, fp_size: int) -> List[Tuple[str, int]]:
+    """
+    Types and sizes of the fingerprints that make up a fingerprint type. A concatenation
+    like "morgan+MACCS" splits fp_size equally among its components.
+    :param fp_type: One of fp_types or a concatenation of them joined with "+"
+    :param fp_size: Number of bits of the whole fingerprint
+    :return: List of (type, size) pairs in the order of the concatenation
+    """
+    components = fp_type.split("+")
+    for component in components:
+        if component not in fp_types:
+            raise ValueError(f"Unknown fingerprint type: {component}")
+    if fp_size % len(components) != 0:
+        raise ValueError(
+            f"A fingerprint of {fp_size} bits cannot be split into {len(components)} parts"
+        )
+    return [(component, fp_size // len(components)) for component in components]
+
+
+def _fillFingerprint(generator: Any, mol: Chem.Mol, row: np.ndarray, counts: bool):
+    """Writes the fingerprint of mol as bits or saturated counts into row"""
+    if generator is None:
+        DataStructs.ConvertToNumpyArray(MACCSkeys.GenMACCSKeys(mol), row[:maccs_size])
+    elif counts:
+        np.minimum(
+            generator.GetCountFingerprintAsNumPy(mol),
+            count_max,
+            out=row,
+            casting="unsafe",
+        )
+    else:
+        row[:] = generator.GetFingerprintAsNumPy(mol)
+
+
+def calculateFingerprints(
+    structures: Sequence[str],
+    accessor: str,
+    fp_size: int,
+    fp_type: str = default_fp_type,
+    out: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    counts: bool = False,
+    mol_store: Optional[MoleculeStore] = None,
+    profile: str = "strict",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates the bit-packed fingerprints of a list of structures into one matrix. The bits
+    of a batch of molecules are collected in one block that is packed at once.
+    :param structures: SMILES or InChI strings
+    :param accessor: "smiles" or "inchi", the kind of structures
+    :param fp_size: Number of bits in the fingerprint
+    :param fp_type: One of fp_types or a concatenation of them, see fingerprintComponents.
+        MACCS keys fill the first 167 bits of their part of the fingerprint.
+    :param out: Optional preallocated fingerprint matrix and validity array with one row
+        per structure that are filled instead of allocating new ones
+    :param counts: Calculate count fingerprints with one uint8 count per position instead of
+        packed bits. Counts above 255 saturate. MACCS keys only have counts of 0 and 1.
+    :param mol_store: Optional molecule store. Stored molecules are loaded instead of
+        parsed, and newly parsed molecules are added to it.
+    :param profile: Parse profile, one of parse_profiles. "fast" skips the sanitization
+        steps the fingerprint does not need, see sanitizeFlags. For structures that a full
+        sanitization accepts the fingerprints are the same, but structures with invalid
+        valences are not detected. Molecules parsed with it are not added to mol_store.
+    :return: uint8 matrix with one packed fingerprint per structure and a boolean array marking
+        the structures for which a fingerprint could be calculated
+    """
+    (fp,), valid = calculateFingerprintSet(
+        structures,
+        accessor,
+        fp_size,
+        [fp_type],
+        out=None if out is None else ([out[0]], out[1]),
+        counts=counts,
+        mol_store=mol_store,
+        profile=profile,
+    )
+    return fp, valid
+
+
+def calculateFingerprintSet(
+    structures: Sequence[str],
+    accessor: str,
+    fp_size: int,
+    fp_types: Sequence[str],
+    out: Optional[Tuple[List[np.ndarray], np.ndarray]] = None,
+    counts: bool = False,
+    started: Optional[np.ndarray] = None,
+    mol_store: Optional[MoleculeStore] = None,
+    profile: str = "strict",
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """
+    Calculates several fingerprint types of a list of structures, one matrix per type. Each
+    structure is parsed once, and a fingerprint that is part of several requested types is
+    calculated once. See calculateFingerprints.
+    :param fp_types: Fingerprint types or concatenations, see fingerprintComponents
+    :param out: Optional preallocated matrices, one per type, and validity array
+    :param started: Optional float64 array that receives the time.monotonic() at which the
+        calculation of each structure started, so that another process can tell which
+        structure a calculation is stuck at
+    :param mol_store: Optional molecule store, see calculateFingerprints
+    :param profile: Parse profile, see calculateFingerprints
+    :return: List of matrices in the order of fp_types and a boolean array marking the
+        structures for which the fingerprints could be calculated
+    """
+    components = [fingerprintComponents(fp_type, fp_size) for fp_type in fp_types]
+    generators = {
+        component: fingerprintGenerator(*component)
+        for type_components in components
+        for component in type_components
+    }
+    sanitize = sanitizeFlags(profile, generators)
+    # only fully sanitized molecules are stored for other stages
+    store_parsed = mol_store is not None and sanitize is None
+    if out is None:
+        fps = [
+            np.zeros(
+                (len(structures), fingerprint_width(fp_size, counts)), dtype=np.uint8
+            )
+            for _ in fp_types
+        ]
+        valid = np.zeros(len(structures), dtype=bool)
     else:
-        if "inchi" in data_frame:
-            func = inchi2fp
-            accessor = "inchi"
+        fps, valid = out
+    if not counts:
+        bits = [
+            np.zeros((min(_batch_rows, len(structures)), fp_size), dtype=np.uint8)
+            for _ in fp_types
+        ]
+    for start in range(0, len(structures), _batch_rows):
+        batch = structures[start : start + _batch_rows]
+        # counts are written directly into the matrices, bits are packed block-wise
+        if counts:
+            blocks = [fp[start : start + len(batch)] for fp in fps]
         else:
-            raise ValueError("Neither smiles nor inchi column in data-frame")
+            blocks = [block[: len(batch)] for block in bits]
+        for block in blocks:
+            block[:] = 0
+        if mol_store is not None:
+            binaries, stored = mol_store.lookup(batch, accessor)
+            parsed = {}
+        for i, structure in enumerate(batch):
+            if started is not None:
+                started[start + i] = time.monotonic()
+            if mol_store is not None and stored[i]:
+                mol = Chem.Mol(binaries[i]) if binaries[i] is not None else None
+            else:
+                # Unparsable structures give None, missing values are no strings.
+                # Note: We don't need to log here since rdkit already logs
+                mol = parseStructure(structure, accessor, sanitize)
+                if store_parsed and isinstance(structure, str):
+                    parsed[structure] = mol.ToBinary() if mol is not None else None
+            valid[start + i] = mol is not None
+            if mol is None:
+                continue
+            calculated = {}
+            for block, type_components in zip(blocks, components):
+                offset = 0
+                for component in type_components:
+                    row = block[i, offset : offset + component[1]]
+                    if component in calculated:
+                        row[:] = calculated[component]
+                    else:
+                        _fillFingerprint(generators[component], mol, row, counts)
+                        calculated[component] = row
+                    offset += component[1]
+        if store_parsed and parsed:
+            mol_store.store(list(parsed), accessor, list(parsed.values()))
+        if not counts:
+            for fp, block in zip(fps, blocks):
+                fp[start : start + len(batch)] = pack_fingerprints(block)
+    return fps, valid
+
+
+def sanitizeFlags(
+    profile: str, components: Iterable[Tuple[str, int]]
+) -> Optional[Chem.SanitizeFlags]:
+    """
+    Sanitization steps of a parse profile for the fingerprint components that are
+    calculated from the molecules.
+    :param profile: One of parse_profiles
+    :param components: Fingerprint components, see fingerprintComponents
+    :return: None for the full sanitization of "strict". For "fast" the steps of
+        molstore.fast_sanitization, plus conjugation and hybridization for
+        pi_electron_fp_types.
+    """
+    if profile not in parse_profiles:
+        raise ValueError(
+            f"Unknown parse profile {profile}, use one of {parse_profiles}"
+        )
+    if profile == "strict":
+        return None
+    flags = fast_sanitization
+    if any(name in pi_electron_fp_types for name, _ in components):
+        flags |= (
+            Chem.SanitizeFlags.SANITIZE_SETCONJUGATION
+            | Chem.SanitizeFlags.SANITIZE_SETHYBRIDIZATION
+        )
+    return flags
+
+
+def fingerprintKind(
+    accessor: str,
+    fp_size: int,
+    fp_type: str,
+    counts: bool = False,
+    profile: str = "strict",
+) -> str:
+    """
+    Describes the fingerprint that is calculated for a kind of structure. It is part of the
+    key in the fingerprint cache.
+    :param accessor: "smiles" or "inchi"
+    :param fp_size: Number of bits in the fingerprint
+    :param fp_type: One of fp_types or a concatenation of them
+    :param counts: Whether count fingerprints are calculated
+    :param profile: Parse profile. Fingerprints of the "fast" profile are cached apart,
+        since it accepts structures with invalid valences.
+    :return: String with the structure kind, fingerprint type and its parameters
+    """
+    kind = (
+        accessor
+        + ":"
+        + "+".join(
+            f"morgan:{morgan_radius}:{size}"
+            if component == "morgan"
+            else f"{component}:{size}"
+            for component, size in fingerprintComponents(fp_type, fp_size)
+        )
+    )
+    if counts:
+        kind += ":counts"
+    return kind + ":fast" if profile == "fast" else kind
 
-    data_frame["fp"] = data_frame[accessor].apply(func)
+
+def _sharedSize(n_rows: int, width: int, n_matrices: int = 1) -> int:
+    """Number of bytes of the shared memory block, see _sharedArrays"""
+    return n_rows * (12 + n_matrices * width + 1)
+
+
+def _progressArrays(buffer: memoryview, n_rows: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Views of the progress arrays at the start of a shared memory block: the time.monotonic()
+    at which the calculation of each row started and the process id of the worker
+    calculating it
+    """
+    started = np.ndarray((n_rows,), dtype=np.float64, buffer=buffer)
+    worker = np.ndarray((n_rows,), dtype=np.int32, buffer=buffer, offset=8 * n_rows)
+    return started, worker
+
+
+def _sharedArrays(
+    buffer: memoryview, n_rows: int, width: int, n_matrices: int = 1
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """
+    Views of the fingerprint matrices and validity array in a shared memory block. The block
+    holds the progress arrays (see _progressArrays) followed by n_matrices matrices of
+    n_rows * width bytes and n_rows validity flags.
+    """
+    offset = 12 * n_rows
+    fps = [
+        np.ndarray(
+            (n_rows, width),
+            dtype=np.uint8,
+            buffer=buffer,
+            offset=offset + k * n_rows * width,
+        )
+        for k in range(n_matrices)
+    ]
+    valid = np.ndarray(
+        (n_rows,),
+        dtype=bool,
+        buffer=buffer,
+        offset=offset + n_matrices * n_rows * width,
+    )
+    return fps, valid
+
+
+def _trackerPid() -> Optional[int]:
+    """Process id of the resource tracker of this process, None if it is not running"""
+    return resource_tracker._resource_tracker._pid
+
+
+def _attachSharedMemory(
+    name: str, owner_tracker: Optional[int]
+) -> shared_memory.SharedMemory:
+    """
+    Attaches to a shared memory block created by another process. Attaching registers the
+    block with the resource tracker. A worker forked after the creating process started its
+    tracker shares that tracker, which the creating process unregisters the block from
+    when unlinking it. A worker with its own tracker would unlink the block again when the
+    pool shuts down and warn about it, so the block is unregistered there.
+    :param name: Name of the block
+    :param owner_tracker: Process id of the resource tracker of the creating process
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    if _trackerPid() != owner_tracker:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _fillSharedRows(
+    task: Tuple[str, int, int, np.ndarray],
+    accessor: str,
+    fp_size: int,
+    fp_types: Sequence[str],
+    counts: bool = False,
+    owner_tracker: Optional[int] = None,
+    mol_store_file: str = "",
+    profile: str = "strict",
+) -> Tuple[int, int, float]:
+    """
+    Worker function of calculateFingerprintSetParallel. Calculates the fingerprints of a
+    slice of structures and writes them at their row offset into the shared matrices.
+    :param task: Name of the shared memory block, its number of rows, the first row of the
+        slice and the structures of the slice
+    :param owner_tracker: Process id of the resource tracker of the calling process
+    :param mol_store_file: Optional file of a molecule store, see molecule_store
+    :param profile: Parse profile, see calculateFingerprints
+    :return: Process id of the worker, number of structures and seconds it took
+    """
+    shm_name, n_rows, start, structures = task
+    started = time.perf_counter()
+    shm = _attachSharedMemory(shm_name, owner_tracker)
+    fps, valid = _sharedArrays(
+        shm.buf, n_rows, fingerprint_width(fp_size, counts), len(fp_types)
+    )
+    started_at, worker = _progressArrays(shm.buf, n_rows)
+    stop = start + len(structures)
+    worker[start:stop] = os.getpid()
+    calculateFingerprintSet(
+        structures,
+        accessor,
+        fp_size,
+        fp_types,
+        out=([fp[start:stop] for fp in fps], valid[start:stop]),
+        counts=counts,
+        started=started_at[start:stop],
+        mol_store=molecule_store(mol_store_file),
+        profile=profile,
+    )
+    # the views need to be released before the block can be closed
+    del fps, valid, started_at, worker
+    shm.close()
+    return os.getpid(), len(structures), time.perf_counter() - started
+
+
+def chunkBounds(
+    structures: Sequence[str], n_chunks: int, by_length: bool = False
+) -> np.ndarray:
+    """
+    Row offsets that split structures into up to n_chunks consecutive chunks.
+    :param structures: SMILES or InChI strings, missing values count as empty strings
+    :param n_chunks: Number of chunks
+    :param by_length: Balance the number of characters per chunk instead of the number
+        of structures
+    :return: Increasing offsets starting with 0 and ending with len(structures)
+    """
+    n_rows = len(structures)
+    if not by_length:
+        return np.unique(np.linspace(0, n_rows, n_chunks + 1, dtype=int))
+    lengths = pd.Series(structures, dtype=object).str.len().fillna(0).to_numpy()
+    # every structure weighs at least one character
+    weight = np.cumsum(lengths + 1)
+    targets = np.linspace(0, weight[-1], n_chunks + 1)[1:-1]
+    inner = np.searchsorted(weight, targets) + 1
+    return np.unique(np.concatenate([[0], inner, [n_rows]]).clip(0, n_rows))
+
+
+def _logUtilisation(stats: List[Tuple[int, int, float]], wall_time: float) -> None:
+    """Logs how busy the workers were while calculating the chunks of stats"""
+    if not stats:
+        return
+    busy, rows = {}, {}
+    for pid, n_rows, seconds in stats:
+        busy[pid] = busy.get(pid, 0.0) + seconds
+        rows[pid] = rows.get(pid, 0) + n_rows
+    utilisation = np.array(list(busy.values())) / max(wall_time, 1e-9)
+    logging.info(
+        f"Fingerprints of {sum(rows.values())} structures in {len(stats)} chunks on "
+        f"{len(busy)} workers took {wall_time:.2f}s, worker utilisation "
+        f"min {utilisation.min():.0%} mean {utilisation.mean():.0%} "
+        f"max {utilisation.max():.0%}"
+    )
+    for pid in sorted(busy):
+        logging.debug(
+            f"Worker {pid}: {rows[pid]} structures, busy {busy[pid]:.2f}s "
+            f"({busy[pid] / max(wall_time, 1e-9):.0%})"
+        )
+
+
+def _isAlive(pid: int) -> bool:
+    """Whether the process pid exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def _runChunks(
+    pool: multiprocessing.pool.Pool,
+    fill: Callable,
+    shm: shared_memory.SharedMemory,
+    structures: np.ndarray,
+    bounds: np.ndarray,
+    fps: List[np.ndarray],
+    valid: np.ndarray,
+    owns_pool: bool = True,
+) -> Tuple[List[Tuple[int, int, float]], int]:
+    """
+    Runs the chunks of structures between consecutive bounds on the pool and watches them.
+    A worker that spends more than settings.fp_structure_timeout seconds on a structure is
+    killed, and the pool replaces a killed or crashed worker. The structure a failed chunk
+    was stuck at is retried on its own if its worker crashed, and marked invalid if it
+    timed out or crashed again. The other structures of the chunk are calculated again.
+    A chunk whose worker died before its first structure is calculated again, and so is a
+    chunk that no worker took up for settings.fp_structure_timeout seconds while later
+    chunks were calculated or no chunk was calculated at all. On a pool shared with other
+    calls, the chunks may be queued behind their tasks, so the time is only counted once a
+    worker took up a chunk of this call.
+    The pool does not notice that the task of a dead worker is lost, so the pool needs to
+    be terminated instead of joined if a task was abandoned.
+    :param fill: _fillSharedRows with its parameters bound
+    :param fps: Shared fingerprint matrices, see _sharedArrays
+    :param valid: Shared validity array
+    :param owns_pool: Whether the pool runs the tasks of this call only
+    :return: Worker process id, number of structures and busy seconds of each chunk, and
+        the number of abandoned tasks
+    """
+    n_rows = len(structures)
+    started, worker = _progressArrays(shm.buf, n_rows)
+    # task id -> first and last row of the chunk and whether it is a retried structure
+    pending = {}
+    task_ids = itertools.count()
+    completed = queue.SimpleQueue()
+    # task id -> time.monotonic() since which the chunk waits for a worker that may be lost
+    waiting = {}
+    stats = []
+    abandoned = 0
+
+    def finish(task_id: int, value: Any) -> None:
+        completed.put((task_id, value))
+
+    def submit(start: int, stop: int, retry: bool = False):
+        if stop > start:
+            started[start:stop] = 0
+            worker[start:stop] = 0
+            task = (shm.name, n_rows, start, structures[start:stop])
+            task_id = next(task_ids)
+            pending[task_id] = (start, stop, retry)
+            pool.apply_async(
+                fill,
+                (task,),
+                callback=partial(finish, task_id),
+                error_callback=partial(finish, task_id),
+            )
+
+    def collect(timeout: float) -> None:
+        """Takes the completed tasks, waiting up to timeout seconds for the first one"""
+        try:
+            results = [completed.get(timeout=timeout)]
+        except queue.Empty:
+            return
+        while not completed.empty():
+            results.append(completed.get())
+        for task_id, value in results:
+            # abandoned tasks that complete nevertheless are ignored
+            if pending.pop(task_id, None) is None:
+                continue
+            waiting.pop(task_id, None)
+            if isinstance(value, BaseException):
+                raise value
+            stats.append(value)
+
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        submit(start, stop)
+    while pending:
+        collect(_watchdog_interval)
+        now = time.monotonic()
+        taken = [task_id for task_id, (start, _, _) in pending.items() if worker[start]]
+        # until then the chunks of a shared pool may wait for the tasks of other calls
+        reached = owns_pool or taken or stats
+        for task_id, (start, stop, retry) in list(pending.items()):
+            if task_id not in pending:
+                continue
+            pid = int(worker[start])
+            if pid == 0:
+                # tasks are taken up in the order they were submitted, a worker that
+                # died before it recorded its pid leaves its chunk waiting for good
+                if (taken and max(taken) < task_id) or not reached:
+                    waiting.pop(task_id, None)
+                elif (
+                    now - waiting.setdefault(task_id, now)
+                    > settings.fp_structure_timeout
+                ):
+                    logging.warning(
+                        f"No fingerprint worker took up the structures {start} to "
+                        f"{stop} in {settings.fp_structure_timeout}s, submitting them again"
+                    )
+                    del pending[task_id], waiting[task_id]
+                    abandoned += 1
+                    submit(start, stop, retry)
+                continue
+            in_progress = np.flatnonzero(started[start:stop])
+            if len(in_progress) == 0:
+                if _isAlive(pid):
+                    continue
+                # the result may still be on its way
+                collect(_watchdog_interval)
+                if task_id not in pending:
+                    continue
+                logging.warning(
+                    f"Fingerprint worker {pid} died before its first structure, "
+                    "submitting its structures again"
+                )
+                del pending[task_id]
+                abandoned += 1
+                submit(start, stop, retry)
+                continue
+            row = start + in_progress[-1]
+            pid = int(worker[row])
+            if not _isAlive(pid):
+                # the result may still be on its way
+                collect(_watchdog_interval)
+                if task_id not in pending:
+                    continue
+                reason = "crashed"
+            elif time.monotonic() - started[row] > settings.fp_structure_timeout:
+                os.kill(pid, signal.SIGKILL)
+                reason = f"took more than {settings.fp_structure_timeout}s"
+            else:
+                continue
+            del pending[task_id]
+            abandoned += 1
+            submit(start, row)
+            if reason == "crashed" and not retry:
+                logging.warning(
+                    f"Fingerprint worker {pid} crashed at {structures[row]!r}, retrying it"
+                )
+                submit(row, row + 1, retry=True)
+            else:
+                logging.warning(
+                    f"Marking {structures[row]!r} as invalid: its fingerprint worker "
+                    f"{pid} {reason}"
+                )
+                valid[row] = False
+                for fp in fps:
+                    fp[row] = 0
+            submit(row + 1, stop)
+    return stats, abandoned
+
+
+def calculateFingerprintsParallel(
+    structures: np.ndarray,
+    accessor: str,
+    fp_size: int,
+    fp_type: str = default_fp_type,
+    pool: Optional[multiprocessing.pool.Pool] = None,
+    counts: bool = False,
+    backend: str = "process",
+    mol_store: Optional[MoleculeStore] = None,
+    profile: str = "strict",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates the packed fingerprints of structures with a process pool. See calculateFingerprints.
+    Only the structures are sent to the workers, which write the packed fingerprints directly
+    into a shared memory matrix at their row offsets. The structures are split into many
+    small chunks that idle workers pick up in any order, see chunkBounds and
+    settings.fp_chunks_per_worker. Structures that crash a worker or take too long are
+    marked invalid, see _runChunks.
+    :param pool: Pool to use. If None, a pool with one process per available CPU (see
+        resources.cpu_count) is created for this call.
+    :param backend: One of fp_backends. "thread" calculates in a thread pool of this
+        process instead, see calculateFingerprintSetThreaded. "auto" does so for batches of
+        at most settings.fp_thread_max_rows structures if no pool is given. Only the
+        default "process" isolates structures that crash or hang.
+    :param mol_store: Optional molecule store that the workers load molecules from and add
+        newly parsed molecules to, see calculateFingerprints
+    :param profile: Parse profile of the workers, see calculateFingerprints
+    """
+    (fp,), valid = calculateFingerprintSetParallel(
+        structures,
+        accessor,
+        fp_size,
+        [fp_type],
+        pool,
+        counts,
+        backend,
+        mol_store,
+        profile,
+    )
+    return fp, valid
+
+
+def calculateFingerprintSetParallel(
+    structures: np.ndarray,
+    accessor: str,
+    fp_size: int,
+    fp_types: Sequence[str],
+    pool: Optional[multiprocessing.pool.Pool] = None,
+    counts: bool = False,
+    backend: str = "process",
+    mol_store: Optional[MoleculeStore] = None,
+    profile: str = "strict",
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """
+    Calculates several fingerprint types of structures with a process pool, parsing each
+    structure once. See calculateFingerprintSet and calculateFingerprintsParallel.
+    """
+    if backend not in fp_backends:
+        raise ValueError(
+            f"Unknown fingerprint backend {backend}, use one of {fp_backends}"
+        )
+    n_rows, width = len(structures), fingerprint_width(fp_size, counts)
+    if n_rows == 0:
+        return calculateFingerprintSet(
+            structures, accessor, fp_size, fp_types, counts=counts, profile=profile
+        )
+    if backend == "auto":
+        backend = (
+            "thread"
+            if pool is None and n_rows <= settings.fp_thread_max_rows
+            else "process"
+        )
+        logging.info(f"Fingerprinting {n_rows} structures with the {backend} backend")
+    if backend == "thread":
+        return calculateFingerprintSetThreaded(
+            structures,
+            accessor,
+            fp_size,
+            fp_types,
+            counts=counts,
+            mol_store=mol_store,
+            profile=profile,
+        )
+    n_cores = resources.cpu_count()
+    shm = shared_memory.SharedMemory(
+        create=True, size=_sharedSize(n_rows, width, len(fp_types))
+    )
+    try:
+        n_chunks = min(
+            n_cores * settings.fp_chunks_per_worker,
+            max(1, n_rows // settings.fp_min_chunk_rows),
+        )
+        bounds = chunkBounds(structures, n_chunks, settings.fp_chunks_by_length)
+        fill = partial(
+            _fillSharedRows,
+            accessor=accessor,
+            fp_size=fp_size,
+            fp_types=list(fp_types),
+            counts=counts,
+            owner_tracker=_trackerPid(),
+            mol_store_file=mol_store.file_name if mol_store is not None else "",
+            profile=profile,
+        )
+        shared_fps, shared_valid = _sharedArrays(shm.buf, n_rows, width, len(fp_types))
+        # the workers write at the row offsets of their chunks, so the results are in
+        # order whichever worker finishes first
+        started = time.perf_counter()
+        run = partial(
+            _runChunks,
+            fill=fill,
+            shm=shm,
+            structures=structures,
+            bounds=bounds,
+            fps=shared_fps,
+            valid=shared_valid,
+        )
+        if pool is not None:
+            stats, _ = run(pool, owns_pool=False)
+        else:
+            with multiprocessing.Pool(n_cores) as pool:
+                stats, abandoned = run(pool)
+                # the pool would wait for abandoned tasks, it is terminated on exit then
+                if not abandoned:
+                    pool.close()
+                    pool.join()
+        _logUtilisation(stats, time.perf_counter() - started)
+        fps, valid = [fp.copy() for fp in shared_fps], shared_valid.copy()
+        del shared_fps, shared_valid
+    finally:
+        shm.close()
+        shm.unlink()
+    return fps, valid
+
+
+def calculateFingerprintSetThreaded(
+    structures: np.ndarray,
+    accessor: str,
+    fp_size: int,
+    fp_types: Sequence[str],
+    counts: bool = False,
+    threads: int = 0,
+    mol_store: Optional[MoleculeStore] = None,
+    profile: str = "strict",
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """
+    Calculates several fingerprint types of structures with a thread pool in this process,
+    see calculateFingerprintSet. No process is started and no structure is pickled, so
+    small batches return much faster than with calculateFingerprintSetParallel. The threads
+    fill the rows of their chunks in the result matrices. They run in parallel while RDKit
+    releases the GIL. A structure that crashes RDKit takes the calling process down, so
+    untrusted input of unknown quality is better calculated in a process pool.
+    :param threads: Number of threads, 0 uses resources.cpu_count()
+    :param mol_store: Optional molecule store, see calculateFingerprints
+    :param profile: Parse profile, see calculateFingerprints
+    """
+    n_rows = len(structures)
+    n_chunks = min(
+        (threads or resources.cpu_count()) * settings.fp_chunks_per_worker,
+        max(1, n_rows // settings.fp_min_chunk_rows),
+    )
+    if n_chunks <= 1:
+        return calculateFingerprintSet(
+            structures,
+            accessor,
+            fp_size,
+            fp_types,
+            counts=counts,
+            mol_store=mol_store,
+            profile=profile,
+        )
+    width = fingerprint_width(fp_size, counts)
+    fps = [np.zeros((n_rows, width), dtype=np.uint8) for _ in fp_types]
+    valid = np.zeros(n_rows, dtype=bool)
+    bounds = chunkBounds(structures, n_chunks, settings.fp_chunks_by_length)
+
+    def fill(start: int, stop: int) -> None:
+        calculateFingerprintSet(
+            structures[start:stop],
+            accessor,
+            fp_size,
+            fp_types,
+            out=([fp[start:stop] for fp in fps], valid[start:stop]),
+            counts=counts,
+            mol_store=mol_store,
+            profile=profile,
+        )
+
+    with ThreadPoolExecutor(threads or resources.cpu_count()) as executor:
+        for future in [
+            executor.submit(fill, start, stop)
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]:
+            future.result()
+    return fps, valid
+
+
+def _fillSharedDescriptors(
+    task: Tuple[str, int, int, np.ndarray],
+    accessor: str,
+    names: Sequence[str],
+    owner_tracker: Optional[int] = None,
+    mol_store_file: str = "",
+) -> Tuple[int, int, float]:
+    """
+    Worker function of calculateDescriptorsParallel. Calculates the descriptors of a slice
+    of structures and writes them at their row offset into the shared matrix, see
+    _fillSharedRows.
+    """
+    shm_name, n_rows, start, structures = task
+    started = time.perf_counter()
+    shm = _attachSharedMemory(shm_name, owner_tracker)
+    (matrix,), valid = _sharedArrays(shm.buf, n_rows, 4 * len(names))
+    started_at, worker = _progressArrays(shm.buf, n_rows)
+    stop = start + len(structures)
+    worker[start:stop] = os.getpid()
+    calculateDescriptors(
+        structures,
+        accessor,
+        names,
+        out=(matrix[start:stop].view(np.float32), valid[start:stop]),
+        started=started_at[start:stop],
+        mol_store=molecule_store(mol_store_file),
+    )
+    # the views need to be released before the block can be closed
+    del matrix, valid, started_at, worker
+    shm.close()
+    return os.getpid(), len(structures), time.perf_counter() - started
+
+
+def calculateDescriptorsParallel(
+    structures: np.ndarray,
+    accessor: str,
+    names: Sequence[str],
+    pool: Optional[multiprocessing.pool.Pool] = None,
+    mol_store: Optional[MoleculeStore] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates descriptors of structures with the process pool of the fingerprints, see
+    descriptors.calculateDescriptors and calculateFingerprintSetParallel. The workers
+    write the float32 rows into shared memory, and structures that crash a worker or take
+    too long are marked invalid. Most descriptors are implemented in Python and hold the
+    GIL, so there is no thread backend.
+    :param pool: Pool to use. If None, up to settings.fp_thread_max_rows structures are
+        calculated in this process and more in a new pool.
+    :param mol_store: Optional molecule store, see calculateFingerprints
+    :return: float32 matrix with NaN in the rows of invalid structures and boolean array
+        marking the valid ones
+    """
+    n_rows = len(structures)
+    if n_rows == 0 or (pool is None and n_rows <= settings.fp_thread_max_rows):
+        return calculateDescriptors(structures, accessor, names, mol_store=mol_store)
+    n_cores = resources.cpu_count()
+    width = 4 * len(names)
+    shm = shared_memory.SharedMemory(create=True, size=_sharedSize(n_rows, width))
+    try:
+        n_chunks = min(
+            n_cores * settings.fp_chunks_per_worker,
+            max(1, n_rows // settings.fp_min_chunk_rows),
+        )
+        bounds = chunkBounds(structures, n_chunks, settings.fp_chunks_by_length)
+        fill = partial(
+            _fillSharedDescriptors,
+            accessor=accessor,
+            names=list(names),
+            owner_tracker=_trackerPid(),
+            mol_store_file=mol_store.file_name if mol_store is not None else "",
+        )
+        shared_matrices, shared_valid = _sharedArrays(shm.buf, n_rows, width)
+        started = time.perf_counter()
+        run = partial(
+            _runChunks,
+            fill=fill,
+            shm=shm,
+            structures=structures,
+            bounds=bounds,
+            fps=shared_matrices,
+            valid=shared_valid,
+        )
+        if pool is not None:
+            stats, _ = run(pool, owns_pool=False)
+        else:
+            with multiprocessing.Pool(n_cores) as pool:
+                stats, abandoned = run(pool)
+                # the pool would wait for abandoned tasks, it is terminated on exit then
+                if not abandoned:
+                    pool.close()
+                    pool.join()
+        _logUtilisation(stats, time.perf_counter() - started)
+        matrix = shared_matrices[0].view(np.float32).copy()
+        valid = shared_valid.copy()
+        del shared_matrices, shared_valid
+    finally:
+        shm.close()
+        shm.unlink()
+    # rows of structures that were given up are zeroed by _runChunks
+    matrix[~valid] = np.nan
+    return matrix, valid
+
+
+def cachedFingerprints(
+    structures: np.ndarray,
+    accessor: str,
+    fp_size: int,
+    fp_type: str,
+    cache: Optional[FingerprintCache],
+    calculate: Callable[
+        [np.ndarray, str, int, str], Tuple[np.ndarray, np.ndarray]
+    ] = calculateFingerprints,
+    counts: bool = False,
+    profile: str = "strict",
+) -> Tuple[FeatureMatrix, np.ndarray]:
+    """
+    Calculates the packed fingerprints of structures. Every distinct structure is looked up
+    and calculated only once and its fingerprint is copied to all rows holding it. Only
+    structures that are not found in the cache are calculated and newly calculated
+    fingerprints are written back to the cache. Wide bit fingerprints (see use_sparse) are
+    calculated in blocks of settings.sparse_block_rows structures and returned as
+    SparseFingerprints.
+    :param structures: Array of SMILES or InChI strings
+    :param accessor: "smiles" or "inchi", the kind of structures
+    :param fp_size: Number of bits in the fingerprint
+    :param fp_type: One of fp_types or a concatenation of them
+    :param cache: Fingerprint cache. If None, all fingerprints are calculated.
+    :param calculate: Function calculating the fingerprints of the cache misses. For count
+        fingerprints it is called with counts=True, for the "fast" profile with
+        profile="fast".
+    :param counts: Calculate count fingerprints, see calculateFingerprints
+    :param profile: Parse profile, see calculateFingerprints
+    :return: Matrix of packed fingerprints or SparseFingerprints and boolean array marking
+        the valid ones
+    """
+    (fp,), valid = cachedFingerprintSet(
+        structures,
+        accessor,
+        fp_size,
+        [fp_type],
+        cache,
+        calculate=partial(_calculateSingle, calculate=calculate),
+        counts=counts,
+        profile=profile,
+    )
+    return fp, valid
+
+
+def _calculateSingle(
+    structures: np.ndarray,
+    accessor: str,
+    fp_size: int,
+    fp_types: Sequence[str],
+    calculate: Callable,
+    **kwargs,
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Calculates the only type of fp_types with a function for single fingerprint types"""
+    (fp_type,) = fp_types
+    fp, valid = calculate(structures, accessor, fp_size, fp_type, **kwargs)
+    return [fp], valid
+
+
+def cachedFingerprintSet(
+    structures: np.ndarray,
+    accessor: str,
+    fp_size: int,
+    fp_types: Sequence[str],
+    cache: Optional[FingerprintCache],
+    calculate: Callable[
+        [np.ndarray, str, int, Sequence[str]], Tuple[List[np.ndarray], np.ndarray]
+    ] = calculateFingerprintSet,
+    counts: bool = False,
+    profile: str = "strict",
+) -> Tuple[List[FeatureMatrix], np.ndarray]:
+    """
+    Calculates several fingerprint types of structures like cachedFingerprints. A
+    structure that misses any of the types in the cache is parsed once for all of them.
+    :param fp_types: Fingerprint types or concatenations, see fingerprintComponents
+    :param calculate: Function calculating all types of the cache misses, see
+        calculateFingerprintSet
+    :return: List of matrices in the order of fp_types and boolean array marking the valid
+        rows
+    """
+    if counts:
+        calculate = partial(calculate, counts=True)
+    if profile != "strict":
+        calculate = partial(calculate, profile=profile)
+    # missing values get the code -1 and no fingerprint
+    codes, unique = pd.factorize(structures)
+    unique = np.asarray(unique, dtype=object)
+    if len(unique) > 0:
+        logging.info(
+            f"{len(unique)} distinct structures in {len(structures)} rows "
+            f"(deduplication ratio {len(structures) / len(unique):.2f})"
+        )
+    unique_fps, unique_valid = _uniqueFingerprints(
+        unique, accessor, fp_size, fp_types, cache, calculate, counts, profile
+    )
+    present = codes >= 0
+    valid = np.zeros(len(structures), dtype=bool)
+    valid[present] = unique_valid[codes[present]]
+    fps = []
+    for unique_fp in unique_fps:
+        if isinstance(unique_fp, SparseFingerprints):
+            # rows without structure take an empty row appended to the distinct fingerprints
+            empty = SparseFingerprints(
+                np.zeros(2, np.int64), unique_fp.indices[:0], fp_size
+            )
+            rows = np.where(present, codes, len(unique))
+            fps.append(SparseFingerprints.concat([unique_fp, empty])[rows])
+        else:
+            fp = np.zeros(
+                (len(structures), fingerprint_width(fp_size, counts)), dtype=np.uint8
+            )
+            fp[present] = unique_fp[codes[present]]
+            fps.append(fp)
+    return fps, valid
+
+
+def _uniqueFingerprints(
+    structures: np.ndarray,
+    accessor: str,
+    fp_size: int,
+    fp_types: Sequence[str],
+    cache: Optional[FingerprintCache],
+    calculate: Callable,
+    counts: bool,
+    profile: str,
+) -> Tuple[List[FeatureMatrix], np.ndarray]:
+    if not use_sparse(fp_size, counts):
+        return _cachedBlock(
+            structures, accessor, fp_size, fp_types, cache, calculate, counts, profile
+        )
+    # only one block of wide fingerprints is held as packed rows at a time
+    blocks, valid = [[] for _ in fp_types], []
+    for start in range(0, max(len(structures), 1), settings.sparse_block_rows):
+        block_fps, block_valid = _cachedBlock(
+            structures[start : start + settings.sparse_block_rows],
+            accessor,
+            fp_size,
+            fp_types,
+            cache,
+            calculate,
+            counts,
+            profile,
+        )
+        for type_blocks, block_fp in zip(blocks, block_fps):
+            type_blocks.append(SparseFingerprints.from_packed(block_fp, fp_size))
+        valid.append(block_valid)
+    return [SparseFingerprints.concat(b) for b in blocks], np.concatenate(valid)
+
+
+def _cachedBlock(
+    structures: np.ndarray,
+    accessor: str,
+    fp_size: int,
+    fp_types: Sequence[str],
+    cache: Optional[FingerprintCache],
+    calculate: Callable,
+    counts: bool,
+    profile: str,
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    if cache is None:
+        return calculate(structures, accessor, fp_size, fp_types)
+    kinds = [fingerprintKind(accessor, fp_size, t, counts, profile) for t in fp_types]
+    width = fingerprint_width(fp_size, counts)
+    fps, cached = [], np.ones(len(structures), dtype=bool)
+    for kind in kinds:
+        fp, valid, found = cache.lookup(structures, kind, width)
+        fps.append(fp)
+        cached &= found
+    # structures missing any type are calculated for all of them
+    missing = np.flatnonzero(~cached)
+    if len(missing) > 0:
+        calculated, valid[missing] = calculate(
+            structures[missing], accessor, fp_size, fp_types
+        )
+        for fp, kind, new_fp in zip(fps, kinds, calculated):
+            fp[missing] = new_fp
+            cache.store(structures[missing], kind, new_fp, valid[missing])
+    cache.log_statistics()
+    return fps, valid
+
+
+def addFPColumn(
+    data_frame: pd.DataFrame,
+    fp_size: int,
+    cache: Optional[FingerprintCache] = None,
+    fp_type: str = default_fp_type,
+    counts: bool = False,
+    mol_store: Optional[MoleculeStore] = None,
+    standardizer: Optional[Standardizer] = None,
+    profile: str = "strict",
+) -> pd.DataFrame:
+    """
+    Adds a fingerprint to each row in the dataframe. Meant for small dataframes, data files are
+    imported with importDataFile which keeps all fingerprints in one FeatureStore matrix.
+    :param data_frame: Input dataframe that needs to have a "smiles" or an "inchi" column
+    :param fp_size: Number of bits in the fingerprint
+    :param cache: Optional fingerprint cache, only cache misses are calculated
+    :param fp_type: One of fp_types
+    :param counts: Calculate uint8 count fingerprints instead of packed bits
+    :param mol_store: Optional molecule store, structures in it are not parsed again
+    :param standardizer: Optional standardizer, the fingerprints are calculated from the
+        standardized structures, see standardizeColumn
+    :param profile: Parse profile, one of parse_profiles, see calculateFingerprints
+    :return: The dataframe with an additional "fp" column holding the bit-packed fingerprints
+    """
+    structures, accessor = standardizeColumn(
+        data_frame, structure_column(data_frame), standardizer
+    )
+    fp, valid = cachedFingerprints(
+        structures,
+        accessor,
+        fp_size,
+        fp_type,
+        cache,
+        calculate=partial(calculateFingerprints, mol_store=mol_store),
+        counts=counts,
+        profile=profile,
+    )
+    if isinstance(fp, SparseFingerprints):
+        fp = fp.to_packed()
+    data_frame["fp"] = [row if ok else None for row, ok in zip(fp, valid)]
     return data_frame
 
 
+def cachedDescriptors(
+    structures: np.ndarray,
+    accessor: str,
+    names: Sequence[str],
+    cache: Optional[FingerprintCache],
+    calculate: Callable[
+        [np.ndarray, str, Sequence[str]], Tuple[np.ndarray, np.ndarray]
+    ] = calculateDescriptors,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates the descriptors of structures like cachedFingerprints. Every distinct
+    structure is calculated once, and only if its descriptors are not in the cache, which
+    stores the bytes of the float32 rows under descriptors.descriptorKind.
+    :param structures: Array of SMILES or InChI strings or mol blocks
+    :param accessor: "smiles", "inchi" or "molblock", the kind of structures
+    :param names: Names of descriptors.descriptor_functions
+    :param cache: Fingerprint cache. If None, all descriptors are calculated.
+    :param calculate: Function calculating the descriptors of the cache misses, see
+        calculateDescriptorsParallel
+    :return: float32 matrix with NaN in the rows of invalid or missing structures and
+        boolean array marking the valid rows
+    """
+    codes, unique = pd.factorize(structures)
+    unique = np.asarray(unique, dtype=object)
+    if cache is None:
+        unique_values, unique_valid = calculate(unique, accessor, names)
+    else:
+        kind = descriptorKind(accessor, names)
+        stored, unique_valid, found = cache.lookup(unique, kind, 4 * len(names))
+        unique_values = stored.view(np.float32)
+        unique_values[~unique_valid] = np.nan
+        missing = np.flatnonzero(~found)
+        if len(missing) > 0:
+            unique_values[missing], unique_valid[missing] = calculate(
+                unique[missing], accessor, names
+            )
+            cache.store(
+                unique[missing],
+                kind,
+                np.ascontiguousarray(unique_values[missing]).view(np.uint8),
+                unique_valid[missing],
+            )
+        cache.log_statistics()
+    present = codes >= 0
+    values = np.full((len(structures), len(names)), np.nan, dtype=np.float32)
+    values[present] = unique_values[codes[present]]
+    valid = np.zeros(len(structures), dtype=bool)
+    valid[present] = unique_valid[codes[present]]
+    return values, valid
+
+
+def addDescriptors(
+    df: pd.DataFrame,
+    features: FeatureStore,
+    names: Sequence[str],
+    cache: Optional[FingerprintCache] = None,
+    pool: Optional[multiprocessing.pool.Pool] = None,
+    mol_store: Optional[MoleculeStore] = None,
+) -> FeatureStore:
+    """
+    Adds the descriptors of the structures of a dataframe as feature descriptor_feature.
+    The standardized structures are used if the dataframe holds them, see
+    standardizeColumn.
+    :param df: Dataframe with the structures, aligned to features
+    :param features: FeatureStore the descriptors are added to
+    :param names: Names of descriptors.descriptor_functions
+    :param cache: Optional fingerprint cache, see cachedDescriptors
+    :param pool: Process pool, see calculateDescriptorsParallel
+    :param mol_store: Optional molecule store, see calculateDescriptorsParallel
+    :return: features
+    """
+    structures, accessor = fingerprintedStructures(df)
+    values, valid = cachedDescriptors(
+        structures,
+        accessor,
+        names,
+        cache,
+        calculate=partial(calculateDescriptorsParallel, pool=pool, mol_store=mol_store),
+    )
+    features.set(descriptor_feature, values, valid)
+    return features
+
+
 def importDataFile(
     file_name: str,
     import_function: Callable[[str], pd.DataFrame] = pd.read_csv,
     fp_size: int = default_fp_size,
-) -> pd.DataFrame:
+    cache: Optional[FingerprintCache] = None,
+    fp_type: str = default_fp_type,
+    pool: Optional[multiprocessing.pool.Pool] = None,
+    calculate: Optional[Callable] = None,
+    counts: bool = False,
+    extra_fp_types: Sequence[str] = (),
+    backend: str = "process",
+    mol_store: Optional[MoleculeStore] = None,
+    standardizer: Optional[Standardizer] = None,
+    profile: str = "strict",
+    descriptors: Sequence[str] = (),
+) -> Tuple[pd.DataFrame, FeatureStore]:
     """
-    Reads data as CSV or TSV and calculates fingerprints from the SMILES in the data.
+    Reads data as CSV, TSV, SDF or SMILES file and calculates fingerprints from the
+    structures in the data, see detectImportFunction.
     :param import_function:
     :param file_name: Filename of CSV files containing the training data. The
         SMILES/Fingerprints are stored 1st column
     :param fp_size: Number of bits in the fingerprint
-    :return: Two pandas dataframe containing the X and Y matrix for training and/or prediction. If
-        no outcome data is provided, the Y matrix is a None object.
+    :param cache: Optional fingerprint cache, only cache misses are calculated
+    :param fp_type: Type of the fingerprint, one of fp_types
+    :param pool: Process pool calculating the fingerprints. If None, one is created.
+    :param calculate: Function calculating the fingerprints that are not cached, see
+        cachedFingerprints. Defaults to calculateFingerprintsParallel with pool.
+    :param counts: Calculate uint8 count fingerprints instead of packed bits
+    :param extra_fp_types: Further fingerprint types or concatenations that are calculated
+        from the same parse of each structure and stored as features "fp:<type>". They are
+        not calculated for converted data.
+    :param backend: Backend of the default calculation, one of fp_backends. "auto" uses a
+        thread pool instead of starting a process pool for small files, without isolating
+        structures that crash or hang, see calculateFingerprintSetParallel.
+    :param mol_store: Optional molecule store of the default calculation. Structures in it
+        are loaded instead of parsed and parsed structures are added, so that later stages
+        like the scaffold split do not parse them again.
+    :param standardizer: Optional standardizer. The structures are standardized with pool
+        and the fingerprints are calculated from the standardized SMILES, which are added
+        to the dataframe, see standardizeColumn.
+    :param profile: Parse profile of the calculation, one of parse_profiles, see
+        calculateFingerprints. It is ignored for converted data.
+    :param descriptors: Names of descriptors.descriptor_functions that are calculated with
+        pool and stored as feature descriptor_feature, see addDescriptors. They are also
+        calculated for converted data, from the structures stored with it.
+    :return: The dataframe with identifiers and outcome data and the FeatureStore holding
+        the packed fingerprints aligned to its index. Wide bit fingerprints are held as
+        SparseFingerprints, see use_sparse.
     """
-    # Read the data as Pandas pickle which already contains the calculated fingerprints
-    name, ext = os.path.splitext(file_name)
-    if ext == ".pkl":
-        return pd.read_pickle(file_name)
+    # Read converted data which already contains the calculated fingerprints
+    if isConverted(file_name):
+        df, features = loadConverted(file_name, fp_size, fp_type, counts)
+        if descriptors:
+            addDescriptors(df, features, descriptors, cache, pool, mol_store)
+        return df, features
 
     df = import_function(file_name)
+    if not df.index.is_unique:
+        df.reset_index(drop=True, inplace=True)
+    accessor = structure_column(df)
 
     # disable the rdkit logger. We know that some inchis will fail and we took care of it. No use to spam the console
     RDLogger.DisableLog("rdApp.*")
-    n_cores = multiprocessing.cpu_count()
-    df_split = np.array_split(df, n_cores)
-    with multiprocessing.Pool(n_cores) as pool:
-        df = pd.concat(pool.map(partial(addFPColumn, fp_size=fp_size), df_split))
-        pool.close()
-        pool.join()
-    return df
+    return df, _featureStore(
+        df,
+        accessor,
+        fp_size,
+        cache,
+        fp_type,
+        pool,
+        calculate,
+        counts,
+        extra_fp_types,
+        backend,
+        mol_store,
+        standardizer,
+        profile,
+        descriptors,
+    )
+
+
+def _featureStore(
+    df: pd.DataFrame,
+    accessor: str,
+    fp_size: int,
+    cache: Optional[FingerprintCache],
+    fp_type: str,
+    pool: Optional[multiprocessing.pool.Pool],
+    calculate: Optional[Callable],
+    counts: bool,
+    extra_fp_types: Sequence[str],
+    backend: str = "process",
+    mol_store: Optional[MoleculeStore] = None,
+    standardizer: Optional[Standardizer] = None,
+    profile: str = "strict",
+    descriptors: Sequence[str] = (),
+) -> FeatureStore:
+    """Calculates the fingerprints and descriptors of a dataframe, see importDataFile"""
+    if calculate is None:
+        calculate = partial(
+            calculateFingerprintSetParallel,
+            pool=pool,
+            backend=backend,
+            mol_store=mol_store,
+        )
+    elif extra_fp_types:
+        raise ValueError("Extra fingerprint types need the default calculation")
+    else:
+        calculate = partial(_calculateSingle, calculate=calculate)
+    structures, accessor = standardizeColumn(df, accessor, standardizer, pool)
+    (fp, *extra_fps), valid = cachedFingerprintSet(
+        structures,
+        accessor,
+        fp_size,
+        [fp_type, *extra_fp_types],
+        cache,
+        calculate=calculate,
+        counts=counts,
+        profile=profile,
+    )
+    features = FeatureStore(df.index, fp, valid, fp_size, fp_type, counts)
+    for extra_type, extra_fp in zip(extra_fp_types, extra_fps):
+        features.set(f"fp:{extra_type}", extra_fp, valid.copy())
+    if descriptors:
+        addDescriptors(df, features, descriptors, cache, pool, mol_store)
+    return features
+
+
+def iterDataFile(
+    file_name: str,
+    import_function: Callable[..., pd.DataFrame] = pd.read_csv,
+    fp_size: int = default_fp_size,
+    chunk_size: int = 100_000,
+    cache: Optional[FingerprintCache] = None,
+    fp_type: str = default_fp_type,
+    pool: Optional[multiprocessing.pool.Pool] = None,
+    calculate: Optional[Callable] = None,
+    counts: bool = False,
+    extra_fp_types: Sequence[str] = (),
+    backend: str = "process",
+    mol_store: Optional[MoleculeStore] = None,
+    standardizer: Optional[Standardizer] = None,
+    profile: str = "strict",
+    descriptors: Sequence[str] = (),
+) -> Iterator[Tuple[pd.DataFrame, FeatureStore]]:
+    """
+    Reads data as CSV, TSV, SDF or SMILES file in chunks of chunk_size rows and calculates
+    the fingerprints of each chunk, so that only one chunk of the input is held in memory.
+    All chunks are fingerprinted with the same process pool. The mol blocks of SDF files
+    are parsed by the workers of the pool.
+    :param file_name: Filename of the input file, optionally compressed with gzip or zstd.
+        Converted datasets are returned as one chunk.
+    :param import_function: Function reading the file. It is called with a chunksize argument
+        and needs to return an iterator over dataframes like pd.read_csv.
+    :param fp_size: Number of bits in the fingerprint
+    :param chunk_size: Number of rows per chunk
+    :param cache: Optional fingerprint cache, only cache misses are calculated
+    :param fp_type: Type of the fingerprint, one of fp_types
+    :param pool: Process pool calculating the fingerprints. If None, one is created for
+        all chunks.
+    :param calculate: Function calculating the fingerprints that are not cached, see
+        cachedFingerprints. Defaults to calculateFingerprintsParallel with pool.
+    :param counts: Calculate uint8 count fingerprints instead of packed bits
+    :param extra_fp_types: Further fingerprint types, see importDataFile
+    :param backend: Backend of the default calculation, one of fp_backends. Unless it is
+        "thread", one process pool is started for all chunks, which is then used for
+        chunks of any size.
+    :param mol_store: Optional molecule store, see importDataFile
+    :param standardizer: Optional standardizer, see importDataFile
+    :param profile: Parse profile, see importDataFile
+    :param descriptors: Names of descriptors to calculate, see importDataFile
+    :return: Iterator over the dataframe and FeatureStore of each chunk. The index of the
+        dataframes continues over the chunks.
+    """
+    if isConverted(file_name):
+        yield importDataFile(
+            file_name,
+            fp_size=fp_size,
+            cache=cache,
+            fp_type=fp_type,
+            pool=pool,
+            counts=counts,
+            mol_store=mol_store,
+            descriptors=descriptors,
+        )
+        return
+
+    # disable the rdkit logger. We know that some inchis will fail and we took care of it. No use to spam the console
+    RDLogger.DisableLog("rdApp.*")
+    if pool is None and calculate is None and backend != "thread":
+        with multiprocessing.Pool(resources.cpu_count()) as pool:
+            yield from iterDataFile(
+                file_name,
+                import_function,
+                fp_size,
+                chunk_size,
+                cache,
+                fp_type,
+                pool,
+                counts=counts,
+                extra_fp_types=extra_fp_types,
+                backend=backend,
+                mol_store=mol_store,
+                standardizer=standardizer,
+                profile=profile,
+                descriptors=descriptors,
+            )
+        return
+    for i, df in enumerate(import_function(file_name, chunksize=chunk_size)):
+        accessor = structure_column(df)
+        logging.info(
+            f"Calculating fingerprints of chunk {i} of {file_name} with {len(df)} rows"
+        )
+        yield df, _featureStore(
+            df,
+            accessor,
+            fp_size,
+            cache,
+            fp_type,
+            pool,
+            calculate,
+            counts,
+            extra_fp_types,
+            backend,
+            mol_store,
+            standardizer,
+            profile,
+            descriptors,
+        )
+
+
+def standardizeParallel(
+    structures: np.ndarray,
+    accessor: str,
+    standardizer: Standardizer,
+    pool: Optional[multiprocessing.pool.Pool] = None,
+) -> np.ndarray:
+    """
+    Standardizes structures with the process pool that calculates the fingerprints, see
+    standardize.standardizeStructure. Every distinct structure is standardized once, and
+    only if its result is not in the cache of the standardizer. New results are added to
+    the cache.
+    :param structures: SMILES or InChI strings or mol blocks
+    :param accessor: "smiles", "inchi" or "molblock"
+    :param standardizer: Cache of the standardized structures
+    :param pool: Pool to use. If None, up to settings.fp_thread_max_rows structures are
+        standardized in this process and more in a new pool.
+    :return: Object array of standardized SMILES, None where a structure is missing or
+        could not be standardized
+    """
+    # missing values get the code -1, which selects the None appended to the results
+    codes, unique = pd.factorize(structures)
+    unique = np.asarray(unique, dtype=object)
+    results, found = standardizer.lookup(unique, accessor)
+    standardized = np.array(results + [None], dtype=object)
+    missing = np.flatnonzero(~found)
+    if len(missing) > 0:
+        new_structures = unique[missing]
+        standardize = partial(standardizeStructures, accessor=accessor)
+        if pool is None and len(missing) <= settings.fp_thread_max_rows:
+            new_results = standardize(new_structures)
+        else:
+            n_chunks = min(
+                resources.cpu_count() * settings.fp_chunks_per_worker,
+                max(1, len(missing) // settings.fp_min_chunk_rows),
+            )
+            bounds = chunkBounds(new_structures, n_chunks, settings.fp_chunks_by_length)
+            chunks = [new_structures[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+            if pool is not None:
+                chunk_results = pool.map(standardize, chunks)
+            else:
+                with multiprocessing.Pool(resources.cpu_count()) as new_pool:
+                    chunk_results = new_pool.map(standardize, chunks)
+            new_results = [result for chunk in chunk_results for result in chunk]
+        for i, result in zip(missing, new_results):
+            standardized[i] = result
+        standardizer.store(new_structures, accessor, new_results)
+    standardizer.log_statistics()
+    return standardized[codes]
+
+
+def fingerprintedStructures(df: pd.DataFrame) -> Tuple[np.ndarray, str]:
+    """
+    The structures the features of a dataframe were calculated from: the standardized
+    structures if the dataframe holds them, see standardizeColumn, else the input column.
+    :return: The structures and their kind
+    """
+    if standardized_column in df:
+        return df[standardized_column].to_numpy(), "smiles"
+    accessor = structure_column(df)
+    return df[accessor].to_numpy(), accessor
+
+
+def standardizeColumn(
+    df: pd.DataFrame,
+    accessor: str,
+    standardizer: Optional[Standardizer],
+    pool: Optional[multiprocessing.pool.Pool] = None,
+) -> Tuple[np.ndarray, str]:
+    """
+    The structures the fingerprints of a dataframe are calculated from. With a
+    standardizer, the structures are standardized with standardizeParallel and stored in
+    the column standardized_column of df. The input column is kept.
+    :param df: Dataframe with the structures
+    :param accessor: Column of the structures, "smiles", "inchi" or "molblock"
+    :param standardizer: Optional standardizer, the structures are used as they are if None
+    :param pool: Process pool of standardizeParallel
+    :return: The structures and their kind
+    """
+    if standardizer is None:
+        return df[accessor].to_numpy(), accessor
+    structures = standardizeParallel(
+        df[accessor].to_numpy(), accessor, standardizer, pool
+    )
+    df[standardized_column] = structures
+    return structures, "smiles"
+
+
+def concatChunks(
+    chunks: Iterable[Tuple[pd.DataFrame, FeatureStore]],
+    fp_size: int = default_fp_size,
+    fp_type: str = default_fp_type,
+    counts: bool = False,
+) -> Tuple[pd.DataFrame, FeatureStore]:
+    """
+    Collects the chunks of iterDataFile into one dataframe and FeatureStore.
+    :param chunks: Dataframes and FeatureStores of the chunks
+    :param fp_size: Number of bits of the empty store returned for no chunks
+    :param fp_type: Fingerprint type of the empty store
+    :param counts: Whether the empty store holds count fingerprints
+    :return: The dataframe and FeatureStore of all chunks
+    """
+    dfs, stores = [], []
+    for df, features in chunks:
+        dfs.append(df)
+        stores.append(features)
+    if len(dfs) == 0:
+        empty = np.zeros((0, fingerprint_width(fp_size, counts)), dtype=np.uint8)
+        return pd.DataFrame(), FeatureStore(
+            pd.RangeIndex(0), empty, np.zeros(0, dtype=bool), fp_size, fp_type, counts
+        )
+    if len(dfs) == 1:
+        return dfs[0], stores[0]
+    return pd.concat(dfs), FeatureStore.concat(stores)
+
 
+def isConverted(file_name: str) -> bool:
+    """Whether file_name is a dataset directory or pickle written by convert_all"""
+    return is_dataset(file_name) or os.path.splitext(file_name)[1] == ".pkl"
 
-def importSmilesCSV(csvfilename: str) -> pd.DataFrame:
-    return pd.read_csv(csvfilename)
+
+def loadConverted(
+    file_name: str,
+    fp_size: int,
+    fp_type: str = default_fp_type,
+    counts: bool = False,
+) -> Tuple[pd.DataFrame, FeatureStore]:
+    """
+    Loads a dataset written by convert_all. Dataset directories are memory-mapped, pickles
+    are read with loadPickle. Fingerprints of foldable_fp_types that were stored with a
+    larger size are folded to fp_size, so that one conversion at high resolution, e.g.
+    with 16384 bits, serves all smaller power-of-two sizes.
+    :param file_name: Path to the dataset directory or .pkl file
+    :param fp_size: Number of bits the fingerprints are expected to have
+    :param fp_type: Type the fingerprints are expected to have
+    :param counts: Whether count fingerprints are expected
+    :return: The dataframe and its FeatureStore
+    """
+    if is_dataset(file_name):
+        df, features = load_dataset(file_name)
+    else:
+        df, features = loadPickle(file_name)
+    # Stores of older versions do not know their fingerprint type
+    if getattr(features, "fp_type", None) not in (None, fp_type):
+        raise ValueError(
+            f"{file_name} holds {features.fp_type} fingerprints but {fp_type} were requested"
+        )
+    if getattr(features, "counts", False) != counts:
+        raise ValueError(
+            f"{file_name} holds {'count' if not counts else 'bit'} fingerprints but "
+            f"{'count' if counts else 'bit'} fingerprints were requested"
+        )
+    if features.fp_size != fp_size:
+        if not canFold(features.fp_size, fp_size, features.fp_type, counts):
+            raise ValueError(
+                f"{file_name} holds fingerprints of {features.fp_size} bits but {fp_size} were requested"
+            )
+        logging.info(f"Folding fingerprints of {features.fp_size} bits to {fp_size}")
+        features = features.fold(fp_size)
+    return df, features
+
+
+def saveFingerprintRecord(directory: str, features: FeatureStore) -> str:
+    """
+    Records the fingerprints of features next to the models trained on them, see
+    checkFingerprintRecord
+    :return: Path of the record
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, fingerprint_record)
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "fp_size": features.fp_size,
+                "fp_type": features.fp_type,
+                "counts": features.counts,
+            },
+            f,
+        )
+    return path
+
+
+def checkFingerprintRecord(
+    directories: Sequence[str], features: FeatureStore, accessor: str
+) -> None:
+    """
+    Fails if features hold other fingerprints than the models in directories were trained
+    on. Models without a record (see saveFingerprintRecord) were trained on
+    legacy_fp_types.
+    :param directories: Directories searched for the first record
+    :param features: FeatureStore with the fingerprints to predict from
+    :param accessor: Kind of the input structures, "smiles", "inchi" or "molblock"
+    """
+    for directory in directories:
+        path = os.path.join(directory, fingerprint_record)
+        if os.path.isfile(path):
+            with open(path) as f:
+                record = json.load(f)
+            if (
+                record["fp_type"] != features.fp_type
+                or record["counts"] != features.counts
+            ):
+                raise ValueError(
+                    f"The model was trained on {record['fp_type']} "
+                    f"{'count' if record['counts'] else 'bit'} fingerprints (see {path}) "
+                    f"but {features.fp_type} {'count' if features.counts else 'bit'} "
+                    "fingerprints were calculated, set fpType and fpCounts accordingly"
+                )
+            return
+    legacy_type = legacy_fp_types.get(accessor)
+    if legacy_type is not None and legacy_type != features.fp_type:
+        raise ValueError(
+            f"The model has no {fingerprint_record}, so it was trained by a version that "
+            f"used {legacy_type} fingerprints for {accessor} input, but {features.fp_type} "
+            f"fingerprints were calculated. Set fpType to {legacy_type}."
+        )
+
+
+def canFold(
+    fp_size: int, target_size: int, fp_type: Optional[str], counts: bool = False
+) -> bool:
+    """
+    Whether fingerprints of fp_size bits can be folded to the fingerprints of target_size
+    bits that RDKit calculates, see features.fold_fingerprints.
+    """
+    return (
+        fp_type in foldable_fp_types[counts]
+        and target_size < fp_size
+        and fp_size % target_size == 0
+        and (counts or target_size % 8 == 0)
+    )
+
+
+def loadPickle(
+    file_name: str, fp_size: int = default_fp_size
+) -> Tuple[pd.DataFrame, FeatureStore]:
+    """
+    Loads a pickle written by convert_all of earlier versions. Pickles that store one
+    fingerprint object per dataframe row are converted into a FeatureStore.
+    :param file_name: Path to the .pkl file
+    :param fp_size: Number of bits of the fingerprints in a dataframe column
+    :return: The dataframe and its FeatureStore
+    """
+    data = pd.read_pickle(file_name)
+    if isinstance(data, tuple):
+        df, features = data
+    else:
+        df = data
+        # Pickles written before the fingerprints were bit-packed store one np.bool_ per bit
+        valid = df["fp"].notnull()
+        if valid.any() and df.loc[valid, "fp"].iloc[0].dtype == np.bool_:
+            fp_size = len(df.loc[valid, "fp"].iloc[0])
+            df.loc[valid, "fp"] = df.loc[valid, "fp"].apply(pack_fingerprints)
+        features = FeatureStore.from_column(df, fp_size)
+    return df, features
 
 
-def importDstoxTSV(tsvfilename: str) -> pd.DataFrame:
-    return pd.read_table(tsvfilename, names=["toxid", "inchi", "key"])
+def importSmilesCSV(
+    csvfilename: str, chunksize: Optional[int] = None
+) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    return pd.read_csv(csvfilename, chunksize=chunksize)
+
+
+def importDstoxTSV(
+    tsvfilename: str, chunksize: Optional[int] = None
+) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    return pd.read_table(
+        tsvfilename, names=["toxid", "inchi", "key"], chunksize=chunksize
+    )
 
 
 conversion_rules = {
@@ -147,20 +1855,281 @@ conversion_rules = {
 }
 
 
-def convert_all(directory: str) -> List[str]:
-    files = [
-        f
-        for f in os.listdir(directory)
-        for key, value in conversion_rules.items()
-        if isfile(join(directory, f)) and f in key
-    ]
+def _readTable(
+    file_name: str,
+    chunksize: Optional[int] = None,
+    sep: str = ",",
+    names: Optional[List[str]] = None,
+    header: Optional[int] = 0,
+) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    return pd.read_csv(
+        file_name, sep=sep, names=names, header=header, chunksize=chunksize
+    )
+
+
+def detectImportFunction(
+    file_name: str,
+) -> Callable[..., Union[pd.DataFrame, Iterator[pd.DataFrame]]]:
+    """
+    Detects the format of a data file from its extension and, for CSV and TSV files, their
+    first line. SDF (.sdf, .sd) and SMILES (.smi) files are streamed by dfpl.readers.
+    CSV and TSV files with a header need a column named smiles or inchi (in any case).
+    Files without a header, like the DSSTox tables, need a column of InChI strings. All
+    formats may be compressed with gzip (.gz) or zstd (.zst).
+    :param file_name: Path to the file
+    :return: Function reading the file like importSmilesCSV, optionally in chunks
+    """
+    if os.path.basename(file_name) in conversion_rules:
+        return conversion_rules[os.path.basename(file_name)]
+    ext = format_extension(file_name)
+    if ext in sdf_extensions:
+        return read_sdf
+    if ext in smi_extensions:
+        return read_smi
+    with open_text(file_name) as f:
+        first_line = f.readline().rstrip("\r\n")
+    if ext in (".tsv", ".tab"):
+        sep = "\t"
+    elif ext == ".csv":
+        sep = ","
+    else:
+        sep = "\t" if "\t" in first_line else ","
+    fields = next(csv.reader([first_line], delimiter=sep), [])
+    for i, field in enumerate(fields):
+        if field.strip().lower() in ("smiles", "inchi"):
+            names = list(fields)
+            names[i] = field.strip().lower()
+            return partial(_readTable, sep=sep, names=names, header=0)
+    for i, field in enumerate(fields):
+        if field.startswith("InChI="):
+            if len(fields) == 3 and i == 1:
+                names = ["toxid", "inchi", "key"]
+            else:
+                names = [f"column{j}" for j in range(len(fields))]
+                names[i] = "inchi"
+            return partial(_readTable, sep=sep, names=names, header=None)
+    raise ValueError(f"{file_name} has neither a smiles nor an inchi column")
+
+
+def findDataFiles(
+    directory: str, patterns: Optional[Sequence[str]] = None
+) -> List[str]:
+    """
+    Finds the data files to convert.
+    :param directory: Directory the patterns are relative to
+    :param patterns: Glob patterns, "**" matches subdirectories. If None, the file names
+        of conversion_rules are used.
+    :return: Sorted paths of the matching files
+    """
+    if patterns is None:
+        patterns = list(conversion_rules)
+    files = {
+        path
+        for pattern in patterns
+        for path in glob.glob(join(directory, pattern), recursive=True)
+        if isfile(path)
+    }
+    return sorted(files)
+
+
+def structureHashes(structures: Sequence[str]) -> np.ndarray:
+    """
+    64 bit content hashes of structures that are stored with a converted dataset
+    :param structures: SMILES or InChI strings
+    :return: uint64 array with one hash per structure
+    """
+    return pd.util.hash_array(np.asarray(structures, dtype=object))
+
+
+def _calculateReusing(
+    structures: np.ndarray,
+    accessor: str,
+    fp_size: int,
+    fp_type: str,
+    stored: StoredFingerprints,
+    calculate: Callable[[np.ndarray, str, int, str], Tuple[np.ndarray, np.ndarray]],
+    counts: bool = False,
+    profile: str = "strict",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Takes the fingerprints of structures from a previous conversion and calculates only
+    those of new structures with calculate.
+    """
+    fp, valid, found = stored.lookup(structureHashes(structures))
+    missing = np.flatnonzero(~found)
+    logging.info(
+        f"Reusing {len(structures) - len(missing)} fingerprints of the previous "
+        f"conversion, calculating {len(missing)}"
+    )
+    if len(missing) > 0:
+        fp[missing], valid[missing] = calculate(
+            structures[missing],
+            accessor,
+            fp_size,
+            fp_type,
+            counts=counts,
+            profile=profile,
+        )
+    return fp, valid
+
+
+def convertFile(
+    path: str,
+    cache: Optional[FingerprintCache] = None,
+    chunk_size: int = 0,
+    fp_type: str = default_fp_type,
+    pool: Optional[multiprocessing.pool.Pool] = None,
+    counts: bool = False,
+    fp_size: int = default_fp_size,
+    mol_store: Optional[MoleculeStore] = None,
+    standardizer: Optional[Standardizer] = None,
+    profile: str = "strict",
+    descriptors: Sequence[str] = (),
+) -> str:
+    """
+    Converts one data file into a dataset directory next to it. If the dataset exists from
+    an earlier conversion, only the fingerprints of added or changed rows are calculated
+    and the dataset is replaced when the new one is complete. Descriptors are written to
+    a float32 .npy file next to it with one row per input row, NaN where a structure is
+    invalid, which chemprop reads with --features_path.
+    :param path: Path to the data file, see detectImportFunction
+    :param cache: Optional fingerprint cache, only cache misses are calculated
+    :param chunk_size: Number of rows that are read at once. 0 reads the whole file.
+    :param fp_type: Type of the fingerprint, one of fp_types
+    :param pool: Process pool calculating the fingerprints
+    :param counts: Calculate uint8 count fingerprints instead of packed bits
+    :param fp_size: Number of bits in the fingerprint. Wide fingerprints are stored as set
+        bit positions, see use_sparse.
+    :param mol_store: Optional molecule store, see importDataFile
+    :param standardizer: Optional standardizer, see importDataFile. It runs on pool.
+    :param profile: Parse profile, see importDataFile
+    :param descriptors: Names of descriptors to calculate, see importDataFile
+    :return: Path of the dataset directory
+    """
+    import_function = detectImportFunction(path)
+    logging.info(f"Importing file {path}")
+    base_name = os.path.splitext(strip_compression(path))[0]
+    output_directory = base_name + dataset_extension
+    # only the fingerprints of rows that were added or changed since the last conversion
+    # are calculated
+    calculate = partial(calculateFingerprintsParallel, pool=pool, mol_store=mol_store)
+    # fingerprints of another standardization or parse profile are not reused
+    fingerprint_settings = {
+        "standardizer": standardizer_version if standardizer is not None else "",
+        "profile": profile,
+    }
+    stored = open_stored_fingerprints(
+        output_directory, fp_size, fp_type, counts, fingerprint_settings
+    )
+    if stored is not None:
+        calculate = partial(_calculateReusing, stored=stored, calculate=calculate)
+    if chunk_size > 0:
+        chunks = iterDataFile(
+            path,
+            import_function=import_function,
+            fp_size=fp_size,
+            chunk_size=chunk_size,
+            cache=cache,
+            fp_type=fp_type,
+            pool=pool,
+            calculate=calculate,
+            counts=counts,
+            standardizer=standardizer,
+            profile=profile,
+            descriptors=descriptors,
+        )
+    else:
+        chunks = [
+            importDataFile(
+                path,
+                import_function=import_function,
+                fp_size=fp_size,
+                cache=cache,
+                fp_type=fp_type,
+                pool=pool,
+                calculate=calculate,
+                counts=counts,
+                standardizer=standardizer,
+                profile=profile,
+                descriptors=descriptors,
+            )
+        ]
+    # chunks are written one after another, so only one of them is held in memory
+    writer = DatasetWriter(
+        output_directory, fp_size, fp_type, counts, fingerprint_settings
+    )
+    descriptor_chunks = []
+    for df, features in chunks:
+        # the next conversion looks up the structures it fingerprints, which are the
+        # standardized ones with a standardizer
+        writer.append(df, features, structureHashes(fingerprintedStructures(df)[0]))
+        if descriptors:
+            descriptor_chunks.append(features[descriptor_feature])
+    writer.close()
+    logging.info(f"Saved dataset {output_directory}")
+    if descriptors:
+        np.save(base_name + descriptors_extension, np.concatenate(descriptor_chunks))
+        logging.info(f"Saved descriptors {base_name + descriptors_extension}")
+    return output_directory
+
+
+def convert_all(
+    directory: str,
+    patterns: Optional[Sequence[str]] = None,
+    cache: Optional[FingerprintCache] = None,
+    chunk_size: int = 0,
+    fp_type: str = default_fp_type,
+    parallel_files: int = 4,
+    counts: bool = False,
+    fp_size: int = default_fp_size,
+    mol_store: Optional[MoleculeStore] = None,
+    standardizer: Optional[Standardizer] = None,
+    profile: str = "strict",
+    descriptors: Sequence[str] = (),
+) -> List[str]:
+    """
+    Converts all data files matching the patterns into dataset directories. All files share
+    one process pool: up to parallel_files files are read and written at the same time while
+    the chunks of all of them are fingerprinted by the pool. Files that cannot be converted
+    are logged and skipped.
+    :param directory: Directory the patterns are relative to
+    :param patterns: Glob patterns of the files, see findDataFiles
+    :param cache: Optional fingerprint cache, only cache misses are calculated
+    :param chunk_size: Number of rows that are read at once. 0 reads whole files.
+    :param fp_type: Type of the fingerprint, one of fp_types
+    :param parallel_files: Number of files that are converted at the same time
+    :param counts: Calculate uint8 count fingerprints instead of packed bits
+    :param fp_size: Number of bits in the fingerprint
+    :param mol_store: Optional molecule store, see importDataFile
+    :param standardizer: Optional standardizer, see importDataFile
+    :param profile: Parse profile, see importDataFile
+    :param descriptors: Names of descriptors to calculate, see convertFile
+    :return: Paths of the converted files
+    """
+    files = findDataFiles(directory, patterns)
     logging.info(f"Found {len(files)} files to convert")
-    for f in files:
-        path = join(directory, f)
-        logging.info(f"Importing file {f}")
-        df = importDataFile(path, import_function=conversion_rules[f])
-        name, ext = os.path.splitext(f)
-        output_file = join(directory, name + ".pkl")
-        logging.info(f"Saving pickle of file {f}")
-        df.to_pickle(output_file)
-    return files
+    RDLogger.DisableLog("rdApp.*")
+    converted = []
+    with multiprocessing.Pool(resources.cpu_count()) as pool:
+        convert = partial(
+            convertFile,
+            cache=cache,
+            chunk_size=chunk_size,
+            fp_type=fp_type,
+            pool=pool,
+            counts=counts,
+            fp_size=fp_size,
+            mol_store=mol_store,
+            standardizer=standardizer,
+            profile=profile,
+            descriptors=descriptors,
+        )
+        with ThreadPoolExecutor(max(1, parallel_files)) as executor:
+            futures = {executor.submit(convert, f): f for f in files}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    converted.append(futures[future])
+                except (ValueError, OSError, ImportError, pd.errors.ParserError) as e:
+                    logging.error(f"Could not convert {futures[future]}: {e}")
+    return sorted(converted)
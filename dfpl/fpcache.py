@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Persistent on-disk cache of calculated fingerprints"""
+import hashlib
+import logging
+import time
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+from dfpl import settings
+from dfpl.sqlitestore import SQLiteStore
+
+
+class FingerprintCache(SQLiteStore):
+    """
+    SQLite file that maps a hash of an input structure and the fingerprint parameters to the
+    packed fingerprint. Structures for which no fingerprint could be calculated are cached as
+    well, so that they are not parsed again. The number of entries is bounded and the least
+    recently used entries are evicted first. A cache can be shared by several threads.
+    """
+
+    # Number of looked up entries whose time of use is kept in memory before it is written
+    _touch_batch_size = 10_000
+
+    def __init__(
+        self, file_name: str, max_entries: int = settings.fp_cache_max_entries
+    ):
+        """
+        :param file_name: Path to the SQLite file. It is created if it does not exist.
+        :param max_entries: Maximal number of cached fingerprints
+        """
+        super().__init__(
+            file_name, "fingerprints", {"fp": "BLOB", "last_used": "INTEGER NOT NULL"}
+        )
+        self.max_entries = max_entries
+        # time of the last lookup of entries that is not yet written
+        self.touched: Dict[bytes, int] = {}
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS fingerprints_last_used "
+            "ON fingerprints (last_used)"
+        )
+        self.connection.commit()
+        # counted once, then kept up to date by store; entries written by other
+        # processes are only counted when the cache is opened again
+        (self.entries,) = self.connection.execute(
+            "SELECT COUNT(*) FROM fingerprints"
+        ).fetchone()
+
+    @staticmethod
+    def key(structure: str, fp_kind: str) -> bytes:
+        """
+        Content address of a structure.
+        :param structure: SMILES or InChI string
+        :param fp_kind: Fingerprint type and parameters, e.g. "smiles:morgan:2:2048"
+        :return: Hash of both
+        """
+        return hashlib.blake2b(
+            f"{fp_kind}\0{structure}".encode(), digest_size=16
+        ).digest()
+
+    def lookup(
+        self, structures: Sequence[str], fp_kind: str, width: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Looks up the fingerprints of structures.
+        :param structures: SMILES or InChI strings
+        :param fp_kind: Fingerprint type and parameters
+        :param width: Number of bytes of a packed fingerprint
+        :return: Matrix of packed fingerprints, boolean array marking valid fingerprints and
+            boolean array marking the structures that were found in the cache
+        """
+        keys = [self.key(structure, fp_kind) for structure in structures]
+        found, cached = self.lookup_keys(keys)
+        fp = np.zeros((len(keys), width), dtype=np.uint8)
+        valid = np.zeros(len(keys), dtype=bool)
+        for i, row in enumerate(found):
+            if row is not None:
+                fp[i] = np.frombuffer(row, dtype=np.uint8)
+                valid[i] = True
+        now = time.time_ns()
+        with self.lock:
+            self.touched.update((key, now) for key, hit in zip(keys, cached) if hit)
+            if len(self.touched) >= self._touch_batch_size:
+                self._writeTouched()
+                self.connection.commit()
+        return fp, valid, cached
+
+    def _writeTouched(self) -> None:
+        """Writes the kept times of use without committing, the lock needs to be held"""
+        self.connection.executemany(
+            "UPDATE fingerprints SET last_used = ? WHERE key = ?",
+            ((now, key) for key, now in self.touched.items()),
+        )
+        self.touched.clear()
+
+    def store(
+        self,
+        structures: Sequence[str],
+        fp_kind: str,
+        fp: np.ndarray,
+        valid: np.ndarray,
+    ) -> None:
+        """
+        Writes calculated fingerprints to the cache and evicts the least recently used
+        entries if the cache grows too large.
+        :param structures: SMILES or InChI strings
+        :param fp_kind: Fingerprint type and parameters
+        :param fp: Matrix of packed fingerprints, one row per structure
+        :param valid: Boolean array marking the structures with a fingerprint
+        """
+        now = time.time_ns()
+        with self.lock:
+            self._writeTouched()
+            # entries stored meanwhile by another process are kept, they are the same
+            self.entries += self._insert(
+                (
+                    (self.key(structure, fp_kind), row.tobytes() if ok else None, now)
+                    for structure, row, ok in zip(structures, fp, valid)
+                ),
+                replace=False,
+            )
+            if self.entries > self.max_entries:
+                logging.info(
+                    f"Evicting {self.entries - self.max_entries} fingerprints from cache "
+                    f"{self.file_name}"
+                )
+                self.entries -= self.connection.execute(
+                    "DELETE FROM fingerprints WHERE key IN "
+                    "(SELECT key FROM fingerprints ORDER BY last_used LIMIT ?)",
+                    (self.entries - self.max_entries,),
+                ).rowcount
+            self.connection.commit()
+
+    def log_statistics(self) -> None:
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        logging.info(
+            f"Fingerprint cache {self.file_name}: {self.hits} hits, {self.misses} misses "
+            f"({ratio:.1%} hit rate)"
+        )
+
+    def close(self) -> None:
+        with self.lock:
+            self._writeTouched()
+            self.connection.commit()
+        super().close()
@@ -0,0 +1,318 @@
+"""
+Keras building blocks that feed bit-packed and count fingerprints and descriptors into
+the networks
+"""
+import math
+import warnings
+from typing import Dict, List, Optional
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import InputLayer, Layer
+from tensorflow.keras.models import Model
+from tensorflow.keras.utils import Sequence
+
+from dfpl import settings
+from dfpl.features import (
+    FeatureMatrix,
+    SparseFingerprints,
+    count_max,
+    dense_rows,
+    fingerprint_width,
+    scale_counts,
+    split_descriptors,
+    unpack_fingerprints,
+)
+
+
+class UnpackBits(Layer):
+    """
+    Unpacks np.packbits-packed fingerprints (uint8, 8 bits per byte) into a float bit vector.
+    The fingerprints stay packed in memory and are only unpacked batch-wise inside the model.
+    """
+
+    def __init__(self, fp_size: int, **kwargs):
+        super().__init__(**kwargs)
+        self.fp_size = fp_size
+
+    def call(self, inputs):
+        # np.packbits stores the first bit in the most significant bit of each byte
+        shifts = tf.constant([7, 6, 5, 4, 3, 2, 1, 0], dtype=tf.int32)
+        x = tf.expand_dims(tf.cast(inputs, tf.int32), axis=-1)
+        bits = tf.bitwise.bitwise_and(tf.bitwise.right_shift(x, shifts), 1)
+        bits = tf.reshape(bits, (-1, inputs.shape[-1] * 8))[:, : self.fp_size]
+        return tf.cast(bits, self.compute_dtype)
+
+    def compute_output_shape(self, input_shape):
+        return tf.TensorShape(input_shape[:-1]).concatenate([self.fp_size])
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({"fp_size": self.fp_size})
+        return config
+
+
+class ScaleCounts(Layer):
+    """
+    Scales uint8 count fingerprints logarithmically to [0, 1], see features.scale_counts.
+    """
+
+    def call(self, inputs):
+        counts = tf.cast(inputs, self.compute_dtype)
+        return tf.math.log1p(counts) / math.log1p(count_max)
+
+
+def decode_fingerprints(fp_size: int, counts: bool) -> Layer:
+    """
+    Layer turning fingerprints as stored in the FeatureStore into float network input
+    :param fp_size: Number of bits or counts in the fingerprint
+    :param counts: Whether the fingerprints are uint8 counts instead of packed bits
+    """
+    return ScaleCounts() if counts else UnpackBits(fp_size)
+
+
+class DescriptorInput(Layer):
+    """
+    Splits input rows built with features.append_descriptors into the fingerprint and the
+    descriptors. The fingerprint is decoded like by decode_fingerprints, the descriptors
+    are standardized with the mean and standard deviation of the training data, see adapt.
+    Descriptors that could not be calculated (NaN) become 0, the mean.
+    """
+
+    def __init__(
+        self, n_descriptors: int, fp_size: int = 0, counts: bool = False, **kwargs
+    ):
+        """
+        :param n_descriptors: Number of descriptors at the end of each row
+        :param fp_size: Number of bits or counts of a packed fingerprint before them, 0 if
+            the rows hold float features like compressed fingerprints
+        :param counts: Whether the fingerprint holds uint8 counts instead of packed bits
+        """
+        super().__init__(**kwargs)
+        self.n_descriptors = n_descriptors
+        self.fp_size = fp_size
+        self.counts = counts
+        self.decode = decode_fingerprints(fp_size, counts) if fp_size else None
+
+    def build(self, input_shape):
+        shape = (self.n_descriptors,)
+        self.mean = self.add_weight(
+            name="mean", shape=shape, initializer="zeros", trainable=False
+        )
+        self.std = self.add_weight(
+            name="std", shape=shape, initializer="ones", trainable=False
+        )
+        super().build(input_shape)
+
+    def call(self, inputs):
+        if self.decode is not None:
+            width = fingerprint_width(self.fp_size, self.counts)
+            fp = self.decode(inputs[:, :width])
+            # the bytes of each float32 descriptor
+            raw = tf.reshape(inputs[:, width:], (-1, self.n_descriptors, 4))
+            descriptors = tf.bitcast(raw, tf.float32)
+        else:
+            fp = tf.cast(inputs[:, : -self.n_descriptors], self.compute_dtype)
+            descriptors = tf.cast(inputs[:, -self.n_descriptors :], tf.float32)
+        scaled = (descriptors - self.mean) / self.std
+        scaled = tf.where(tf.math.is_nan(scaled), tf.zeros_like(scaled), scaled)
+        return tf.concat([fp, tf.cast(scaled, self.compute_dtype)], axis=-1)
+
+    def compute_output_shape(self, input_shape):
+        fp_size = self.fp_size or input_shape[-1] - self.n_descriptors
+        return tf.TensorShape(input_shape[:-1]).concatenate(
+            [fp_size + self.n_descriptors]
+        )
+
+    def adapt(self, x: np.ndarray) -> None:
+        """
+        Sets the mean and standard deviation of the descriptors of training data
+        :param x: Input rows, see features.append_descriptors
+        """
+        descriptors = split_descriptors(x, self.n_descriptors).astype(np.float64)
+        # descriptors that are missing in all rows have no statistics
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean = np.nanmean(descriptors, axis=0)
+            std = np.nanstd(descriptors, axis=0)
+        mean[~np.isfinite(mean)] = 0.0
+        std[~np.isfinite(std) | (std == 0.0)] = 1.0
+        self.set_weights([mean.astype(np.float32), std.astype(np.float32)])
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(
+            {
+                "n_descriptors": self.n_descriptors,
+                "fp_size": self.fp_size,
+                "counts": self.counts,
+            }
+        )
+        return config
+
+
+def input_layers(
+    input_size: int, packed: bool, counts: bool = False, n_descriptors: int = 0
+) -> List[Layer]:
+    """
+    Input layers for a Sequential network.
+
+    :param input_size: Number of input features the first hidden layer sees
+    :param packed: Whether the input is a fingerprint of input_size bits as stored in the
+        FeatureStore
+    :param counts: Whether that fingerprint holds uint8 counts instead of packed bits
+    :param n_descriptors: Number of descriptors that follow the fingerprint in each row,
+        see DescriptorInput. The first hidden layer sees them in addition to input_size.
+    :return: List of layers that need to be added before the first hidden layer
+    """
+    if n_descriptors and packed:
+        width = fingerprint_width(input_size, counts) + 4 * n_descriptors
+        return [
+            InputLayer(input_shape=(width,), dtype=settings.df_fp_numpy_type),
+            DescriptorInput(n_descriptors, input_size, counts),
+        ]
+    if n_descriptors:
+        return [
+            InputLayer(input_shape=(input_size + n_descriptors,)),
+            DescriptorInput(n_descriptors),
+        ]
+    if not packed:
+        return [InputLayer(input_shape=(input_size,))]
+    return [
+        InputLayer(
+            input_shape=(fingerprint_width(input_size, counts),),
+            dtype=settings.df_fp_numpy_type,
+        ),
+        decode_fingerprints(input_size, counts),
+    ]
+
+
+def adapt_descriptor_inputs(model: Model, x: np.ndarray) -> None:
+    """
+    Adapts the DescriptorInput layers of a model to its training data, see
+    DescriptorInput.adapt. Models without descriptors are left as they are.
+    """
+    for layer in model.layers:
+        if isinstance(layer, DescriptorInput):
+            layer.adapt(x)
+
+
+class PackedAutoencoderSequence(Sequence):
+    """
+    Batches of packed fingerprints for training an autoencoder. The input of each batch stays
+    packed and the reconstruction target is unpacked only for the current batch. Count
+    fingerprints are reconstructed as scaled counts. Optionally only the given row positions
+    of x are used, so that a split of a feature matrix does not need to be copied.
+    SparseFingerprints are packed per batch.
+    """
+
+    def __init__(
+        self,
+        x: FeatureMatrix,
+        fp_size: int,
+        batch_size: int,
+        shuffle: bool = True,
+        rows: Optional[np.ndarray] = None,
+        counts: bool = False,
+    ):
+        self.x = x
+        self.fp_size = fp_size
+        self.counts = counts
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.order = np.arange(x.shape[0]) if rows is None else np.array(rows)
+        self.on_epoch_end()
+
+    def __len__(self) -> int:
+        return math.ceil(len(self.order) / self.batch_size)
+
+    def __getitem__(self, item: int):
+        idx = np.sort(self.order[item * self.batch_size : (item + 1) * self.batch_size])
+        x = dense_rows(self.x, idx)
+        if self.counts:
+            return x, scale_counts(x, settings.ac_fp_batch_numpy_type)
+        return x, unpack_fingerprints(
+            x, self.fp_size, dtype=settings.ac_fp_batch_numpy_type
+        )
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.order)
+
+
+class FingerprintSequence(Sequence):
+    """
+    Batches of SparseFingerprints and their targets. Only the fingerprints of the current
+    batch are packed, so that wide fingerprints never exist as a dense matrix.
+    """
+
+    def __init__(
+        self,
+        x: SparseFingerprints,
+        y: Optional[np.ndarray] = None,
+        batch_size: int = 32,
+        shuffle: bool = False,
+    ):
+        self.x = x
+        self.y = y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.order = np.arange(len(x))
+        self.on_epoch_end()
+
+    def __len__(self) -> int:
+        return math.ceil(len(self.order) / self.batch_size)
+
+    def __getitem__(self, item: int):
+        idx = self.order[item * self.batch_size : (item + 1) * self.batch_size]
+        if self.y is None:
+            return dense_rows(self.x, idx)
+        return dense_rows(self.x, idx), self.y[idx]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.order)
+
+
+def model_inputs(
+    x: FeatureMatrix,
+    y: Optional[np.ndarray] = None,
+    batch_size: int = 32,
+    shuffle: bool = False,
+    validation_split: float = 0.0,
+) -> Dict:
+    """
+    Keyword arguments that pass a feature matrix and its targets to Model.fit, evaluate or
+    predict. SparseFingerprints are passed as FingerprintSequence.
+
+    :param x: Feature matrix
+    :param y: Targets, None for predict
+    :param batch_size: Number of rows per batch
+    :param shuffle: Whether the rows are shuffled after each epoch
+    :param validation_split: Fraction of the last rows that Model.fit holds out for validation
+    :return: Keyword arguments for the Model method
+    """
+    if not isinstance(x, SparseFingerprints):
+        inputs = {"x": x, "batch_size": batch_size}
+        if y is not None:
+            inputs["y"] = y
+        if validation_split > 0.0:
+            inputs["validation_split"] = validation_split
+        return inputs
+    inputs = {}
+    if validation_split > 0.0:
+        # Keras cannot split a Sequence, hold out the last rows like it does for arrays
+        split_at = int(math.floor(len(x) * (1.0 - validation_split)))
+        inputs["validation_data"] = FingerprintSequence(
+            x[split_at:], y[split_at:], batch_size
+        )
+        x, y = x[:split_at], y[:split_at]
+    inputs["x"] = FingerprintSequence(x, y, batch_size, shuffle)
+    return inputs
+
+
+def validation_inputs(x: FeatureMatrix, y: np.ndarray, batch_size: int = 32):
+    """validation_data for Model.fit, a FingerprintSequence for SparseFingerprints"""
+    if isinstance(x, SparseFingerprints):
+        return FingerprintSequence(x, y, batch_size)
+    return x, y
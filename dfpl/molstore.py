@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Persistent on-disk store of parsed RDKit molecules shared by the pipeline stages"""
+import hashlib
+import os
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from rdkit import Chem
+
+from dfpl.sqlitestore import SQLiteStore
+
+
+# Sanitization steps every fingerprint type depends on: normalized functional groups,
+# aromaticity and the smallest set of rings. See parseStructure.
+fast_sanitization = (
+    Chem.SanitizeFlags.SANITIZE_CLEANUP
+    | Chem.SanitizeFlags.SANITIZE_KEKULIZE
+    | Chem.SanitizeFlags.SANITIZE_SETAROMATICITY
+    | Chem.SanitizeFlags.SANITIZE_SYMMRINGS
+)
+
+
+def _parsePartially(
+    structure: str, accessor: str, sanitize: Chem.SanitizeFlags
+) -> Optional[Chem.Mol]:
+    """Parses a structure and runs only the sanitize steps, see parseStructure"""
+    if accessor == "smiles":
+        mol = Chem.MolFromSmiles(structure, sanitize=False)
+    elif accessor == "molblock":
+        mol = Chem.MolFromMolBlock(structure, sanitize=False, removeHs=False)
+    else:
+        # the InChI library and not the sanitization dominates the parse time
+        return Chem.MolFromInchi(structure)
+    if mol is None:
+        return None
+    # implicit hydrogens without the valence checks
+    mol.UpdatePropertyCache(strict=False)
+    mol = Chem.RemoveHs(mol, sanitize=False)
+    if (
+        Chem.SanitizeMol(mol, sanitize, catchErrors=True)
+        != Chem.SanitizeFlags.SANITIZE_NONE
+    ):
+        return None
+    return mol
+
+
+def parseStructure(
+    structure: str, accessor: str, sanitize: Optional[Chem.SanitizeFlags] = None
+) -> Optional[Chem.Mol]:
+    """
+    Parses and sanitizes a structure.
+    :param structure: SMILES, InChI or mol block
+    :param accessor: "smiles", "inchi" or "molblock", the kind of structure
+    :param sanitize: Sanitization steps of a partial parse, e.g. fast_sanitization. It skips
+        the valence checks and the stereochemistry perception of a full parse and is meant
+        for trusted input that a full parse accepts. None sanitizes fully.
+    :return: The molecule, None if the structure cannot be parsed or is no string
+    """
+    if not isinstance(structure, str):
+        return None
+    if sanitize is not None:
+        return _parsePartially(structure, accessor, sanitize)
+    if accessor == "smiles":
+        return Chem.MolFromSmiles(structure)
+    if accessor == "molblock":
+        return Chem.MolFromMolBlock(structure)
+    return Chem.MolFromInchi(structure)
+
+
+class MoleculeStore(SQLiteStore):
+    """
+    SQLite file that maps a hash of an input structure to its sanitized RDKit molecule in
+    binary form (Chem.Mol.ToBinary), which is much faster to load than parsing the
+    structure again. Fingerprints, splits and descriptors then parse each structure once
+    per dataset instead of once per stage. Structures that cannot be parsed are stored
+    as well, so that they are not parsed again. The file can be written by several
+    processes, e.g. the fingerprint workers, and a store can be shared by several threads.
+    """
+
+    def __init__(self, file_name: str):
+        """
+        :param file_name: Path to the SQLite file. It is created if it does not exist.
+        """
+        super().__init__(file_name, "molecules", {"mol": "BLOB"})
+
+    @staticmethod
+    def key(structure: str, accessor: str) -> bytes:
+        """
+        Content address of a structure.
+        :param structure: SMILES or InChI string
+        :param accessor: "smiles" or "inchi"
+        :return: Hash of both
+        """
+        return hashlib.blake2b(
+            f"{accessor}\0{structure}".encode(), digest_size=16
+        ).digest()
+
+    def lookup(
+        self, structures: Sequence[str], accessor: str
+    ) -> Tuple[List[Optional[bytes]], np.ndarray]:
+        """
+        Looks up the molecules of structures.
+        :param structures: SMILES or InChI strings, missing values are never found
+        :param accessor: "smiles" or "inchi"
+        :return: Binary molecule of each structure, None if it is not stored or could not be
+            parsed, and a boolean array marking the structures that were found
+        """
+        return self.lookup_keys(
+            [
+                self.key(structure, accessor) if isinstance(structure, str) else None
+                for structure in structures
+            ]
+        )
+
+    def store(
+        self,
+        structures: Sequence[str],
+        accessor: str,
+        binaries: Sequence[Optional[bytes]],
+    ) -> None:
+        """
+        Writes molecules to the store.
+        :param structures: SMILES or InChI strings
+        :param accessor: "smiles" or "inchi"
+        :param binaries: Binary molecule of each structure, None if it could not be parsed
+        """
+        self.store_items(
+            (self.key(structure, accessor), binary)
+            for structure, binary in zip(structures, binaries)
+            if isinstance(structure, str)
+        )
+
+    def molecules(
+        self, structures: Sequence[str], accessor: str
+    ) -> List[Optional[Chem.Mol]]:
+        """
+        Molecules of structures. Structures that are not in the store are parsed and added.
+        :param structures: SMILES or InChI strings
+        :param accessor: "smiles" or "inchi"
+        :return: The molecule of each structure, None if it cannot be parsed
+        """
+        binaries, cached = self.lookup(structures, accessor)
+        mols = [Chem.Mol(binary) if binary is not None else None for binary in binaries]
+        missing = np.flatnonzero(~cached)
+        for i in missing:
+            mols[i] = parseStructure(structures[i], accessor)
+        if len(missing) > 0:
+            self.store(
+                [structures[i] for i in missing],
+                accessor,
+                [mols[i].ToBinary() if mols[i] is not None else None for i in missing],
+            )
+        return mols
+
+
+@lru_cache(maxsize=None)
+def _openStore(file_name: str, pid: int) -> MoleculeStore:
+    return MoleculeStore(file_name)
+
+
+def molecule_store(file_name: str) -> Optional[MoleculeStore]:
+    """
+    The molecule store of a file, opened once per process and shared by all stages of it.
+    A forked worker process opens its own connection to the file.
+    :param file_name: Path to the SQLite file, the store is disabled if it is empty
+    :return: The store or None
+    """
+    if not file_name:
+        return None
+    return _openStore(os.path.abspath(file_name), os.getpid())
@@ -9,8 +9,35 @@ import jsonpickle
 import torch
 from chemprop.args import TrainArgs
 
+from dfpl import settings
+from dfpl.descriptors import descriptorNames
 from dfpl.utils import parseCmdArgs
 
+fingerprint_types = ["topological", "MACCS", "atompairs", "morgan"]
+
+
+def fingerprintType(value: str) -> str:
+    """
+    Type of --fpType: one of fingerprint_types or a concatenation of them like morgan+MACCS
+    """
+    if not all(part in fingerprint_types for part in value.split("+")):
+        raise argparse.ArgumentTypeError(
+            f"invalid fingerprint type '{value}', use one of {fingerprint_types} or a "
+            "concatenation like morgan+MACCS"
+        )
+    return value
+
+
+def descriptorSet(value: str) -> str:
+    """
+    Type of --descriptors: comma-separated RDKit descriptor names, "default" or "all"
+    """
+    try:
+        descriptorNames(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
 
 @dataclass
 class Options:
@@ -26,9 +53,23 @@ class Options:
     ecModelDir: str = "AE_encoder"
     fnnModelDir: str = "modeltraining"
     type: str = "smiles"
-    fpType: str = "topological"  # also "MACCS", "atompairs"
+    fpType: str = "topological"  # also "MACCS", "atompairs", "morgan"
+    fpCounts: bool = False  # uint8 count fingerprints instead of bits
+    fpMinFrequency: float = 0.0  # bits set in fewer training fingerprints are removed
+    fpMaxFrequency: float = 1.0  # bits set in more training fingerprints are removed
     epochs: int = 512
     fpSize: int = 2048
+    cacheFile: str = ""  # SQLite fingerprint cache, disabled if empty
+    cacheSize: int = (
+        settings.fp_cache_max_entries
+    )  # maximal number of cached fingerprints
+    molStoreFile: str = ""  # SQLite store of parsed molecules, disabled if empty
+    standardize: bool = False  # strip salts, neutralize and canonicalize tautomers
+    standardizeCacheFile: str = ""  # SQLite cache of standardized structures
+    parseProfile: str = "strict"  # "fast" only sanitizes what the fingerprints need
+    descriptors: str = ""  # RDKit descriptors fed to the FNN next to the fingerprints
+    chunkSize: int = 0  # rows per chunk of a streamed import, 0 imports the whole file
+    threads: int = 0  # CPUs of the fingerprint workers, TF and torch, 0 detects them
     encFPSize: int = 256
     kFolds: int = 0
     testSize: float = 0.2
@@ -101,6 +142,7 @@ class GnnOptions(TrainArgs):
     preds_path: str = "./tox21dmpnn.csv"
     test_path: str = ""
     save_preds: bool = True
+    threads: int = 0
 
     @classmethod
     def fromCmdArgs(cls, args: argparse.Namespace, json_config: Optional[dict] = None):
@@ -150,10 +192,16 @@ def createCommandlineParser() -> argparse.ArgumentParser:
     parseInputPredict(parser_predict)
 
     parser_convert = subparsers.add_parser(
-        "convert", help="Convert known data files to pickle serialization files"
+        "convert", help="Convert data files to datasets with precalculated fingerprints"
     )
     parser_convert.set_defaults(method="convert")
     parseInputConvert(parser_convert)
+
+    parser_lookup = subparsers.add_parser(
+        "lookup", help="Look up compounds in a converted dataset by their identifiers"
+    )
+    parser_lookup.set_defaults(method="lookup")
+    parseInputLookup(parser_lookup)
     return parser
 
 
@@ -184,7 +232,9 @@ def parseInputTrain(parser: argparse.ArgumentParser) -> None:
         metavar="FILE",
         type=str,
         help="The file containing the data for training in "
-        "comma separated CSV format.The first column should be smiles.",
+        "comma separated CSV format.The first column should be smiles. "
+        "SDF (.sdf) and SMILES (.smi) files and gzip (.gz) or zstd (.zst) compressed "
+        "files are read as well.",
         default=argparse.SUPPRESS,
     )
     general_args.add_argument(
@@ -225,9 +275,35 @@ def parseInputTrain(parser: argparse.ArgumentParser) -> None:
         "-k",
         "--fpType",
         metavar="STR",
-        type=str,
-        choices=["topological", "MACCS"],  # , 'atompairs', 'torsions'],
-        help="The type of fingerprint to be generated/used in input file.",
+        type=fingerprintType,
+        help="The type of fingerprint to be generated/used in input file: topological, MACCS, "
+        "atompairs or morgan, or a concatenation like morgan+MACCS whose parts share the "
+        "fingerprint size equally. MACCS keys fill the first 167 bits of their part.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--fpCounts",
+        metavar="BOOL",
+        type=bool,
+        help="Use count fingerprints with one count per position, saturated at 255, "
+        "instead of bits.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--fpMinFrequency",
+        metavar="FLOAT",
+        type=float,
+        help="Remove the fingerprint bits that are set in less than this fraction of the "
+        "training data. The kept bits are saved with the models and predict uses the same "
+        "bits.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--fpMaxFrequency",
+        metavar="FLOAT",
+        type=float,
+        help="Remove the fingerprint bits that are set in more than this fraction of the "
+        "training data.",
         default=argparse.SUPPRESS,
     )
     general_args.add_argument(
@@ -237,6 +313,84 @@ def parseInputTrain(parser: argparse.ArgumentParser) -> None:
         help="Size of fingerprint that should be generated.",
         default=argparse.SUPPRESS,
     )
+    general_args.add_argument(
+        "--cacheFile",
+        metavar="FILE",
+        type=str,
+        help="SQLite file that caches calculated fingerprints between runs. "
+        "Only fingerprints of new structures are calculated. Disabled if empty.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--chunkSize",
+        metavar="INT",
+        type=int,
+        help="Read the input file in chunks of this many rows to limit the memory usage. "
+        "0 reads the whole file at once.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--cacheSize",
+        metavar="INT",
+        type=int,
+        help="Maximal number of fingerprints in the cache. The least recently used ones are evicted first.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--molStoreFile",
+        metavar="FILE",
+        type=str,
+        help="SQLite file that keeps the parsed molecules of the input structures between "
+        "stages and runs, so that the fingerprints and the scaffold and molecular weight "
+        "splits parse each structure only once. Disabled if empty.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--standardize",
+        metavar="BOOL",
+        type=bool,
+        help="Standardize the structures before the fingerprints are calculated: strip "
+        "salts, neutralize charges and choose the canonical tautomer. The standardized "
+        "SMILES are added to the data as column standardized_smiles.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--standardizeCacheFile",
+        metavar="FILE",
+        type=str,
+        help="SQLite file that keeps the standardized structures between runs, so that "
+        "each distinct structure is standardized only once. Disabled if empty.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--parseProfile",
+        metavar="STR",
+        type=str,
+        choices=["strict", "fast"],
+        help="How the structures are parsed. 'strict' fully sanitizes each molecule, "
+        "'fast' skips the checks and perception steps the fingerprint type does not "
+        "need, which yields the same fingerprints for valid structures but also accepts "
+        "some structures with invalid valences.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--descriptors",
+        metavar="STR",
+        type=descriptorSet,
+        help="RDKit 2D descriptors that are calculated next to the fingerprints and fed "
+        "to the single-label FNN after them: comma-separated names of "
+        "rdkit.Chem.Descriptors.descList, 'default' for a set of 12 physico-chemical "
+        "descriptors or 'all'. Empty disables them.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--threads",
+        metavar="INT",
+        type=int,
+        help="Number of CPUs used by the fingerprint workers, TensorFlow and PyTorch. "
+        "0 detects them from the CPU affinity, the cgroup CPU quota and SLURM_CPUS_PER_TASK.",
+        default=argparse.SUPPRESS,
+    )
     general_args.add_argument(
         "-c",
         "--compressFeatures",
@@ -504,6 +658,13 @@ def parseTrainGnn(parser: argparse.ArgumentParser) -> None:
     general_args.add_argument("--split_key_molecule", type=int)
     general_args.add_argument("--pytorch_seed", type=int)
     general_args.add_argument("--cache_cutoff", type=float)
+    general_args.add_argument(
+        "--threads",
+        type=int,
+        metavar="INT",
+        default=0,
+        help="Number of CPUs used by PyTorch and the data loading workers, 0 detects them",
+    )
     general_args.add_argument("--save_preds", type=bool)
     general_args.add_argument(
         "--cuda", action="store_true", default=False, help="Turn on cuda"
@@ -1028,7 +1189,9 @@ def parseInputPredict(parser: argparse.ArgumentParser) -> None:
         "An optional column 'id' is used to assign the outcomes to the"
         "original identifiers. If this column is missing, the results are"
         "numbered in the order of their appearance in the input file."
-        "A header is expected and respective column names are used.",
+        "A header is expected and respective column names are used. "
+        "SDF (.sdf) and SMILES (.smi) files and gzip (.gz) or zstd (.zst) compressed "
+        "files are read as well.",
         default=argparse.SUPPRESS,
     )
     files_args.add_argument(
@@ -1061,9 +1224,96 @@ def parseInputPredict(parser: argparse.ArgumentParser) -> None:
         "-k",
         "--fpType",
         metavar="STR",
+        type=fingerprintType,
+        help="The type of fingerprint to be generated/used in input file: topological, MACCS, "
+        "atompairs or morgan, or a concatenation like morgan+MACCS whose parts share the "
+        "fingerprint size equally. MACCS keys fill the first 167 bits of their part.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--fpCounts",
+        metavar="BOOL",
+        type=bool,
+        help="Use count fingerprints with one count per position, saturated at 255, "
+        "instead of bits.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--cacheFile",
+        metavar="FILE",
+        type=str,
+        help="SQLite file that caches calculated fingerprints between runs. "
+        "Only fingerprints of new structures are calculated. Disabled if empty.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--chunkSize",
+        metavar="INT",
+        type=int,
+        help="Read the input file in chunks of this many rows to limit the memory usage. "
+        "0 reads the whole file at once.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--cacheSize",
+        metavar="INT",
+        type=int,
+        help="Maximal number of fingerprints in the cache. The least recently used ones are evicted first.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--molStoreFile",
+        metavar="FILE",
+        type=str,
+        help="SQLite file that keeps the parsed molecules of the input structures between "
+        "stages and runs, so that the fingerprints and the scaffold and molecular weight "
+        "splits parse each structure only once. Disabled if empty.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--standardize",
+        metavar="BOOL",
+        type=bool,
+        help="Standardize the structures before the fingerprints are calculated: strip "
+        "salts, neutralize charges and choose the canonical tautomer. The standardized "
+        "SMILES are added to the data as column standardized_smiles.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--standardizeCacheFile",
+        metavar="FILE",
         type=str,
-        choices=["topological", "MACCS"],  # , 'atompairs', 'torsions'],
-        help="The type of fingerprint to be generated/used in input file.",
+        help="SQLite file that keeps the standardized structures between runs, so that "
+        "each distinct structure is standardized only once. Disabled if empty.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--parseProfile",
+        metavar="STR",
+        type=str,
+        choices=["strict", "fast"],
+        help="How the structures are parsed. 'strict' fully sanitizes each molecule, "
+        "'fast' skips the checks and perception steps the fingerprint type does not "
+        "need, which yields the same fingerprints for valid structures but also accepts "
+        "some structures with invalid valences.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--descriptors",
+        metavar="STR",
+        type=descriptorSet,
+        help="RDKit 2D descriptors that are calculated next to the fingerprints and fed "
+        "to the single-label FNN after them: comma-separated names of "
+        "rdkit.Chem.Descriptors.descList, 'default' for a set of 12 physico-chemical "
+        "descriptors or 'all'. Empty disables them.",
+        default=argparse.SUPPRESS,
+    )
+    general_args.add_argument(
+        "--threads",
+        metavar="INT",
+        type=int,
+        help="Number of CPUs used by the fingerprint workers, TensorFlow and PyTorch. "
+        "0 detects them from the CPU affinity, the cgroup CPU quota and SLURM_CPUS_PER_TASK.",
         default=argparse.SUPPRESS,
     )
     files_args.add_argument(
@@ -1117,6 +1367,13 @@ def parsePredictGnn(parser: argparse.ArgumentParser) -> None:
     general_args.add_argument(
         "--no_cuda", action="store_true", default=False, help="Turn off cuda"
     )
+    general_args.add_argument(
+        "--threads",
+        type=int,
+        metavar="INT",
+        default=0,
+        help="Number of CPUs used by PyTorch and the data loading workers, 0 detects them",
+    )
     general_args.add_argument(
         "--num_workers",
         type=int,
@@ -1266,3 +1523,158 @@ def parseInputConvert(parser: argparse.ArgumentParser) -> None:
         required=True,
         default="",
     )
+    parser.add_argument(
+        "--pattern",
+        metavar="GLOB",
+        type=str,
+        nargs="+",
+        help="Glob patterns of the files to convert, relative to the input directory. "
+        "'**' matches subdirectories. The format of each file is detected from its "
+        "extension and first line, SDF (.sdf) and SMILES (.smi) files and their gzip (.gz) "
+        "or zstd (.zst) compressed versions are converted as well. By default only the files S_dataset.csv, smiles.csv and inchi.tsv are "
+        "converted.",
+        default=None,
+    )
+    parser.add_argument(
+        "--parallelFiles",
+        metavar="INT",
+        type=int,
+        help="Number of files that are converted at the same time. The fingerprints of all "
+        "files are calculated by one shared process pool.",
+        default=4,
+    )
+    parser.add_argument(
+        "--cacheFile",
+        metavar="FILE",
+        type=str,
+        help="SQLite file that caches calculated fingerprints between runs. Disabled if empty.",
+        default="",
+    )
+    parser.add_argument(
+        "--cacheSize",
+        metavar="INT",
+        type=int,
+        help="Maximal number of fingerprints in the cache. The least recently used ones are evicted first.",
+        default=settings.fp_cache_max_entries,
+    )
+    parser.add_argument(
+        "--molStoreFile",
+        metavar="FILE",
+        type=str,
+        help="SQLite file that keeps the parsed molecules of the structures between runs and "
+        "stages. Disabled if empty.",
+        default="",
+    )
+    parser.add_argument(
+        "--standardize",
+        metavar="BOOL",
+        type=bool,
+        help="Standardize the structures before the fingerprints are calculated: strip "
+        "salts, neutralize charges and choose the canonical tautomer.",
+        default=False,
+    )
+    parser.add_argument(
+        "--standardizeCacheFile",
+        metavar="FILE",
+        type=str,
+        help="SQLite file that keeps the standardized structures between runs. Disabled if "
+        "empty.",
+        default="",
+    )
+    parser.add_argument(
+        "--parseProfile",
+        metavar="STR",
+        type=str,
+        choices=["strict", "fast"],
+        help="How the structures are parsed, 'fast' only runs the sanitization steps the "
+        "fingerprint type needs.",
+        default="strict",
+    )
+    parser.add_argument(
+        "--descriptors",
+        metavar="STR",
+        type=descriptorSet,
+        help="RDKit 2D descriptors that are written to <file>.descriptors.npy next to each "
+        "dataset, e.g. for the --features_path of the GNN: comma-separated names, "
+        "'default' or 'all'. Empty disables them.",
+        default="",
+    )
+    parser.add_argument(
+        "--chunkSize",
+        metavar="INT",
+        type=int,
+        help="Read the input files in chunks of this many rows. 0 reads each file at once.",
+        default=0,
+    )
+    parser.add_argument(
+        "--fpType",
+        metavar="STR",
+        type=fingerprintType,
+        help="The type of fingerprint to be generated, or a concatenation like morgan+MACCS.",
+        default="topological",
+    )
+    parser.add_argument(
+        "--fpCounts",
+        metavar="BOOL",
+        type=bool,
+        help="Calculate count fingerprints with one count per position, saturated at 255, "
+        "instead of bits.",
+        default=False,
+    )
+    parser.add_argument(
+        "--fpSize",
+        metavar="INT",
+        type=int,
+        help="Length of the fingerprint that should be generated. Fingerprints of at least "
+        "8192 bits are stored as the positions of their set bits.",
+        default=2048,
+    )
+    parser.add_argument(
+        "--threads",
+        metavar="INT",
+        type=int,
+        help="Number of fingerprint worker processes. 0 detects the available CPUs from the "
+        "CPU affinity, the cgroup CPU quota and SLURM_CPUS_PER_TASK.",
+        default=0,
+    )
+
+
+def parseInputLookup(parser: argparse.ArgumentParser) -> None:
+    """
+    Parse the input arguments.
+
+    :return: A namespace object built up from attributes parsed out of the cmd line.
+    """
+    parser.add_argument(
+        "-i",
+        "--inputFile",
+        metavar="DIR",
+        type=str,
+        help="Dataset directory (.dfpl) written by convert.",
+        required=True,
+    )
+    parser.add_argument(
+        "--ids",
+        metavar="ID",
+        type=str,
+        nargs="+",
+        help="Compound identifiers (e.g. toxid or cid values) or InChIKeys to look up.",
+        required=True,
+    )
+    parser.add_argument(
+        "--column",
+        metavar="STR",
+        type=str,
+        help="Identifier column to search. By default all indexed columns (id, cid, toxid, "
+        "key, inchikey) are searched.",
+        default=None,
+    )
+    parser.add_argument(
+        "-o",
+        "--outputFile",
+        metavar="FILE",
+        type=str,
+        help="CSV file receiving the found rows with their fingerprint as hex string. "
+        "Written to the standard output if empty.",
+        default="",
+    )
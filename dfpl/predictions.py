@@ -1,53 +1,80 @@
 import logging
 import os
+from typing import Optional
 
-import numpy as np
 import pandas as pd
+from tensorflow.keras.models import Model
 
-from dfpl import options, settings
+from dfpl import options
 from dfpl import single_label_model as sl
+from dfpl.features import FeatureStore
+from dfpl.layers import model_inputs
 
 
-def predict_values(df: pd.DataFrame, opts: options.Options) -> pd.DataFrame:
+def load_prediction_model(features: FeatureStore, opts: options.Options) -> Model:
+    """
+    Defines the model architecture based on the feature size and loads the trained weights.
+
+    :param features: FeatureStore holding the features that will be predicted.
+    :param opts: Model options including paths and feature types.
+    :return: Model with loaded weights.
+    """
+    # Uncompressed fingerprints are unpacked or scaled inside the model.
+    packed_input = not opts.compressFeatures
+    feature_input_size = (
+        opts.fpSize if packed_input else features["fpcompressed"].shape[1]
+    )
+    model = sl.define_single_label_model(
+        input_size=feature_input_size, opts=opts, packed_input=packed_input
+    )
+
+    # Load the model weights
+    weights_path = os.path.join(opts.fnnModelDir, "model_weights.h5")
+    model.load_weights(weights_path)
+    logging.info(f"Model weights loaded from {weights_path}")
+    return model
+
+
+def predict_values(
+    df: pd.DataFrame,
+    features: FeatureStore,
+    opts: options.Options,
+    model: Optional[Model] = None,
+) -> pd.DataFrame:
     """
     Predict a set of chemicals using a selected model.
 
-    :param df: Input DataFrame containing the features (either compressed or uncompressed).
+    :param df: Input DataFrame with the identifiers of the chemicals.
+    :param features: FeatureStore holding the features (either compressed or uncompressed) of df.
     :param opts: Model options including paths, feature types, and prediction preferences.
+    :param model: Model used for the prediction. If None, it is loaded with load_prediction_model.
     :return: DataFrame with predictions.
     """
 
     # Determine the correct feature column and input size
-    feature_column = "fpcompressed" if opts.compressFeatures else "fp"
-    sub_df = df[df[feature_column].notnull()]
+    feature_column = sl.input_feature(opts)
+    sub_df = df[features.valid(feature_column, df.index)].copy()
 
     if sub_df.empty:
         logging.warning(f"No valid features found in column '{feature_column}'")
         return pd.DataFrame()
 
+    if not opts.compressFeatures and features.counts != opts.fpCounts:
+        raise ValueError(
+            f"The model expects {'count' if opts.fpCounts else 'bit'} fingerprints"
+        )
+
     # Prepare the feature matrix for prediction
-    x = np.array(
-        sub_df[feature_column].to_list(),
-        dtype=settings.nn_fp_compressed_numpy_type
-        if opts.compressFeatures
-        else settings.nn_fp_numpy_type,
-        copy=settings.numpy_copy_values,
-    )
+    x = features.get(feature_column, sub_df.index)
     logging.info(
         f"{'Compressed' if opts.compressFeatures else 'Uncompressed'} FP matrix with shape {x.shape} and type {x.dtype}"
     )
 
-    # Define the model architecture based on the feature size
-    feature_input_size = x.shape[1]
-    model = sl.define_single_label_model(input_size=feature_input_size, opts=opts)
-
-    # Load the model weights
-    weights_path = os.path.join(opts.fnnModelDir, "model_weights.h5")
-    model.load_weights(weights_path)
-    logging.info(f"Model weights loaded from {weights_path}")
+    if model is None:
+        model = load_prediction_model(features, opts)
 
     # Make predictions
-    predictions = model.predict(x)
+    predictions = model.predict(**model_inputs(x))
 
     # Add predictions to the DataFrame
     sub_df["predicted"] = predictions
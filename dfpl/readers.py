@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming readers of SDF and SMILES files, optionally compressed with gzip or zstd.
+
+The readers only split the input into records and read the names and data fields of
+the molecules. Structures are not parsed here: the mol blocks of an SDF file are passed
+on as strings in the "molblock" column and parsed by the fingerprint workers, see
+fingerprint.calculateFingerprintSetParallel, so that parsing runs in parallel.
+"""
+import gzip
+import io
+import logging
+import os
+from typing import IO, Dict, Iterator, List, Optional, Union
+
+import pandas as pd
+
+# Extensions of compressed files and the compression pandas infers from them
+compressions = {".gz": "gzip", ".zst": "zstd"}
+sdf_extensions = [".sdf", ".sd"]
+smi_extensions = [".smi"]
+
+
+def strip_compression(file_name: str) -> str:
+    """
+    File name without the extension of its compression, e.g. "lib.sdf" for "lib.sdf.gz"
+    """
+    base, ext = os.path.splitext(file_name)
+    return base if ext.lower() in compressions else file_name
+
+
+def format_extension(file_name: str) -> str:
+    """Lower case extension of the file format, ignoring the compression"""
+    return os.path.splitext(strip_compression(file_name))[1].lower()
+
+
+def open_text(file_name: str) -> IO[str]:
+    """
+    Opens a text file for reading. Files ending in .gz or .zst are decompressed while they
+    are read. zstd needs the zstandard package.
+    :param file_name: Path to the file
+    :return: Text stream of the decompressed content
+    """
+    compression = compressions.get(os.path.splitext(file_name)[1].lower())
+    if compression == "gzip":
+        return gzip.open(file_name, "rt", encoding="utf-8")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                f"Reading {file_name} needs the zstandard package, "
+                "install it with 'pip install zstandard'"
+            ) from None
+        binary = zstandard.ZstdDecompressor().stream_reader(
+            open(file_name, "rb"), closefd=True
+        )
+        return io.TextIOWrapper(binary, encoding="utf-8")
+    return open(file_name, encoding="utf-8")
+
+
+def _records(lines: Iterator[str]) -> Iterator[List[str]]:
+    """Lines of each record of an SDF stream, without the $$$$ delimiter"""
+    record = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.startswith("$$$$"):
+            yield record
+            record = []
+        else:
+            record.append(line)
+    # the delimiter of the last record is often missing
+    if any(line.strip() for line in record):
+        yield record
+
+
+def _sdfRow(record: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Splits an SDF record into its mol block and data fields. The title line of the mol
+    block is the "name" of the molecule, a data field of that name replaces it.
+    """
+    end = next(
+        (i for i, line in enumerate(record) if line.startswith("M  END")),
+        len(record) - 1,
+    )
+    row = {
+        "molblock": "\n".join(record[: end + 1]) + "\n",
+        "name": record[0].strip() if record else None,
+    }
+    field, values = None, []
+    for line in record[end + 1 :]:
+        if line.startswith(">"):
+            start = line.find("<")
+            stop = line.find(">", start + 1)
+            field = line[start + 1 : stop] if 0 < start < stop else None
+            values = []
+        elif field is not None:
+            if line.strip():
+                values.append(line)
+            else:
+                row[field] = "\n".join(values)
+                field = None
+    if field is not None:
+        row[field] = "\n".join(values)
+    return row
+
+
+def _smiRows(lines: Iterator[str]) -> Iterator[Dict[str, Optional[str]]]:
+    """
+    Rows of a SMILES file: the SMILES and the name of a molecule separated by whitespace.
+    If the first line starts with the word "smiles", it holds the column names and each
+    line is split into as many fields.
+    """
+    names = ["smiles", "name"]
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if i == 0 and line.split()[0].lower() == "smiles":
+            names = ["smiles"] + line.split()[1:]
+            continue
+        fields = line.split(None, len(names) - 1)
+        yield dict(zip(names, fields))
+
+
+class _Chunks:
+    """
+    Collects rows into dataframes of chunk_size rows with a continuous index. All chunks
+    get the columns of the first one, since a converted dataset needs the same columns in
+    every chunk. Data fields that first appear in a later chunk are dropped. Data fields
+    whose values are all numbers in the first chunk are numeric in all of them, values of
+    later chunks that are no numbers become NaN. An empty file gives an empty dataframe
+    with the structure columns of its format.
+    """
+
+    def __init__(self, file_name: str, structure_columns: List[str]):
+        self.file_name = file_name
+        self.structure_columns = structure_columns
+        self.columns = None
+        self.numeric = []
+        self.rows = 0
+
+    def frame(self, rows: List[dict]) -> pd.DataFrame:
+        df = pd.DataFrame(
+            rows,
+            index=pd.RangeIndex(self.rows, self.rows + len(rows)),
+            columns=None if rows else self.structure_columns,
+            dtype=None if rows else object,
+        )
+        self.rows += len(rows)
+        if self.columns is None:
+            self.columns = list(df.columns)
+            for column in self.columns:
+                # structures and names stay strings, also if they look like numbers
+                if column in ("molblock", "smiles", "name"):
+                    continue
+                try:
+                    df[column] = pd.to_numeric(df[column])
+                    self.numeric.append(column)
+                except (ValueError, TypeError):
+                    pass
+            return df
+        dropped = [column for column in df.columns if column not in self.columns]
+        if dropped:
+            logging.warning(
+                f"Ignoring data fields {dropped} of {self.file_name} that are missing "
+                "in its first chunk"
+            )
+        df = df.reindex(columns=self.columns)
+        for column in self.numeric:
+            values = pd.to_numeric(df[column], errors="coerce")
+            coerced = int((values.isna() & df[column].notna()).sum())
+            if coerced:
+                logging.warning(
+                    f"Setting {coerced} values of data field {column} of "
+                    f"{self.file_name} to NaN, they are no numbers unlike the values "
+                    "in its first chunk"
+                )
+            df[column] = values
+        return df
+
+
+def _readRows(
+    file_name: str,
+    rows: Iterator[dict],
+    chunksize: Optional[int],
+    structure_columns: List[str],
+) -> Iterator[pd.DataFrame]:
+    chunks = _Chunks(file_name, structure_columns)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if chunksize and len(batch) == chunksize:
+            yield chunks.frame(batch)
+            batch = []
+    if batch or chunks.columns is None:
+        yield chunks.frame(batch)
+
+
+def _iterSDF(file_name: str, chunksize: Optional[int]) -> Iterator[pd.DataFrame]:
+    with open_text(file_name) as f:
+        yield from _readRows(
+            file_name, map(_sdfRow, _records(f)), chunksize, ["molblock", "name"]
+        )
+
+
+def _iterSMI(file_name: str, chunksize: Optional[int]) -> Iterator[pd.DataFrame]:
+    with open_text(file_name) as f:
+        yield from _readRows(file_name, _smiRows(f), chunksize, ["smiles", "name"])
+
+
+def read_sdf(
+    file_name: str, chunksize: Optional[int] = None
+) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    """
+    Reads an SDF file like pd.read_csv. Each record is a row with its mol block in the
+    "molblock" column, its title in "name" and a column per data field.
+    :param file_name: Path to the file, optionally compressed, see open_text
+    :param chunksize: If given, an iterator over chunks of that many rows is returned
+    :return: Dataframe or iterator over dataframes
+    """
+    if chunksize:
+        return _iterSDF(file_name, chunksize)
+    (df,) = _iterSDF(file_name, None)
+    return df
+
+
+def read_smi(
+    file_name: str, chunksize: Optional[int] = None
+) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    """
+    Reads a SMILES file like pd.read_csv into a "smiles" and a "name" column, see _smiRows.
+    :param file_name: Path to the file, optionally compressed, see open_text
+    :param chunksize: If given, an iterator over chunks of that many rows is returned
+    :return: Dataframe or iterator over dataframes
+    """
+    if chunksize:
+        return _iterSMI(file_name, chunksize)
+    (df,) = _iterSMI(file_name, None)
+    return df
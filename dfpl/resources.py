@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Number of CPUs this process may use and the thread pools that are sized from it.
+
+multiprocessing.cpu_count() reports every core of the host, also inside a Slurm
+allocation, a container with a CPU quota or a job bound to a few cores. The RDKit
+worker pool, TensorFlow and PyTorch (chemprop) would then each start one thread or
+process per host core. Here the CPUs are counted once from the affinity mask, the
+cgroup CPU quota and SLURM_CPUS_PER_TASK, and all pools are sized consistently.
+"""
+import logging
+import math
+import os
+from typing import List, Optional, Tuple
+
+# Root of the cgroup file system, see _cgroupQuota
+cgroup_root = "/sys/fs/cgroup"
+
+# Number of CPUs set by configure_threads, 0 uses the detected number
+_threads = 0
+
+
+def _affinityCpus() -> int:
+    """Number of CPUs in the affinity mask of this process"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _cgroupPaths() -> List[Tuple[str, str]]:
+    """Controllers and paths of the cgroups of this process, see /proc/self/cgroup"""
+    try:
+        with open("/proc/self/cgroup") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    paths = []
+    for line in lines:
+        parts = line.split(":", 2)
+        if len(parts) == 3:
+            paths.append((parts[1], parts[2]))
+    return paths
+
+
+def _readQuota(quota: str, period: str) -> Optional[float]:
+    """CPUs of a quota and period in microseconds, None if there is no quota"""
+    if quota in ("max", "-1") or float(period) <= 0:
+        return None
+    return float(quota) / float(period)
+
+
+def _cgroupQuota() -> Optional[float]:
+    """
+    CPU quota of the cgroup of this process in CPUs, e.g. 2.5 for a container started
+    with --cpus 2.5. Both cgroup v2 (cpu.max) and v1 (cpu.cfs_quota_us) are read. The
+    cgroup of the process may not be visible inside a container, so the root of the
+    cgroup file system is checked as well.
+    :return: The smallest quota found, None if there is none
+    """
+    candidates = []
+    for controllers, path in _cgroupPaths() + [("", "/")]:
+        path = path.lstrip("/")
+        if controllers == "":
+            candidates.append((os.path.join(cgroup_root, path, "cpu.max"), None))
+        if controllers == "" or "cpu" in controllers.split(","):
+            for directory in ("cpu", "cpu,cpuacct"):
+                base = os.path.join(cgroup_root, directory, path)
+                candidates.append(
+                    (
+                        os.path.join(base, "cpu.cfs_quota_us"),
+                        os.path.join(base, "cpu.cfs_period_us"),
+                    )
+                )
+    quotas = []
+    for quota_file, period_file in candidates:
+        try:
+            with open(quota_file) as f:
+                values = f.read().split()
+            if period_file is not None:
+                with open(period_file) as f:
+                    values.append(f.read().strip())
+            quota = _readQuota(*values[:2])
+        except (OSError, ValueError, TypeError):
+            continue
+        if quota is not None:
+            quotas.append(quota)
+    return min(quotas) if quotas else None
+
+
+def _slurmCpus() -> Optional[int]:
+    """CPUs per task of the Slurm allocation, None outside of Slurm"""
+    try:
+        return int(os.environ["SLURM_CPUS_PER_TASK"])
+    except (KeyError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """
+    Number of CPUs this process may use: the smallest of the affinity mask, the cgroup
+    CPU quota (rounded up) and SLURM_CPUS_PER_TASK.
+    """
+    limits = {"affinity": _affinityCpus()}
+    quota = _cgroupQuota()
+    if quota is not None:
+        limits["cgroup quota"] = max(1, math.ceil(quota))
+    slurm = _slurmCpus()
+    if slurm is not None and slurm > 0:
+        limits["SLURM_CPUS_PER_TASK"] = slurm
+    source = min(limits, key=limits.get)
+    logging.debug(f"Available CPUs {limits}, limited by {source}")
+    return limits[source]
+
+
+def cpu_count() -> int:
+    """
+    Number of CPUs the pools of this process are sized to: the number set with
+    configure_threads or else available_cpus.
+    """
+    return _threads if _threads > 0 else available_cpus()
+
+
+def configure_threads(threads: int = 0) -> int:
+    """
+    Sizes the thread pools of the libraries used by deepFPlearn to the same number of
+    CPUs. The RDKit worker pools use cpu_count processes, TensorFlow uses as many
+    intra-op threads and PyTorch (chemprop) as many threads. Must be called before
+    TensorFlow runs its first operation, otherwise its thread pools keep their size.
+    :param threads: Number of CPUs to use, 0 detects them, see available_cpus
+    :return: The number of CPUs used
+    """
+    global _threads
+    _threads = max(0, threads)
+    n = cpu_count()
+    # libraries that are loaded later, e.g. by the worker processes, read these
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ.setdefault(variable, str(n))
+    try:
+        import tensorflow as tf
+
+        tf.config.threading.set_intra_op_parallelism_threads(n)
+        # independent operations rarely run side by side in our models
+        tf.config.threading.set_inter_op_parallelism_threads(min(2, n))
+    except ImportError:
+        pass
+    except RuntimeError as e:
+        logging.warning(f"Could not limit the TensorFlow threads: {e}")
+    try:
+        import torch
+
+        torch.set_num_threads(n)
+    except ImportError:
+        pass
+    logging.info(f"Using {n} CPUs for fingerprint workers, TensorFlow and PyTorch")
+    return n
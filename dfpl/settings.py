@@ -1,13 +1,58 @@
 import numpy as np
 
 # Datatype that is used for fingerprint vectors stored inside
-# dataframe used during the program
-df_fp_numpy_type = np.bool8
+# dataframe used during the program. Fingerprints are stored bit-packed
+# (8 bits per byte, see np.packbits) and are only unpacked batch-wise
+# at the input of the networks (see dfpl.layers.UnpackBits).
+df_fp_numpy_type = np.uint8
+
+# Bit fingerprints of at least this many bits are stored as the indices of
+# their set bits (CSR, see dfpl.features.SparseFingerprints) instead of
+# packed rows, so that memory scales with the number of set bits.
+sparse_fp_min_size = 8192
+
+# Number of rows of wide fingerprints that are calculated as packed rows at
+# once before they are converted to the sparse format.
+sparse_block_rows = 4096
+
+# The hidden layers of the deep single-label network are sized as if the input
+# had at most this many features, so that wide fingerprints do not blow up the
+# first layers.
+fnn_max_hidden_input = 2048
 
 # Do we need copies when creating numpy matrices from the pandas dataframes
 # for training? Everything seems to work fine with False and it saves memory.
 numpy_copy_values = False
 
+# Default maximal number of entries of the on-disk fingerprint cache
+# (see dfpl.fpcache). Least recently used fingerprints are evicted first.
+fp_cache_max_entries = 10_000_000
+
+# The structures of a parallel fingerprint calculation are split into about
+# this many chunks per worker process, but not into chunks of fewer than
+# fp_min_chunk_rows structures. Idle workers pick up the next chunk, so a
+# chunk of slow molecules does not hold up the others.
+fp_chunks_per_worker = 16
+fp_min_chunk_rows = 64
+
+# Whether the chunks hold about the same number of characters instead of the
+# same number of structures. Long SMILES/InChI strings are large molecules
+# that take longer to fingerprint.
+fp_chunks_by_length = True
+
+# Batches of at most this many structures are fingerprinted by a thread pool in the
+# calling process instead of a process pool when the backend is "auto", see
+# fingerprint.calculateFingerprintSetParallel. Starting worker processes and sending
+# them the structures costs more than fingerprinting a small batch, but a structure that
+# crashes or hangs takes the calling process down with it. The default backend is
+# "process".
+fp_thread_max_rows = 5000
+
+# Seconds a fingerprint worker process may spend on one structure. Workers that take
+# longer are killed and replaced, and the structure is marked invalid. A structure whose
+# worker crashed is retried once on its own before it is marked invalid.
+fp_structure_timeout = 300.0
+
 # Autoencoder data type settings
 
 # Type that is given as input numpy array to the network
@@ -15,7 +60,10 @@ numpy_copy_values = False
 # The big dsstox dataset runs out of mem on Patrick's machine when
 # we use floats here.
 # Also, we possibly should give the FNN a float type fp
-ac_fp_numpy_type = np.bool8
+# Since the fingerprints are packed, this is the packed type and the
+# bits are only expanded to ac_fp_batch_numpy_type for a single batch.
+ac_fp_numpy_type = np.uint8
+ac_fp_batch_numpy_type = np.float32
 
 # Type used for the compressed fp which is an inner layer of the ac
 # an MUST be of float type. On Patrick's machine, (GPU) tensorflow layers
@@ -23,6 +71,10 @@ ac_fp_numpy_type = np.bool8
 # training and if it enhances results. Needs to be evaluated.
 ac_fp_compressed_numpy_type = np.bool8
 
+# Number of fingerprints that are gathered from the feature matrix and
+# passed through the encoder at once when compressing a whole dataset.
+compress_chunk_size = 65536
+
 # Feedforward Neuronal Network data type settings
 #
 # The sections below define the types of the numpy matrices used for training
@@ -30,12 +82,13 @@ ac_fp_compressed_numpy_type = np.bool8
 # XX_fp_numpy_type: used for uncompressed fingerprint tensors
 # XX_fp_compressed_numpy_type: used for compressed fingerprint tensors
 # XX_target_numpy_type: used for the target tensors
+# Uncompressed fingerprints stay packed and are unpacked inside the network.
 
-nn_fp_numpy_type = np.float32
+nn_fp_numpy_type = np.uint8
 nn_fp_compressed_numpy_type = np.float32
 nn_target_numpy_type = np.short
 
-nn_multi_fp_numpy_type = np.float32
+nn_multi_fp_numpy_type = np.uint8
 nn_multi_fp_compressed_numpy_type = np.float32
 nn_multi_target_numpy_type = np.float32
 
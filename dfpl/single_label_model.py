@@ -33,22 +33,66 @@ from dfpl import callbacks as cb
 from dfpl import options
 from dfpl import plot as pl
 from dfpl import settings
+from dfpl.descriptors import descriptorNames
+from dfpl.fingerprint import targetColumns
+from dfpl.features import FeatureStore, append_descriptors, descriptor_feature
+from dfpl.layers import (
+    adapt_descriptor_inputs,
+    input_layers,
+    model_inputs,
+    validation_inputs,
+)
+from dfpl.molstore import molecule_store
 from dfpl.utils import ae_scaffold_split, weight_split
 
 
+def input_feature(opts: options.Options) -> str:
+    """
+    Name of the feature the networks are trained on and predict from: the compressed or
+    uncompressed fingerprints, followed by the descriptors if opts.descriptors names any,
+    see add_descriptor_input.
+    """
+    feature = "fpcompressed" if opts.compressFeatures else "fp"
+    if descriptorNames(opts.descriptors):
+        return f"{feature}+{descriptor_feature}"
+    return feature
+
+
+def add_descriptor_input(features: FeatureStore, opts: options.Options) -> FeatureStore:
+    """
+    Adds the fingerprints followed by the descriptors as feature input_feature, see
+    features.append_descriptors. Rows are valid if both are. Nothing is added without
+    descriptors.
+    :param features: FeatureStore with the fingerprints and the descriptors
+    :param opts: Options with the descriptors and whether the fingerprints are compressed
+    :return: features
+    """
+    feature = input_feature(opts)
+    if not descriptorNames(opts.descriptors) or feature in features:
+        return features
+    base = "fpcompressed" if opts.compressFeatures else "fp"
+    features.set(
+        feature,
+        append_descriptors(features[base], features[descriptor_feature]),
+        features.valid(base) & features.valid(descriptor_feature),
+    )
+    return features
+
+
 def prepare_nn_training_data(
-    df: pd.DataFrame, target: str, opts: options.Options, return_dataframe: bool = False
+    df: pd.DataFrame,
+    features: FeatureStore,
+    target: str,
+    opts: options.Options,
+    return_dataframe: bool = False,
 ) -> Union[Tuple[np.ndarray, np.ndarray], pd.DataFrame]:
     # Check the value counts and abort if too imbalanced
     allowed_imbalance = 0.1
-    # If feature compression is enabled, use compressed fingerprints
-    if opts.compressFeatures:
-        vc = df[df[target].notna() & df["fpcompressed"].notnull()][
-            target
-        ].value_counts()
+    # If feature compression is enabled, use compressed fingerprints.
     # Otherwise, use uncompressed fingerprints
-    else:
-        vc = df[df[target].notna() & df["fp"].notnull()][target].value_counts()
+    feature = input_feature(opts)
+    df_fp = df[df[target].notna() & features.valid(feature, df.index)]
+    vc = df_fp[target].value_counts()
 
     # If the dataset is extremely unbalanced, adjust sampling options
     if min(vc) < max(vc) * allowed_imbalance:
@@ -65,142 +109,74 @@ def prepare_nn_training_data(
             )
 
     logging.info("Preparing training data matrices")
-
-    # If feature compression is enabled, use compressed fingerprints
     if opts.compressFeatures:
         logging.info("Using compressed fingerprints")
-        df_fpc = df[df[target].notna() & df["fpcompressed"].notnull()]
-        logging.info(
-            f"DataSet has {df_fpc.shape[0]} valid entries in fpcompressed and {target}"
-        )
-
-        # If sampling down is enabled, adjust sampling options and downsample the data
-        if opts.sampleDown:
-            assert 0.0 < opts.sampleFractionOnes < 1.0
-            logging.info(f"Using fractional sampling {opts.sampleFractionOnes}")
-            # How many ones and zeros are in the dataset
-            counts = df_fpc[target].value_counts()
-            logging.info(f"Number of sampling values: {counts.to_dict()}")
-
-            # Add a sample of 0s to the df of 1s
-            dfX = df_fpc[df_fpc[target] == 1].append(
-                df_fpc[df_fpc[target] == 0].sample(
-                    int(min(counts[0], counts[1] / opts.sampleFractionOnes))
-                )
-            )
-            # Convert fingerprints and targets to numpy arrays
-            x = np.array(
-                dfX["fpcompressed"].to_list(),
-                dtype=settings.nn_fp_compressed_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            y = np.array(
-                dfX[target].to_list(),
-                dtype=settings.nn_target_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            # Return the dataframe if specified
-            if return_dataframe:
-                return dfX
-        else:
-            logging.info("Fraction sampling is OFF")
-            # How many ones and zeros are in the dataset
-            counts = df_fpc[target].value_counts()
-            logging.info(f"Number of sampling values: {counts.to_dict()}")
-
-            # Convert fingerprints and targets to numpy arrays
-            x = np.array(
-                df_fpc["fpcompressed"].to_list(),
-                dtype=settings.nn_fp_compressed_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            y = np.array(
-                df_fpc[target].to_list(),
-                dtype=settings.nn_target_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            if return_dataframe:
-                return df_fpc
-
-    # If feature compression is not enabled, use uncompressed fingerprints
     else:
         logging.info("Using uncompressed fingerprints")
-        # select rows where the target is not null and the fingerprint is not null
-        df_fp = df[df[target].notna() & df["fp"].notnull()]
-        logging.info(f"DataSet has {df_fp.shape[0]} valid entries in fp and {target}")
+    logging.info(
+        f"DataSet has {df_fp.shape[0]} valid entries in {feature} and {target}"
+    )
 
-        if opts.sampleDown:
-            logging.info(f"Using fractional sampling {opts.sampleFractionOnes}")
-            # count number of each class value
-            counts = df_fp[target].value_counts()
-            logging.info(f"Number of sampling values: {counts.to_dict()}")
-            # downsample the majority class by taking a fraction of its samples and combining with all of the
-            # minority class
-            dfX = df_fp[df_fp[target] == 1.0].append(
-                df_fp[df_fp[target] == 0.0].sample(
-                    int(min(counts[0], counts[1] / opts.sampleFractionOnes))
-                )
-            )
-            # convert fingerprints to numpy array
-            x = np.array(
-                dfX["fp"].to_list(),
-                dtype=settings.ac_fp_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            # convert target values to numpy array
-            y = np.array(
-                dfX[target].to_list(),
-                dtype=settings.nn_target_numpy_type,
-                copy=settings.numpy_copy_values,
+    if opts.sampleDown:
+        logging.info(f"Using fractional sampling {opts.sampleFractionOnes}")
+        # count number of each class value
+        counts = df_fp[target].value_counts()
+        logging.info(f"Number of sampling values: {counts.to_dict()}")
+        # downsample the majority class by taking a fraction of its samples and combining with all of the
+        # minority class
+        dfX = df_fp[df_fp[target] == 1.0].append(
+            df_fp[df_fp[target] == 0.0].sample(
+                int(min(counts[0], counts[1] / opts.sampleFractionOnes))
             )
-            if return_dataframe:
-                return dfX
-        else:
-            logging.info("Fraction sampling is OFF")
-            # count number of each class value
-            counts = df_fp[target].value_counts()
-            logging.info(f"Number of sampling values: {counts.to_dict()}")
-            # convert fingerprints to numpy array
-            x = np.array(
-                df_fp["fp"].to_list(),
-                dtype=settings.ac_fp_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            # convert target values to numpy array
-            y = np.array(
-                df_fp[target].to_list(),
-                dtype=settings.nn_target_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            if return_dataframe:
-                return df_fp
-        # return the numpy arrays of fingerprints and targets
+        )
+    else:
+        logging.info("Fraction sampling is OFF")
+        # count number of each class value
+        counts = df_fp[target].value_counts()
+        logging.info(f"Number of sampling values: {counts.to_dict()}")
+        dfX = df_fp
+    if return_dataframe:
+        return dfX
+
+    # gather the fingerprint rows of the selected entries from the FeatureStore
+    x = features.get(feature, dfX.index)
+    # convert target values to numpy array
+    y = np.array(
+        dfX[target].to_list(),
+        dtype=settings.nn_target_numpy_type,
+        copy=settings.numpy_copy_values,
+    )
+    # return the numpy arrays of fingerprints and targets
     return x, y
 
 
 # This function defines a feedforward neural network (FNN) with the given input size, options, and output bias
 def build_fnn_network(
-    input_size: int, opts: options.Options, output_bias=None
+    input_size: int, opts: options.Options, output_bias=None, packed_input=False
 ) -> Model:
     # Set the output bias if it is provided
     if output_bias is not None:
         output_bias = tf.keras.initializers.Constant(output_bias)
 
-    # Define the number of hidden layers based on the input size
-    my_hidden_layers = {"2048": 6, "1024": 5, "999": 5, "512": 4, "256": 3}
-    if not str(input_size) in my_hidden_layers.keys():
-        raise ValueError("Wrong input-size. Must be in {2048, 1024, 999, 512, 256}.")
-    nhl = int(math.log2(input_size) / 2 - 1)
+    # Define the number and width of the hidden layers based on the input size
+    hidden_size = min(input_size, settings.fnn_max_hidden_input)
+    nhl = int(math.log2(hidden_size) / 2 - 1)
 
     # Create a sequential model
-    model = Sequential()
+    model = Sequential(
+        input_layers(
+            input_size,
+            packed_input,
+            opts.fpCounts,
+            len(descriptorNames(opts.descriptors)),
+        )
+    )
 
     # Add the first hidden layer
     if opts.activationFunction == "relu":
         model.add(
             Dense(
-                units=int(input_size / 2),
-                input_dim=input_size,
+                units=int(hidden_size / 2),
                 activation="relu",
                 kernel_regularizer=regularizers.l2(opts.l2reg),
                 kernel_initializer="he_uniform",
@@ -210,8 +186,7 @@ def build_fnn_network(
     elif opts.activationFunction == "selu":
         model.add(
             Dense(
-                units=int(input_size / 2),
-                input_dim=input_size,
+                units=int(hidden_size / 2),
                 activation="selu",
                 kernel_initializer="lecun_normal",
             )
@@ -228,7 +203,7 @@ def build_fnn_network(
         if opts.activationFunction == "relu":
             model.add(
                 Dense(
-                    units=int(input_size / factor_units),
+                    units=int(hidden_size / factor_units),
                     activation="relu",
                     kernel_regularizer=regularizers.l2(opts.l2reg),
                     kernel_initializer="he_uniform",
@@ -238,7 +213,7 @@ def build_fnn_network(
         elif opts.activationFunction == "selu":
             model.add(
                 Dense(
-                    units=int(input_size / factor_units),
+                    units=int(hidden_size / factor_units),
                     activation="selu",
                     kernel_initializer="lecun_normal",
                 )
@@ -256,19 +231,25 @@ def build_fnn_network(
 
 # This function defines a shallow neural network (SNN) with the given input size, options, and output bias
 def build_snn_network(
-    input_size: int, opts: options.Options, output_bias=None
+    input_size: int, opts: options.Options, output_bias=None, packed_input=False
 ) -> Model:
     # Set the output bias if it is provided
     if output_bias is not None:
         output_bias = tf.keras.initializers.Constant(output_bias)
 
     # Create a sequential model
-    model = Sequential()
+    model = Sequential(
+        input_layers(
+            input_size,
+            packed_input,
+            opts.fpCounts,
+            len(descriptorNames(opts.descriptors)),
+        )
+    )
 
     # Add the first hidden layer
     model.add(
         Dense(
-            input_dim=input_size,
             units=50,
             activation="selu",
             kernel_initializer="lecun_normal",
@@ -310,7 +291,7 @@ def balanced_accuracy(y_true: np.ndarray, y_pred: np.ndarray) -> np.float64:
 
 
 def define_single_label_model(
-    input_size: int, opts: options.Options, output_bias=None
+    input_size: int, opts: options.Options, output_bias=None, packed_input=False
 ) -> Model:
     """
     Defines and compiles the single-label neural network model.
@@ -319,6 +300,8 @@ def define_single_label_model(
         input_size (int): The size of the input layer.
         opts (options.Options): The options used in the model.
         output_bias (float): The initial bias for the last sigmoid layer of the model.
+        packed_input (bool): Whether the input are fingerprints of input_size bits as stored in the
+            FeatureStore, packed bits or uint8 counts if opts.fpCounts is set.
 
     Returns:
         tensorflow.keras.Model: The compiled model.
@@ -351,9 +334,9 @@ def define_single_label_model(
 
     # Set the type of neural network according to the option selected
     if opts.fnnType == "FNN":
-        model = build_fnn_network(input_size, opts, output_bias)
+        model = build_fnn_network(input_size, opts, output_bias, packed_input)
     elif opts.fnnType == "SNN":
-        model = build_snn_network(input_size, opts, output_bias)
+        model = build_snn_network(input_size, opts, output_bias, packed_input)
     else:
         raise ValueError(f'Option FNN Type is not "FNN" or "SNN", but {opts.fnnType}.')
 
@@ -390,7 +373,7 @@ def evaluate_model(
 
     # Predict the test set to compute MCC, AUC, ROC curve, etc.
     threshold = 0.5  # TODO: Introduce thresholds different from 0.5!
-    y_predict = model.predict(x_test).flatten()
+    y_predict = model.predict(**model_inputs(x_test)).flatten()
     y_predict_int = (y_predict >= threshold).astype(np.short)
     y_test_int = y_test.astype(np.short)
 
@@ -421,7 +404,7 @@ def evaluate_model(
 
     # Evaluate the model on the validation set and log the results
     loss, acc, auc_value, precision, recall, balanced_acc = tuple(
-        model.evaluate(x=x_test, y=y_test)
+        model.evaluate(**model_inputs(x_test, y_test))
     )
 
     logging.info(f"Loss: {round(loss, 4)}")
@@ -519,10 +502,18 @@ def fit_and_evaluate_model(
         initial_bias = np.log([count_dict[1] / count_dict[0]])
         logging.info(f"Initial bias for last sigmoid layer: {initial_bias[0]}")
 
-    # Define model
+    # Define model. Uncompressed fingerprints are packed and unpacked inside the model
+    packed_input = not opts.compressFeatures
+    n_descriptors = len(descriptorNames(opts.descriptors))
+    input_size = opts.fpSize if packed_input else x_train.shape[1] - n_descriptors
     model = define_single_label_model(
-        input_size=x_train.shape[1], opts=opts, output_bias=initial_bias
+        input_size=input_size,
+        opts=opts,
+        output_bias=initial_bias,
+        packed_input=packed_input,
     )
+    # descriptors are standardized with the statistics of the training rows
+    adapt_descriptor_inputs(model, x_train)
 
     # Define checkpoint to save model weights during training
     checkpoint_model_weights_path = os.path.join(model_file_prefix, "model_weights.h5")
@@ -533,13 +524,11 @@ def fit_and_evaluate_model(
     # Train model
     start = time()
     hist = model.fit(
-        x_train,
-        y_train,
+        **model_inputs(x_train, y_train, opts.batchSize, shuffle=True),
         callbacks=callback_list,
         epochs=opts.epochs,
-        batch_size=opts.batchSize,
         verbose=opts.verbose,
-        validation_data=(x_test, y_test),
+        validation_data=validation_inputs(x_test, y_test, opts.batchSize),
     )
     trainTime = str(round((time() - start) / 60, ndigits=2))
     logging.info(
@@ -552,7 +541,9 @@ def fit_and_evaluate_model(
     )
     pl.plot_history(history=hist, file=path.join(model_file_prefix, "history.svg"))
     # Evaluate model
-    callback_model = define_single_label_model(input_size=x_train.shape[1], opts=opts)
+    callback_model = define_single_label_model(
+        input_size=input_size, opts=opts, packed_input=packed_input
+    )
     callback_model.load_weights(filepath=checkpoint_model_weights_path)
     performance = evaluate_model(
         x_test=x_test,
@@ -568,33 +559,26 @@ def fit_and_evaluate_model(
 
 def get_x_y(
     df: pd.DataFrame,
+    features: FeatureStore,
     target: str,
     train_set: pd.DataFrame,
     test_set: pd.DataFrame,
     opts: options.Options,
 ):
-    train_indices = train_set.index
-    test_indices = test_set.index
-    if opts.compressFeatures:
-        accessor = "fpcompressed"
-    else:
-        accessor = "fp"
-    new_df = pd.DataFrame(
-        [{x: y for x, y in enumerate(item)} for item in df[accessor].values.tolist()],
-        index=df.index,
-    )
-    x_train = new_df.iloc[train_indices, :].values
-    y_train = df.iloc[train_indices][target].values
-    x_test = new_df.iloc[test_indices, :].values
-    y_test = df.iloc[test_indices][target].values
-    x_train = x_train.astype("float32")
+    # packed fingerprints stay packed, they are unpacked inside the model
+    accessor = input_feature(opts)
+    x_train = features.get(accessor, train_set.index)
+    y_train = df.loc[train_set.index, target].values
+    x_test = features.get(accessor, test_set.index)
+    y_test = df.loc[test_set.index, target].values
     y_train = y_train.astype("float32")
-    x_test = x_test.astype("float32")
     y_test = y_test.astype("float32")
     return x_train, y_train, x_test, y_test
 
 
-def train_single_label_models(df: pd.DataFrame, opts: options.Options) -> None:
+def train_single_label_models(
+    df: pd.DataFrame, features: FeatureStore, opts: options.Options
+) -> None:
     """
     Train individual models for all targets (columns) present in the provided target data (y) and a multi-label
     model that classifies all targets at once. For each individual target the data is first subset to exclude NA
@@ -602,11 +586,12 @@ def train_single_label_models(df: pd.DataFrame, opts: options.Options) -> None:
     training and the remaining data for validation.
 
     :param opts: The command line arguments in the options class
-    :param df: The dataframe containing x matrix and at least one column for a y target.
+    :param df: The dataframe containing at least one column for a y target.
+    :param features: The FeatureStore holding the x matrix aligned to df.
     """
 
     # find target columns
-    targets = [c for c in df.columns if c not in ["smiles", "fp", "fpcompressed"]]
+    targets = targetColumns(df)
     if opts.wabTracking and opts.wabTarget != "":
         # For W&B tracking, we only train one target that's specified as wabTarget "ER".
         # In case it's not there, we use the first one available
@@ -625,7 +610,9 @@ def train_single_label_models(df: pd.DataFrame, opts: options.Options) -> None:
     if opts.split_type == "random":
         for target in targets:  # [:1]:
             # target=targets[1] # --> only for testing the code
-            x, y = prepare_nn_training_data(df, target, opts, return_dataframe=False)
+            x, y = prepare_nn_training_data(
+                df, features, target, opts, return_dataframe=False
+            )
             if x is None:
                 continue
 
@@ -749,23 +736,24 @@ def train_single_label_models(df: pd.DataFrame, opts: options.Options) -> None:
     elif opts.split_type == "scaffold_balanced":
         # df, irrelevant_columns = preprocess_dataframe(df, opts)
         for idx, target in enumerate(targets):
-            df = prepare_nn_training_data(df, target, opts, return_dataframe=True)
-            relevant_cols = ["smiles"] + ["fp"] + [target]  # list(irrelevant_columns)
-            if opts.compressFeatures:
-                relevant_cols = relevant_cols + ["fpcompressed"]
+            df = prepare_nn_training_data(
+                df, features, target, opts, return_dataframe=True
+            )
+            relevant_cols = ["smiles"] + [target]  # list(irrelevant_columns)
             df_task = df.loc[:, relevant_cols]
-            # Drop rows with missing values in the target column
+            # Drop rows with missing values in the target column. The index is kept to find
+            # the rows in the FeatureStore
             df_task.dropna(subset=[target], inplace=True)
-            df_task.reset_index(drop=True, inplace=True)
             if opts.kFolds == 1:
                 train_set, val_set, test_set = ae_scaffold_split(
                     df_task,
                     sizes=(1 - opts.testSize, 0.0, opts.testSize),
                     balanced=False,
                     seed=42,
+                    mol_store=molecule_store(opts.molStoreFile),
                 )
                 x_train, y_train, x_test, y_test = get_x_y(
-                    df_task, target, train_set, test_set, opts
+                    df_task, features, target, train_set, test_set, opts
                 )
                 if opts.wabTracking and not opts.aeWabTracking:
                     wandb.init(
@@ -799,9 +787,10 @@ def train_single_label_models(df: pd.DataFrame, opts: options.Options) -> None:
                         sizes=(1 - opts.testSize, 0.0, opts.testSize),
                         balanced=True,
                         seed=fold_no,
+                        mol_store=molecule_store(opts.molStoreFile),
                     )
                     x_train, y_train, x_test, y_test = get_x_y(
-                        df_task, target, train_set, test_set, opts
+                        df_task, features, target, train_set, test_set, opts
                     )
                     if opts.wabTracking and not opts.aeWabTracking:
                         wandb.init(
@@ -864,19 +853,21 @@ def train_single_label_models(df: pd.DataFrame, opts: options.Options) -> None:
     elif opts.split_type == "molecular_weight":
         logging.info("You can use molecular_weight split once.")
         for idx, target in enumerate(targets):
-            df = prepare_nn_training_data(df, target, opts, return_dataframe=True)
-            relevant_cols = ["smiles"] + ["fp"] + [target]
-            if opts.compressFeatures:
-                relevant_cols = relevant_cols + ["fpcompressed"]
+            df = prepare_nn_training_data(
+                df, features, target, opts, return_dataframe=True
+            )
+            relevant_cols = ["smiles"] + [target]
             df_task = df.loc[:, relevant_cols]
             df_task.dropna(subset=[target], inplace=True)
-            df_task.reset_index(drop=True, inplace=True)
             if opts.kFolds == 1:
                 train_set, val_set, test_set = weight_split(
-                    df_task, bias="small", sizes=(1 - opts.testSize, 0.0, opts.testSize)
+                    df_task,
+                    bias="small",
+                    sizes=(1 - opts.testSize, 0.0, opts.testSize),
+                    mol_store=molecule_store(opts.molStoreFile),
                 )
                 x_train, y_train, x_test, y_test = get_x_y(
-                    df_task, target, train_set, test_set, opts
+                    df_task, features, target, train_set, test_set, opts
                 )
                 if opts.wabTracking and not opts.aeWabTracking:
                     wandb.init(
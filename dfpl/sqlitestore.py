@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""SQLite tables that map the content hash of an input structure to a value"""
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+class SQLiteStore:
+    """
+    SQLite table with a BLOB key and value columns, e.g. the parsed molecules of
+    MoleculeStore, the standardized structures of Standardizer or the fingerprints of
+    FingerprintCache. The keys are looked up in batches and the hits and misses are
+    counted. The file can be written by several processes, and a store can be shared by
+    several threads.
+    """
+
+    # Stay below the SQLite limit of host parameters per statement
+    _batch_size = 500
+
+    def __init__(self, file_name: str, table: str, columns: Dict[str, str]):
+        """
+        :param file_name: Path to the SQLite file. It is created if it does not exist. If
+            empty, the table is only kept in memory for the lifetime of the object.
+        :param table: Name of the table
+        :param columns: Names and SQLite types of the columns after the key. The first one
+            holds the values that are looked up.
+        """
+        self.file_name = file_name
+        self.table = table
+        self.columns = list(columns)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # writers of other processes hold the file for short transactions only
+        self.connection = sqlite3.connect(
+            file_name or ":memory:", timeout=600, check_same_thread=False
+        )
+        if file_name:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+        definitions = "".join(f", {name} {kind}" for name, kind in columns.items())
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key BLOB PRIMARY KEY{definitions})"
+        )
+        self.connection.commit()
+
+    def _batches(self, keys: List[bytes]) -> Iterable[Tuple[List[bytes], str]]:
+        """Batches of keys and the placeholders of their parameters"""
+        for start in range(0, len(keys), self._batch_size):
+            batch = keys[start : start + self._batch_size]
+            yield batch, ",".join("?" * len(batch))
+
+    def lookup_keys(
+        self, keys: List[Optional[bytes]]
+    ) -> Tuple[List[Optional[Any]], np.ndarray]:
+        """
+        Looks up the values of keys.
+        :param keys: Keys to look up, None is never found
+        :return: Value of each key, None if it is not stored, and a boolean array marking
+            the keys that were found
+        """
+        distinct = list({key for key in keys if key is not None})
+        found = {}
+        with self.lock:
+            for batch, params in self._batches(distinct):
+                found.update(
+                    self.connection.execute(
+                        f"SELECT key, {self.columns[0]} FROM {self.table} "
+                        f"WHERE key IN ({params})",
+                        batch,
+                    )
+                )
+            cached = np.array([key in found for key in keys], dtype=bool)
+            self.hits += int(cached.sum())
+            self.misses += len(keys) - int(cached.sum())
+        return [found.get(key) for key in keys], cached
+
+    def store_items(self, items: Iterable[Tuple], replace: bool = True) -> int:
+        """
+        Writes keys and the values of all columns.
+        :param items: Tuples of a key and its values
+        :param replace: Whether stored values of the same keys are replaced, else they are
+            kept
+        :return: Number of written rows
+        """
+        with self.lock:
+            written = self._insert(items, replace)
+            self.connection.commit()
+        return written
+
+    def _insert(self, items: Iterable[Tuple], replace: bool) -> int:
+        """Inserts items without committing, the lock needs to be held"""
+        return self.connection.executemany(
+            f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO {self.table} "
+            f"(key, {', '.join(self.columns)}) "
+            f"VALUES (?{', ?' * len(self.columns)})",
+            items,
+        ).rowcount
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Standardization of input structures with a persistent cache of the results"""
+import hashlib
+import logging
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from rdkit import Chem, rdBase
+from rdkit.Chem.MolStandardize import rdMolStandardize
+
+from dfpl.molstore import parseStructure
+from dfpl.sqlitestore import SQLiteStore
+
+# Changes whenever the standardization steps change, so that cached results of other
+# steps or RDKit versions are not used
+standardizer_version = f"cleanup+fragment+uncharge+tautomer:{rdBase.rdkitVersion}"
+
+
+@lru_cache(maxsize=None)
+def _uncharger() -> rdMolStandardize.Uncharger:
+    return rdMolStandardize.Uncharger()
+
+
+@lru_cache(maxsize=None)
+def _tautomerEnumerator() -> rdMolStandardize.TautomerEnumerator:
+    return rdMolStandardize.TautomerEnumerator()
+
+
+def standardizeStructure(structure: str, accessor: str) -> Optional[str]:
+    """
+    Standardizes a structure so that salts, charge states and tautomers of the same
+    compound get the same fingerprint: the molecule is cleaned up (normalized functional
+    groups, disconnected metals), reduced to its largest organic fragment, neutralized
+    and replaced by its canonical tautomer.
+    :param structure: SMILES, InChI or mol block
+    :param accessor: "smiles", "inchi" or "molblock"
+    :return: Canonical SMILES of the standardized molecule, None if the structure cannot be
+        parsed or standardized
+    """
+    mol = parseStructure(structure, accessor)
+    if mol is None:
+        return None
+    try:
+        mol = rdMolStandardize.Cleanup(mol)
+        mol = rdMolStandardize.FragmentParent(mol, skipStandardize=True)
+        mol = _uncharger().uncharge(mol)
+        mol = _tautomerEnumerator().Canonicalize(mol)
+    except (ValueError, RuntimeError) as e:
+        logging.debug(f"Could not standardize {structure!r}: {e}")
+        return None
+    return Chem.MolToSmiles(mol)
+
+
+def standardizeStructures(
+    structures: Sequence[str], accessor: str
+) -> List[Optional[str]]:
+    """Standardizes a list of structures, see standardizeStructure"""
+    return [standardizeStructure(structure, accessor) for structure in structures]
+
+
+class Standardizer(SQLiteStore):
+    """
+    Memoises the standardized SMILES of input structures in an SQLite file, so that the
+    tautomer enumeration is paid once per distinct structure across all runs. Structures
+    that cannot be standardized are stored as well. The results are keyed by the
+    structure and standardizer_version.
+    """
+
+    def __init__(self, file_name: str = ""):
+        """
+        :param file_name: Path to the SQLite file. It is created if it does not exist. If
+            empty, the results are only kept in memory for the lifetime of the object.
+        """
+        super().__init__(file_name, "standardized", {"smiles": "TEXT"})
+
+    @staticmethod
+    def key(structure: str, accessor: str) -> bytes:
+        """
+        Content address of a structure and the standardization steps.
+        :param structure: SMILES, InChI or mol block
+        :param accessor: "smiles", "inchi" or "molblock"
+        :return: Hash of the structure, its kind and standardizer_version
+        """
+        return hashlib.blake2b(
+            f"{standardizer_version}\0{accessor}\0{structure}".encode(), digest_size=16
+        ).digest()
+
+    def lookup(
+        self, structures: Sequence[str], accessor: str
+    ) -> Tuple[List[Optional[str]], np.ndarray]:
+        """
+        Looks up the standardized structures.
+        :param structures: Distinct input structures, all of them strings
+        :param accessor: "smiles", "inchi" or "molblock"
+        :return: Standardized SMILES of each structure, None if it is not stored or could
+            not be standardized, and a boolean array marking the structures that were found
+        """
+        return self.lookup_keys(
+            [self.key(structure, accessor) for structure in structures]
+        )
+
+    def store(
+        self,
+        structures: Sequence[str],
+        accessor: str,
+        standardized: Sequence[Optional[str]],
+    ) -> None:
+        """
+        Writes standardized structures to the cache.
+        :param structures: Input structures
+        :param accessor: "smiles", "inchi" or "molblock"
+        :param standardized: Standardized SMILES of each structure, None if it failed
+        """
+        self.store_items(
+            (self.key(structure, accessor), smiles)
+            for structure, smiles in zip(structures, standardized)
+        )
+
+    def log_statistics(self) -> None:
+        total = self.hits + self.misses
+        if total > 0:
+            logging.info(
+                f"Standardization cache: {self.hits} hits, {self.misses} misses "
+                f"({self.hits / total:.1%} hit rate)"
+            )
+
+
+def standardizer(enabled: bool, file_name: str = "") -> Optional[Standardizer]:
+    """
+    The standardizer of the options of a run.
+    :param enabled: Whether the structures are standardized
+    :param file_name: Optional SQLite file that keeps the results between runs
+    :return: The standardizer or None if it is disabled
+    """
+    return Standardizer(file_name) if enabled else None
@@ -8,16 +8,20 @@ import warnings
 from collections import defaultdict
 from pathlib import Path
 from random import Random
-from typing import Dict, List, Set, Tuple, Type, TypeVar, Union
+from typing import Dict, List, Optional, Set, Tuple, Type, TypeVar, Union
 
 import jsonpickle
 import numpy as np
 import pandas as pd
 from rdkit import Chem, RDLogger
-from rdkit.Chem import rdMolDescriptors
 from rdkit.Chem.Scaffolds import MurckoScaffold
+from sklearn.model_selection import train_test_split
 from tqdm import tqdm
 
+from dfpl.descriptors import calculateDescriptors
+from dfpl.features import FeatureStore
+from dfpl.molstore import MoleculeStore, parseStructure
+
 RDLogger.DisableLog("rdApp.*")
 T = TypeVar("T")
 
@@ -195,8 +199,33 @@ def inchi_to_mol(inchi: str) -> Chem.Mol:
     return mol
 
 
+def molecules(
+    structures: pd.Series, accessor: str, mol_store: Optional[MoleculeStore] = None
+) -> pd.Series:
+    """
+    Molecules of structures, loaded from a molecule store if one is given
+    :param structures: SMILES or InChI strings or mol blocks
+    :param accessor: "smiles", "inchi" or "molblock"
+    :param mol_store: Optional molecule store, see dfpl.molstore
+    :return: Series of molecules with the index of structures, None where parsing failed
+    """
+    if mol_store is None:
+        if accessor == "molblock":
+            return structures.apply(parseStructure, accessor=accessor)
+        parse = inchi_to_mol if accessor == "inchi" else smiles_to_mol
+        return structures.apply(parse)
+    return pd.Series(
+        mol_store.molecules(structures.tolist(), accessor),
+        index=structures.index,
+        dtype=object,
+    )
+
+
 def weight_split(
-    data: pd.DataFrame, bias: str, sizes: Tuple[float, float, float] = (0.8, 0, 0.2)
+    data: pd.DataFrame,
+    bias: str,
+    sizes: Tuple[float, float, float] = (0.8, 0, 0.2),
+    mol_store: Optional[MoleculeStore] = None,
 ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     if not (len(sizes) == 3 and np.isclose(sum(sizes), 1)):
         raise ValueError(f"Invalid train/val/test splits! got: {sizes}")
@@ -207,20 +236,20 @@ def weight_split(
         sizes[2] * len(data),
     )
     if "inchi" in [x.lower() for x in data.columns]:
-        data["mol"] = data["inchi"].apply(inchi_to_mol)
+        accessor = "inchi"
     elif "smiles" in [x.lower() for x in data.columns]:
-        data["mol"] = data["smiles"].apply(smiles_to_mol)
+        accessor = "smiles"
+    elif "molblock" in data.columns:
+        accessor = "molblock"
     else:
-        logging.info("Dataframe does not have a SMILES or InChi column")
-    none_mols = data["mol"].isnull().sum()
-    logging.info(f"There are {none_mols} chemicals with no mol objects ")
-    data.dropna(subset=["mol"], inplace=True)
-    data["mol_weight"] = data.apply(
-        lambda row: rdMolDescriptors.CalcExactMolWt(row["mol"])
-        if row["mol"] is not None
-        else None,
-        axis=1,
+        raise ValueError("Dataframe does not have a SMILES or InChi column")
+    # the weights are calculated into one array instead of one molecule object per row
+    weights, valid = calculateDescriptors(
+        data[accessor].to_numpy(), accessor, ["ExactMolWt"], mol_store=mol_store
     )
+    logging.info(f"There are {int(np.sum(~valid))} chemicals with no mol objects ")
+    data["mol_weight"] = weights[:, 0]
+    data.drop(index=data.index[~valid], inplace=True)
     # data = data.drop(columns=['mol','fp','inchi','toxid','key'], axis=1)
     sorted_data = data.copy()
     if bias == "big":
@@ -235,9 +264,9 @@ def weight_split(
     train_indices = indices[:train_end_idx]
     val_indices = indices[train_end_idx:val_end_idx]
     test_indices = indices[val_end_idx:]
-    train_df = sorted_data.iloc[train_indices].reset_index(drop=True)
-    val_df = sorted_data.iloc[val_indices].reset_index(drop=True)
-    test_df = sorted_data.iloc[test_indices].reset_index(drop=True)
+    train_df = sorted_data.iloc[train_indices]
+    val_df = sorted_data.iloc[val_indices]
+    test_df = sorted_data.iloc[test_indices]
 
     return train_df, val_df, test_df
 
@@ -248,6 +277,7 @@ def ae_scaffold_split(
     balanced: bool = False,
     key_molecule_index: int = 0,
     seed: int = 0,
+    mol_store: Optional[MoleculeStore] = None,
 ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     Splits a pandas DataFrame by scaffold so that no molecules sharing a scaffold are in different splits.
@@ -256,6 +286,7 @@ def ae_scaffold_split(
     :param balanced: Whether to balance the sizes of scaffolds in each set rather than putting the smallest in test set.
     :param key_molecule_index: For data with multiple molecules, this sets which molecule will be considered during splitting.
     :param seed: Random seed for shuffling when doing balanced splitting.
+    :param mol_store: Optional molecule store the molecules are loaded from instead of parsing them.
     :return: A tuple of pandas DataFrames containing the train, validation, and test splits of the data.
     """
     if not (len(sizes) == 3 and np.isclose(sum(sizes), 1)):
@@ -283,7 +314,15 @@ def ae_scaffold_split(
             warnings.warn(
                 "No column with 'inchi' found in the DataFrame. Proceeding with caution."
             )
-        key_mols = data.iloc[:, key_molecule_index].apply(inchi_to_mol).dropna()
+        key_mols = molecules(
+            data.iloc[:, key_molecule_index], "inchi", mol_store
+        ).dropna()
+    elif "molblock" in key_colnames and "smiles" not in key_colnames:
+        key_mols = molecules(data["molblock"], "molblock", mol_store).dropna()
+    elif mol_store is not None:
+        # unparsable SMILES keep their string, generate_scaffold fails on them as before
+        key_mols = data.iloc[:, key_molecule_index]
+        key_mols = molecules(key_mols, "smiles", mol_store).fillna(key_mols)
     else:
         key_mols = data.iloc[:, key_molecule_index]
     scaffold_to_indices = scaffold_to_smiles(key_mols.tolist(), use_indices=True)
@@ -337,6 +376,51 @@ def ae_scaffold_split(
     return train_df, val_df, test_df
 
 
+def ae_split_rows(
+    df: pd.DataFrame,
+    features: FeatureStore,
+    split_type: str,
+    test_size: float,
+    mol_store: Optional[MoleculeStore] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Splits the entries with a valid fingerprint into training and test data for an autoencoder.
+    :param df: Dataframe with the SMILES/InChI of the entries
+    :param features: FeatureStore holding the fingerprints of df
+    :param split_type: "random", "scaffold_balanced" or "molecular_weight"
+    :param test_size: Fraction of the entries used for testing. If 0.0, all entries are used for training.
+    :param mol_store: Optional molecule store for the scaffold and molecular weight splits
+    :return: Row positions in the FeatureStore of the training and of the test data
+    """
+    valid_df = df[features.valid("fp", df.index)].copy()
+    if test_size == 0.0:
+        return features.rows(valid_df.index), np.array([], dtype=int)
+    if split_type == "random":
+        train_index, test_index = train_test_split(
+            valid_df.index, test_size=test_size, random_state=42
+        )
+    elif split_type == "scaffold_balanced":
+        train_data, _, test_data = ae_scaffold_split(
+            valid_df,
+            sizes=(1 - test_size, 0.0, test_size),
+            balanced=True,
+            seed=42,
+            mol_store=mol_store,
+        )
+        train_index, test_index = train_data.index, test_data.index
+    elif split_type == "molecular_weight":
+        train_data, _, test_data = weight_split(
+            valid_df,
+            sizes=(1 - test_size, 0.0, test_size),
+            bias="small",
+            mol_store=mol_store,
+        )
+        train_index, test_index = train_data.index, test_data.index
+    else:
+        raise ValueError(f"Invalid split type: {split_type}")
+    return features.rows(train_index), features.rows(test_index)
+
+
 def log_scaffold_stats(
     data: pd.DataFrame,
     index_sets: List[Set[int]],
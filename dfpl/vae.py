@@ -8,7 +8,6 @@ import pandas as pd
 import tensorflow.keras.metrics as metrics
 import wandb
 from keras import backend as K
-from sklearn.model_selection import train_test_split
 from tensorflow.keras import initializers, optimizers
 from tensorflow.keras.layers import Dense, Input, Lambda
 from tensorflow.keras.models import Model
@@ -17,7 +16,10 @@ from tensorflow.python.framework.ops import disable_eager_execution
 from dfpl import callbacks
 from dfpl import history as ht
 from dfpl import options, settings
-from dfpl.utils import ae_scaffold_split, weight_split
+from dfpl.features import FeatureStore, count_bits, fingerprint_width, sum_scaled_counts
+from dfpl.layers import PackedAutoencoderSequence, decode_fingerprints
+from dfpl.molstore import molecule_store
+from dfpl.utils import ae_split_rows
 
 disable_eager_execution()
 
@@ -41,19 +43,24 @@ def define_vae_model(opts: options.Options, output_bias=None) -> Tuple[Model, Mo
 
     hidden_layer_count = round(math.log2(input_size / encoding_dim))
 
-    input_vec = Input(shape=(input_size,))
+    # packed fingerprints are unpacked and count fingerprints scaled batch-wise inside the model
+    input_vec = Input(
+        shape=(fingerprint_width(input_size, opts.fpCounts),),
+        dtype=settings.ac_fp_numpy_type,
+    )
+    input_bits = decode_fingerprints(input_size, opts.fpCounts)(input_vec)
 
     # 1st hidden layer
     if opts.aeActivationFunction != "selu":
         encoded = Dense(
             units=int(input_size / 2), activation=opts.aeActivationFunction
-        )(input_vec)
+        )(input_bits)
     else:
         encoded = Dense(
             units=int(input_size / 2),
             activation=opts.aeActivationFunction,
             kernel_initializer="lecun_normal",
-        )(input_vec)
+        )(input_bits)
 
     # encoding layers
     for i in range(
@@ -154,14 +161,17 @@ def define_vae_model(opts: options.Options, output_bias=None) -> Tuple[Model, Mo
     return autoencoder, encoder
 
 
-def train_full_vae(df: pd.DataFrame, opts: options.Options) -> Model:
+def train_full_vae(
+    df: pd.DataFrame, features: FeatureStore, opts: options.Options
+) -> Model:
     """
     Trains an autoencoder on the given feature matrix X. The response matrix is only used to
     split the data into meaningful test and train sets.
 
     :param opts: Command line arguments as defined in options.py
     :param df: Pandas dataframe that contains the SMILES/InChI data for training the autoencoder
-    :return: The encoder model of the trained autoencoder
+    :param features: FeatureStore holding the packed fingerprints of df
+    :return: The encoder model of the trained autoencoder and the index labels of the training and test data
     """
 
     # If wandb tracking is enabled for VAE weights but not for the main program, initialize a new wandb run
@@ -172,122 +182,69 @@ def train_full_vae(df: pd.DataFrame, opts: options.Options) -> Model:
     save_path = os.path.join(opts.ecModelDir, "vae_weights.h5")
     # Collect the callbacks for training
 
-    # Select all fingerprints that are valid and turn them into a numpy array
-    fp_matrix = np.array(
-        df[df["fp"].notnull()]["fp"].to_list(),
-        dtype=settings.ac_fp_numpy_type,
-        copy=settings.numpy_copy_values,
-    )
+    # The fingerprints stay in the FeatureStore, the splits only select row positions
+    fp_matrix = features["fp"]
     logging.info(
         f"Training VAE on a matrix of shape {fp_matrix.shape} with type {fp_matrix.dtype}"
     )
     assert 0.0 <= opts.testSize <= 0.5
-    if opts.aeSplitType == "random":
-        logging.info("Training autoencoder using random split")
-        initial_indices = np.arange(fp_matrix.shape[0])
-        if opts.testSize > 0.0:
-            # Split data into test and training data
-            if opts.aeWabTracking:
-                x_train, x_test, train_indices, test_indices = train_test_split(
-                    fp_matrix, initial_indices, test_size=opts.testSize, random_state=42
-                )
-            else:
-                x_train, x_test, train_indices, test_indices = train_test_split(
-                    fp_matrix, initial_indices, test_size=opts.testSize, random_state=42
-                )
-        else:
-            x_train = fp_matrix
-            x_test = None
-    elif opts.aeSplitType == "scaffold_balanced":
-        logging.info("Training autoencoder using scaffold split")
-        train_indices = np.arange(fp_matrix.shape[0])
-        if opts.testSize > 0.0:
-            # if opts.aeWabTracking:
-            train_data, val_data, test_data = ae_scaffold_split(
-                df,
-                sizes=(1 - opts.testSize, 0.0, opts.testSize),
-                balanced=True,
-                seed=42,
-            )
-            x_train = np.array(
-                train_data[train_data["fp"].notnull()]["fp"].to_list(),
-                dtype=settings.ac_fp_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            x_test = np.array(
-                test_data[test_data["fp"].notnull()]["fp"].to_list(),
-                dtype=settings.ac_fp_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            train_indices = df[
-                df.index.isin(train_data[train_data["fp"].notnull()].index)
-            ].index.to_numpy()
-            test_indices = df[
-                df.index.isin(test_data[test_data["fp"].notnull()].index)
-            ].index.to_numpy()
-        else:
-            x_train = fp_matrix
-            x_test = None
-    elif opts.aeSplitType == "molecular_weight":
-        logging.info("Training autoencoder using molecular weight split")
-        train_indices = np.arange(fp_matrix.shape[0])
-        if opts.testSize > 0.0:
-            train_data, val_data, test_data = weight_split(
-                df, sizes=(1 - opts.testSize, 0.0, opts.testSize), bias="small"
-            )
-            x_train = np.array(
-                train_data[train_data["fp"].notnull()]["fp"].to_list(),
-                dtype=settings.ac_fp_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            x_test = np.array(
-                test_data[test_data["fp"].notnull()]["fp"].to_list(),
-                dtype=settings.ac_fp_numpy_type,
-                copy=settings.numpy_copy_values,
-            )
-            df_sorted = df.sort_values(by="mol_weight", ascending=True)
-            # Get the sorted indices from the sorted DataFrame
-            sorted_indices = df_sorted.index.to_numpy()
-
-            # Find the corresponding indices for train_data, val_data, and test_data in the sorted DataFrame
-            train_indices = sorted_indices[df.index.isin(train_data.index)]
-            # val_indices = sorted_indices[df.index.isin(val_data.index)]
-            test_indices = sorted_indices[df.index.isin(test_data.index)]
-        else:
-            x_train = fp_matrix
-            x_test = None
-    else:
-        raise ValueError(f"Invalid split type: {opts.split_type}")
+    logging.info(f"Training autoencoder using {opts.aeSplitType} split")
+    train_rows, test_rows = ae_split_rows(
+        df,
+        features,
+        opts.aeSplitType,
+        opts.testSize,
+        mol_store=molecule_store(opts.molStoreFile),
+    )
+    train_indices = features.index[train_rows].to_numpy()
+    test_indices = features.index[test_rows].to_numpy()
 
-    # Calculate the initial bias aka the log ratio between 1's and 0'1 in all fingerprints
-    ids, counts = np.unique(x_train.flatten(), return_counts=True)
-    count_dict = dict(zip(ids, counts))
-    if count_dict[0] == 0:
+    # Calculate the initial bias aka the log ratio between 1's and 0'1 in all fingerprints.
+    # For count fingerprints the scaled counts are the reconstruction targets.
+    if opts.fpCounts:
+        ones = sum_scaled_counts(fp_matrix, train_rows)
+    else:
+        ones = count_bits(fp_matrix, train_rows)
+    zeros = len(train_rows) * opts.fpSize - ones
+    if zeros == 0:
         initial_bias = None
         logging.info("No zeroes in training labels. Setting initial_bias to None.")
     else:
-        initial_bias = np.log([count_dict[1] / count_dict[0]])
+        initial_bias = np.log([ones / zeros])
         logging.info(f"Initial bias for last sigmoid layer: {initial_bias[0]}")
     if opts.testSize > 0.0:
         logging.info(f"VAE training/testing mode with train- and test-samples")
-        logging.info(f"VAE train data shape {x_train.shape} with type {x_train.dtype}")
-        logging.info(f"VAE test data shape {x_test.shape} with type {x_test.dtype}")
+        logging.info(f"VAE train data has {len(train_rows)} samples")
+        logging.info(f"VAE test data has {len(test_rows)} samples")
     else:
         logging.info(f"VAE full train mode without test-samples")
-        logging.info(f"VAE train data shape {x_train.shape} with type {x_train.dtype}")
+        logging.info(f"VAE train data has {len(train_rows)} samples")
 
     (vae, encoder) = define_vae_model(opts, output_bias=initial_bias)
     # Train the VAE on the training data
     callback_list = callbacks.autoencoder_callback(checkpoint_path=save_path, opts=opts)
 
     vae_hist = vae.fit(
-        x_train,
-        x_train,
+        PackedAutoencoderSequence(
+            fp_matrix,
+            opts.fpSize,
+            opts.aeBatchSize,
+            rows=train_rows,
+            counts=opts.fpCounts,
+        ),
         epochs=opts.aeEpochs,
-        batch_size=opts.aeBatchSize,
         verbose=opts.verbose,
         callbacks=[callback_list],
-        validation_data=(x_test, x_test) if opts.testSize > 0.0 else None,
+        validation_data=PackedAutoencoderSequence(
+            fp_matrix,
+            opts.fpSize,
+            opts.aeBatchSize,
+            shuffle=False,
+            rows=test_rows,
+            counts=opts.fpCounts,
+        )
+        if opts.testSize > 0.0
+        else None,
     )
 
     # Save the VAE weights
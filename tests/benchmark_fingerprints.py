@@ -0,0 +1,83 @@
+"""
+Throughput of the batch fingerprint engine compared to the former per-molecule
+implementation. Run with: python tests/benchmark_fingerprints.py [CSV file]
+"""
+import pathlib
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from rdkit import Chem, DataStructs, RDLogger
+from rdkit.Chem import AllChem
+
+from dfpl import fingerprint as fp
+from dfpl.features import pack_fingerprints
+
+test_directory = pathlib.Path(__file__).parent.absolute()
+
+
+def legacy_morgan(smiles: list, fp_size: int) -> np.ndarray:
+    """The former smile2fp: one Morgan bit vector and numpy conversion per molecule"""
+    result = []
+    for smile in smiles:
+        npa = np.zeros((0,), dtype=np.bool_)
+        try:
+            DataStructs.ConvertToNumpyArray(
+                AllChem.GetMorganFingerprintAsBitVect(
+                    Chem.MolFromSmiles(smile), 2, nBits=fp_size
+                ),
+                npa,
+            )
+            result.append(pack_fingerprints(npa))
+        except Exception:
+            result.append(None)
+    return result
+
+
+def legacy_topological(smiles: list, fp_size: int) -> np.ndarray:
+    """The former inchi2fp with SMILES input: one RDKFingerprint per molecule"""
+    result = []
+    for smile in smiles:
+        try:
+            result.append(
+                pack_fingerprints(
+                    Chem.RDKFingerprint(Chem.MolFromSmiles(smile), fpSize=fp_size)
+                )
+            )
+        except Exception:
+            result.append(None)
+    return result
+
+
+def throughput(function, n: int) -> float:
+    start = time.perf_counter()
+    function()
+    return n / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    RDLogger.DisableLog("rdApp.*")
+    file_name = (
+        sys.argv[1] if len(sys.argv) > 1 else test_directory / "data" / "S_dataset.csv"
+    )
+    smiles = pd.read_csv(file_name)["smiles"].to_numpy()
+    fp_size = 2048
+    print(f"{len(smiles)} SMILES from {file_name}, single process")
+    for name, legacy in [
+        ("morgan", legacy_morgan),
+        ("topological", legacy_topological),
+    ]:
+        rate = throughput(lambda: legacy(smiles, fp_size), len(smiles))
+        print(f"{'legacy ' + name + ':':22} {rate:8.0f} mol/s")
+    for fp_type in fp.fp_types:
+        rate = throughput(
+            lambda: fp.calculateFingerprints(smiles, "smiles", fp_size, fp_type),
+            len(smiles),
+        )
+        print(f"{fp_type + ':':22} {rate:8.0f} mol/s")
+    rate = throughput(
+        lambda: fp.calculateFingerprintSet(smiles, "smiles", fp_size, fp.fp_types),
+        len(smiles),
+    )
+    print(f"{'all types, one parse:':22} {rate:8.0f} mol/s")
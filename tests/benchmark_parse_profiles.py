@@ -0,0 +1,86 @@
+"""
+Throughput of the "fast" parse profile compared to the "strict" one and a check that both
+yield bit-identical fingerprints for every structure the strict profile accepts.
+Run with: python tests/benchmark_parse_profiles.py [CSV files]
+"""
+import pathlib
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from rdkit import RDLogger
+
+from dfpl import fingerprint as fp
+from dfpl.molstore import parseStructure
+
+test_directory = pathlib.Path(__file__).parent.absolute()
+
+
+def best_rate(function, n: int, repeats: int = 3) -> float:
+    """Molecules per second of the fastest of repeats runs"""
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return n / best
+
+
+def parse_rates(smiles: np.ndarray) -> None:
+    """Prints the parse throughput of both profiles without fingerprints"""
+    rates = {}
+    for profile in fp.parse_profiles:
+        sanitize = fp.sanitizeFlags(
+            profile, fp.fingerprintComponents("atompairs", 2048)
+        )
+        rates[profile] = best_rate(
+            lambda: [parseStructure(s, "smiles", sanitize) for s in smiles],
+            len(smiles),
+        )
+    print(
+        f"{'parse only:':22} {rates['strict']:8.0f} {rates['fast']:8.0f} mol/s "
+        f"{rates['fast'] / rates['strict']:5.2f}x"
+    )
+
+
+def compare(smiles: np.ndarray, fp_size: int, fp_type: str, counts: bool) -> bool:
+    """Prints the throughput of both profiles and whether their fingerprints agree"""
+    rates, results = {}, {}
+    for profile in fp.parse_profiles:
+        calculate = lambda: fp.calculateFingerprints(  # noqa: E731
+            smiles, "smiles", fp_size, fp_type, counts=counts, profile=profile
+        )
+        rates[profile] = best_rate(calculate, len(smiles))
+        results[profile] = calculate()
+    (strict_fp, strict_valid), (fast_fp, fast_valid) = (
+        results["strict"],
+        results["fast"],
+    )
+    identical = bool(
+        np.all(fast_valid[strict_valid])
+        and np.array_equal(strict_fp[strict_valid], fast_fp[strict_valid])
+    )
+    name = fp_type + (" counts" if counts else "") + ":"
+    print(
+        f"{name:22} {rates['strict']:8.0f} {rates['fast']:8.0f} mol/s "
+        f"{rates['fast'] / rates['strict']:5.2f}x  "
+        f"{'identical' if identical else 'DIFFERENT'}, "
+        f"{int(np.sum(fast_valid & ~strict_valid))} only valid when fast"
+    )
+    return identical
+
+
+if __name__ == "__main__":
+    RDLogger.DisableLog("rdApp.*")
+    file_names = sys.argv[1:] or sorted((test_directory / "data").glob("*.csv"))
+    fp_size = 2048
+    all_identical = True
+    for file_name in file_names:
+        smiles = pd.read_csv(file_name)["smiles"].to_numpy()
+        print(f"{len(smiles)} SMILES from {file_name}, single process, strict vs fast")
+        parse_rates(smiles)
+        for fp_type in fp.fp_types:
+            for counts in (False, True):
+                all_identical &= compare(smiles, fp_size, fp_type, counts)
+    sys.exit(0 if all_identical else 1)
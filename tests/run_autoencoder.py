@@ -34,11 +34,11 @@ def runAutoencoder(opts: opt.Options) -> None:
         format="DFPL-{levelname}: {message}", style="{", level=logging.INFO
     )
     logging.info("Adding fingerprint to dataset")
-    df = fp.importDataFile(
+    df, features = fp.importDataFile(
         opts.inputFile, import_function=fp.importSmilesCSV, fp_size=opts.fpSize
     )
     logging.info("Training autoencoder")
-    ac.train_full_ac(df, opts)
+    ac.train_full_ac(df, features, opts)
     logging.info("Done")
 
 
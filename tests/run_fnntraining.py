@@ -41,7 +41,7 @@ def run_single_label_training(opts: opt.Options) -> None:
     )
     utils.createDirectory(opts.outputDir)
 
-    df = fp.importDataFile(
+    df, features = fp.importDataFile(
         opts.inputFile, import_function=fp.importSmilesCSV, fp_size=opts.fpSize
     )
 
@@ -50,20 +50,20 @@ def run_single_label_training(opts: opt.Options) -> None:
 
     if opts.trainAC:
         logging.info("Training autoencoder")
-        encoder = ac.train_full_ac(df, opts)
+        encoder = ac.train_full_ac(df, features, opts)
         # encoder.save_weights(opts.acFile)
     else:
         logging.info("Using trained autoencoder")
         (autoencoder, encoder) = ac.define_ac_model(opts)
         encoder.load_weights(opts.ecWeightsFile)
 
-    df = ac.compress_fingerprints(df, encoder)
+    features = ac.compress_fingerprints(features, encoder)
 
     # train FNNs with compressed features
     logging.info("Training the FNN using compressed input data.")
     opts.compressFeatures = True
 
-    fNN.train_single_label_models(df=df, opts=opts)
+    fNN.train_single_label_models(df=df, features=features, opts=opts)
 
     # train FNNs with uncompressed features
     opts.outputDir = utils.makePathAbsolute(
@@ -72,7 +72,7 @@ def run_single_label_training(opts: opt.Options) -> None:
     utils.createDirectory(opts.outputDir)
     logging.info("Training the FNN using un-compressed input data.")
     opts.compressFeatures = False
-    fNN.train_single_label_models(df=df, opts=opts)
+    fNN.train_single_label_models(df=df, features=features, opts=opts)
 
     logging.info("Done")
 
@@ -31,7 +31,7 @@ def test_predictions(opts: opt.Options):
     )
     logging.info(f"Predicting compounds in the input file {opts.inputFile}")
 
-    df = fp.importDataFile(
+    df, features = fp.importDataFile(
         opts.inputFile, import_function=fp.importSmilesCSV, fp_size=opts.fpSize
     )
 
@@ -42,11 +42,11 @@ def test_predictions(opts: opt.Options):
         (autoencoder, encoder) = ac.define_ac_model(opts, output_bias=None)
         autoencoder.load_weights(opts.ecWeightsFile)
         # compress the fingerprints using the autoencoder
-        df = ac.compress_fingerprints(df, encoder)
+        features = ac.compress_fingerprints(features, encoder)
     # model = tensorflow.keras.models.load_model(opts.fnnModelDir, compile=False)
     # model.compile(loss=opts.lossFunction, optimizer=opts.optimizer)
     # predict
-    df2 = p.predict_values(df=df, opts=opts)
+    df2 = p.predict_values(df=df, features=features, opts=opts)
 
     names_columns = [c for c in df2.columns if c not in ["fp", "fpcompressed"]]
 
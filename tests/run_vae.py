@@ -37,11 +37,11 @@ def runVae(opts: opt.Options) -> None:
         format="DFPL-{levelname}: {message}", style="{", level=logging.INFO
     )
     logging.info("Adding fingerprint to dataset")
-    df = fp.importDataFile(
+    df, features = fp.importDataFile(
         opts.inputFile, import_function=fp.importSmilesCSV, fp_size=opts.fpSize
     )
     logging.info("Training VARIATIONAL autoencoder with scaffold_split")
-    vae.train_full_vae(df, opts)
+    vae.train_full_vae(df, features, opts)
     logging.info("Done")
 
 
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dfpl import bitfilter
+from dfpl import fingerprint as fp
+from dfpl.features import dense_rows, unpack_fingerprints
+
+from test_fingerprint import correct_smiles, incorrect_smiles
+
+
+@pytest.mark.parametrize(
+    "fp_size, counts", [(1024, False), (16384, False), (512, True)]
+)
+def test_bit_filter(tmp_path, fp_size, counts):
+    smiles = correct_smiles * 2 + incorrect_smiles[:2]
+    path = tmp_path / "smiles.csv"
+    pd.DataFrame({"smiles": smiles}).to_csv(path, index=False)
+    _, features = fp.importDataFile(
+        str(path), fp_size=fp_size, fp_type="morgan", counts=counts
+    )
+    valid = features.valid("fp")
+    dense = dense_rows(features["fp"], slice(None))
+    values = dense if counts else unpack_fingerprints(dense, fp_size)
+    expected = (values[valid] > 0).mean(axis=0)
+
+    frequencies = bitfilter.bit_frequencies(features)
+    np.testing.assert_allclose(frequencies, expected)
+    kept = bitfilter.select_bits(frequencies, 0.1, 0.9)
+    assert 0 < len(kept) < fp_size
+    filter_path = bitfilter.save(str(tmp_path), kept, features)
+    projected = bitfilter.apply(filter_path, features)
+    assert projected.fp_size == len(kept) == bitfilter.kept_size(filter_path)
+    projected_values = dense_rows(projected["fp"], slice(None))
+    if not counts:
+        projected_values = unpack_fingerprints(projected_values, len(kept))
+    np.testing.assert_array_equal(projected_values, values[:, kept])
+    np.testing.assert_array_equal(projected.valid("fp"), valid)
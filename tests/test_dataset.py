@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+import pytest
+from rdkit import Chem
+
+from dfpl import fingerprint as fp
+from dfpl.dataset import DatasetWriter, KeyIndex, lookup_dataset
+from dfpl.features import dense_rows
+from dfpl.standardize import Standardizer
+
+from test_fingerprint import correct_smiles, incorrect_smiles
+
+
+def test_dataset_roundtrip(tmp_path):
+    smiles = correct_smiles + incorrect_smiles + [np.nan]
+    df = pd.DataFrame(
+        {
+            "smiles": smiles,
+            # identifiers beyond the 53 bit mantissa of float64
+            "id": 2**60 + np.arange(len(smiles)),
+            "AR": ([1.0, 0.0, np.nan] * len(smiles))[: len(smiles)],
+        }
+    )
+    path = tmp_path / "smiles.csv"
+    df.to_csv(path, index=False)
+    expected_df, expected = fp.importDataFile(str(path), fp_size=1024)
+
+    writer = DatasetWriter(str(tmp_path / "smiles.dfpl"), 1024, fp.default_fp_type)
+    for chunk, features in fp.iterDataFile(str(path), fp_size=1024, chunk_size=7):
+        writer.append(chunk, features)
+    writer.close()
+
+    loaded_df, loaded = fp.importDataFile(str(tmp_path / "smiles.dfpl"), fp_size=1024)
+    assert isinstance(loaded["fp"], np.memmap)
+    pd.testing.assert_frame_equal(loaded_df, expected_df, check_index_type=False)
+    assert loaded_df["id"].tolist() == expected_df["id"].tolist()
+    np.testing.assert_array_equal(loaded["fp"], expected["fp"])
+    np.testing.assert_array_equal(loaded.valid("fp"), expected.valid("fp"))
+    with pytest.raises(ValueError):
+        fp.importDataFile(str(tmp_path / "smiles.dfpl"), fp_size=2048)
+
+
+@pytest.mark.parametrize("fp_size", [1024, 16384])
+def test_dataset_key_index(tmp_path, fp_size):
+    n = 300
+    smiles = (correct_smiles * n)[:n]
+    df = pd.DataFrame(
+        {
+            "toxid": [f"DTXSID{i}" for i in range(n)],
+            "cid": [np.nan if i % 7 == 0 else float(1000 + i) for i in range(n)],
+            "id": 2**60 + np.arange(n),
+            "smiles": smiles,
+        }
+    )
+    path = tmp_path / "smiles.csv"
+    df.to_csv(path, index=False)
+    expected_df, expected = fp.importDataFile(str(path), fp_size=fp_size)
+    writer = DatasetWriter(str(tmp_path / "smiles.dfpl"), fp_size, fp.default_fp_type)
+    for chunk, features in fp.iterDataFile(str(path), fp_size=fp_size, chunk_size=64):
+        writer.append(chunk, features)
+    writer.close()
+
+    directory = str(tmp_path / "smiles.dfpl")
+    index = KeyIndex(directory)
+    assert set(index.columns) == {"toxid", "cid", "id"}
+    np.testing.assert_array_equal(
+        index.rows(["DTXSID5", "DTXSID299", "DTXSID300", "1012", 1013, "1014"]),
+        [5, 299, -1, 12, 13, -1],
+    )
+    np.testing.assert_array_equal(index.rows(["1012"], column="toxid"), [-1])
+    # identifiers beyond the 53 bit mantissa of float64 are matched exactly
+    np.testing.assert_array_equal(
+        index.rows([2**60 + 7, str(2**60 + 8)], column="id"), [7, 8]
+    )
+    with pytest.raises(ValueError):
+        index.rows(["C"], column="smiles")
+
+    ids = ["DTXSID42", "unknown", "1100", "DTXSID42", "DTXSID3"]
+    found_df, found = lookup_dataset(directory, ids)
+    rows = [42, 100, 3]
+    pd.testing.assert_frame_equal(
+        found_df, expected_df.iloc[rows], check_index_type=False
+    )
+    np.testing.assert_array_equal(
+        dense_rows(found["fp"], slice(None)), dense_rows(expected["fp"], rows)
+    )
+    np.testing.assert_array_equal(found.valid("fp"), expected.valid("fp")[rows])
+
+
+def test_convert_patterns(tmp_path):
+    (tmp_path / "assays").mkdir()
+    pd.DataFrame({"ID": [1, 2], "SMILES": correct_smiles[:2], "AR": [0, 1]}).to_csv(
+        tmp_path / "assays" / "a.csv", index=False
+    )
+    inchi = Chem.MolToInchi(Chem.MolFromSmiles(correct_smiles[2]))
+    (tmp_path / "assays" / "b.tsv").write_text(f"DTXSID1\t{inchi}\tKEY\n")
+    (tmp_path / "notes.txt").write_text("no structures\n")
+
+    converted = fp.convert_all(
+        str(tmp_path), patterns=["**/*.csv", "**/*.tsv", "*.txt"], chunk_size=1
+    )
+    assert converted == [str(tmp_path / "assays" / f) for f in ["a.csv", "b.tsv"]]
+    df, features = fp.importDataFile(str(tmp_path / "assays" / "a.dfpl"))
+    assert list(df.columns) == ["ID", "smiles", "AR"]
+    assert features.valid("fp").all()
+    df, features = fp.importDataFile(str(tmp_path / "assays" / "b.dfpl"))
+    assert list(df.columns) == ["toxid", "inchi", "key"]
+    assert features.valid("fp").all()
+
+
+def test_incremental_convert(tmp_path, caplog):
+    path = tmp_path / "smiles.csv"
+    pd.DataFrame({"smiles": correct_smiles[:6], "AR": range(6)}).to_csv(
+        path, index=False
+    )
+    fp.convertFile(str(path), chunk_size=4)
+    # one row deleted, one changed and one added
+    smiles = correct_smiles[1:6] + correct_smiles[7:8]
+    smiles[2] = correct_smiles[6]
+    pd.DataFrame({"smiles": smiles, "AR": range(6)}).to_csv(path, index=False)
+    with caplog.at_level("INFO"):
+        output = fp.convertFile(str(path), chunk_size=4)
+    assert (
+        "Reusing 3 fingerprints of the previous conversion, calculating 1"
+        in caplog.text
+    )
+    assert (
+        "Reusing 1 fingerprints of the previous conversion, calculating 1"
+        in caplog.text
+    )
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["smiles.csv", "smiles.dfpl"]
+
+    df, features = fp.importDataFile(output)
+    expected, expected_valid = fp.calculateFingerprints(
+        np.array(smiles, dtype=object), "smiles", fp.default_fp_size
+    )
+    assert df["smiles"].tolist() == smiles
+    np.testing.assert_array_equal(features["fp"], expected)
+    np.testing.assert_array_equal(features.valid("fp"), expected_valid)
+
+    # fingerprints of the standardized structures are only reused when standardizing, and
+    # fingerprints of another parse profile are never reused
+    for standardize, profile, reused in [
+        (True, "strict", 0),
+        (True, "strict", 6),
+        (False, "strict", 0),
+        (False, "fast", 0),
+        (False, "fast", 6),
+    ]:
+        caplog.clear()
+        with caplog.at_level("INFO"):
+            fp.convertFile(
+                str(path),
+                standardizer=Standardizer() if standardize else None,
+                profile=profile,
+            )
+        assert (f"Reusing {reused} fingerprints" in caplog.text) == (reused > 0)
+        df, features = fp.importDataFile(output)
+        structures, _ = fp.fingerprintedStructures(df)
+        expected, _ = fp.calculateFingerprints(structures, "smiles", fp.default_fp_size)
+        np.testing.assert_array_equal(features["fp"], expected)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+from rdkit import Chem, RDLogger
+from rdkit.Chem import Descriptors
+
+from dfpl import fingerprint as fp
+from dfpl import settings
+from dfpl.descriptors import calculateDescriptors, descriptorNames
+from dfpl.features import append_descriptors, descriptor_feature, split_descriptors
+from dfpl.fpcache import FingerprintCache
+
+from test_fingerprint import correct_smiles, incorrect_smiles
+
+
+def test_descriptors(tmp_path, monkeypatch):
+    RDLogger.DisableLog("rdApp.*")
+    names = descriptorNames("MolWt,TPSA,NumHDonors")
+    with pytest.raises(ValueError):
+        descriptorNames("MolWt,NoSuchDescriptor")
+    assert descriptorNames("") == []
+    smiles = np.array(correct_smiles + incorrect_smiles + [np.nan], dtype=object)
+    expected, valid = calculateDescriptors(smiles, "smiles", names)
+    assert expected.dtype == np.float32
+    np.testing.assert_array_equal(valid, np.arange(len(smiles)) < len(correct_smiles))
+    assert np.isnan(expected[~valid]).all()
+    np.testing.assert_allclose(
+        expected[0, 0], Descriptors.MolWt(Chem.MolFromSmiles(correct_smiles[0]))
+    )
+
+    # the pool writes the same rows, the cache returns them on the second call
+    monkeypatch.setattr(settings, "fp_thread_max_rows", 0)
+    monkeypatch.setattr(settings, "fp_min_chunk_rows", 3)
+    cache = FingerprintCache(str(tmp_path / "cache.sqlite"))
+    for _ in range(2):
+        values, values_valid = fp.cachedDescriptors(
+            smiles, "smiles", names, cache, calculate=fp.calculateDescriptorsParallel
+        )
+        np.testing.assert_array_equal(values, expected)
+        np.testing.assert_array_equal(values_valid, valid)
+    assert cache.hits == len(smiles) - 1
+
+    # descriptors are added to the features and taken over by the folded fingerprints
+    path = tmp_path / "smiles.csv"
+    pd.DataFrame({"smiles": smiles, "activity": 1}).to_csv(path, index=False)
+    df, features = fp.importDataFile(
+        str(path), fp_size=2048, cache=cache, descriptors=names, backend="thread"
+    )
+    np.testing.assert_array_equal(features[descriptor_feature], expected)
+    np.testing.assert_array_equal(
+        features.fold(1024)[descriptor_feature], features[descriptor_feature]
+    )
+    x = append_descriptors(features["fp"], features[descriptor_feature])
+    assert x.shape == (len(smiles), 256 + 4 * len(names))
+    np.testing.assert_array_equal(split_descriptors(x, len(names)), expected)
+    cache.close()
+
+    fp.convertFile(str(path), descriptors=names)
+    stored = np.load(tmp_path / f"smiles{fp.descriptors_extension}")
+    np.testing.assert_array_equal(stored, expected)
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+from rdkit import Chem
+from rdkit.Chem import AllChem
+
+from dfpl import fingerprint as fp
+from dfpl import settings
+from dfpl.features import (
+    SparseFingerprints,
+    count_bits,
+    dense_rows,
+    unpack_fingerprints,
+)
+
+from test_fingerprint import correct_smiles, incorrect_smiles
+
+
+def test_packed_fingerprints():
+    df = pd.DataFrame(correct_smiles, columns=["smiles"])
+    df = fp.addFPColumn(df, fp_size=2048, fp_type="morgan")
+    packed = np.array(df["fp"].to_list())
+    assert packed.dtype == np.uint8
+    assert packed.shape == (len(correct_smiles), 2048 // 8)
+    bits = unpack_fingerprints(packed, 2048)
+    expected = np.array(
+        AllChem.GetMorganFingerprintAsBitVect(
+            Chem.MolFromSmiles(correct_smiles[0]), 2, nBits=2048
+        )
+    )
+    assert (bits[0] == expected).all()
+    assert count_bits(packed) == bits.sum()
+
+
+def test_sparse_fingerprints(tmp_path, monkeypatch):
+    # small blocks so that the fingerprints are calculated in several blocks
+    monkeypatch.setattr(settings, "sparse_block_rows", 5)
+    smiles = correct_smiles * 2 + incorrect_smiles[:3] + [np.nan]
+    df = pd.DataFrame({"smiles": smiles, "id": np.arange(len(smiles))})
+    path = tmp_path / "smiles.csv"
+    df.to_csv(path, index=False)
+    expected, expected_valid = fp.calculateFingerprints(
+        df["smiles"].to_numpy(), "smiles", 16384, "morgan"
+    )
+
+    _, features = fp.importDataFile(
+        str(path), fp_size=16384, fp_type="morgan", calculate=fp.calculateFingerprints
+    )
+    sparse = features["fp"]
+    assert isinstance(sparse, SparseFingerprints)
+    assert sparse.shape == expected.shape
+    assert sparse.nbytes < expected.nbytes / 10
+    np.testing.assert_array_equal(sparse.to_packed(), expected)
+    np.testing.assert_array_equal(features.valid("fp"), expected_valid)
+    rows = np.array([3, 0, 12, 3])
+    np.testing.assert_array_equal(dense_rows(sparse, rows), expected[rows])
+    assert count_bits(sparse, rows) == count_bits(expected, rows)
+
+    # the second conversion reuses the stored sparse fingerprints
+    fp.convertFile(str(path), fp_type="morgan", fp_size=16384)
+    fp.convertFile(str(path), fp_type="morgan", fp_size=16384)
+    _, loaded = fp.importDataFile(
+        str(tmp_path / "smiles.dfpl"), fp_size=16384, fp_type="morgan"
+    )
+    assert isinstance(loaded["fp"], SparseFingerprints)
+    np.testing.assert_array_equal(loaded["fp"].to_packed(), expected)
+    np.testing.assert_array_equal(loaded.valid("fp"), expected_valid)
+
+
+@pytest.mark.parametrize(
+    "fp_type, counts",
+    [("topological", False), ("morgan", False), ("morgan", True), ("atompairs", True)],
+)
+def test_folded_fingerprints(tmp_path, fp_type, counts):
+    smiles = correct_smiles + incorrect_smiles[:2]
+    path = tmp_path / "smiles.csv"
+    pd.DataFrame({"smiles": smiles}).to_csv(path, index=False)
+    fp.convertFile(str(path), fp_type=fp_type, fp_size=16384, counts=counts)
+    for fp_size in [8192, 2048, 256]:
+        expected, expected_valid = fp.calculateFingerprints(
+            np.array(smiles, dtype=object), "smiles", fp_size, fp_type, counts=counts
+        )
+        _, features = fp.importDataFile(
+            str(tmp_path / "smiles.dfpl"),
+            fp_size=fp_size,
+            fp_type=fp_type,
+            counts=counts,
+        )
+        assert features.fp_size == fp_size
+        np.testing.assert_array_equal(dense_rows(features["fp"], slice(None)), expected)
+        np.testing.assert_array_equal(features.valid("fp"), expected_valid)
+    with pytest.raises(ValueError):
+        fp.importDataFile(
+            str(tmp_path / "smiles.dfpl"), fp_size=1000, fp_type=fp_type, counts=counts
+        )
@@ -1,7 +1,18 @@
+import multiprocessing
+import os
+import signal
+import time
+
+import numpy as np
 import pandas as pd
-from rdkit import RDLogger
+import pytest
+from rdkit import Chem, RDLogger
+from rdkit.Chem import AllChem, MACCSkeys
 
 from dfpl import fingerprint as fp
+from dfpl import settings
+from dfpl.features import FeatureStore, unpack_fingerprints
+from dfpl.fpcache import FingerprintCache
 
 correct_smiles = [
     "CC1(C)OC2CC3C4CC(F)C5=CC(=O)CCC5(C)C4C(O)CC3(C)C2(O1)C(=O)CO",
@@ -47,3 +58,304 @@ def test_incorrect_smiles():
     df = fp.addFPColumn(df, fp_size=2048)
     allNotNone = df[df["fp"].notnull()]
     assert len(allNotNone.index) == 0
+
+
+@pytest.mark.parametrize(
+    "fp_type, reference",
+    [
+        ("topological", lambda mol: Chem.RDKFingerprint(mol, fpSize=2048)),
+        ("MACCS", MACCSkeys.GenMACCSKeys),
+        ("atompairs", lambda mol: AllChem.GetHashedAtomPairFingerprintAsBitVect(mol)),
+        ("morgan", lambda mol: AllChem.GetMorganFingerprintAsBitVect(mol, 2, 2048)),
+    ],
+)
+def test_fingerprint_types(fp_type, reference):
+    RDLogger.DisableLog("rdApp.*")
+    packed, valid = fp.calculateFingerprints(
+        correct_smiles + incorrect_smiles, "smiles", 2048, fp_type
+    )
+    assert valid.sum() == len(correct_smiles)
+    bits = unpack_fingerprints(packed, 2048)
+    for i, smiles in enumerate(correct_smiles):
+        expected = np.array(reference(Chem.MolFromSmiles(smiles)), dtype=bool)
+        assert (bits[i, : len(expected)] == expected).all()
+        assert not bits[i, len(expected) :].any()
+
+
+def test_deduplicated_fingerprints():
+    structures = np.array(
+        correct_smiles[:3] * 4 + [np.nan, incorrect_smiles[0]] * 2, dtype=object
+    )
+    calculated = []
+
+    def calculate(unique, accessor, fp_size, fp_type):
+        calculated.extend(unique)
+        return fp.calculateFingerprints(unique, accessor, fp_size, fp_type)
+
+    packed, valid = fp.cachedFingerprints(
+        structures, "smiles", 1024, "morgan", None, calculate=calculate
+    )
+    assert sorted(calculated) == sorted(correct_smiles[:3] + incorrect_smiles[:1])
+    expected, expected_valid = fp.calculateFingerprints(
+        structures, "smiles", 1024, "morgan"
+    )
+    np.testing.assert_array_equal(packed, expected)
+    np.testing.assert_array_equal(valid, expected_valid)
+
+
+@pytest.mark.parametrize("fp_type", ["topological", "atompairs", "morgan"])
+def test_count_fingerprints(fp_type):
+    # long chains have counts above 255
+    smiles = np.array(correct_smiles + ["C" * 300, "invalid"], dtype=object)
+    counts, valid = fp.calculateFingerprints(
+        smiles, "smiles", 512, fp_type, counts=True
+    )
+    generator = fp.fingerprintGenerator(fp_type, 512)
+    reference = np.stack(
+        [
+            generator.GetCountFingerprintAsNumPy(Chem.MolFromSmiles(s))
+            for s in smiles[:-1]
+        ]
+    )
+    assert counts.dtype == np.uint8 and counts.shape == (len(smiles), 512)
+    assert reference.max() > 255
+    np.testing.assert_array_equal(counts[:-1], np.minimum(reference, 255))
+    assert valid.tolist() == [True] * (len(smiles) - 1) + [False]
+    parallel, parallel_valid = fp.cachedFingerprints(
+        smiles,
+        "smiles",
+        512,
+        fp_type,
+        None,
+        calculate=fp.calculateFingerprintsParallel,
+        counts=True,
+    )
+    np.testing.assert_array_equal(parallel, counts)
+    np.testing.assert_array_equal(parallel_valid, valid)
+
+
+def test_fingerprint_set(tmp_path):
+    smiles = np.array(correct_smiles + incorrect_smiles[:2] + [np.nan], dtype=object)
+    fp_types = ["morgan", "MACCS", "morgan+MACCS", "topological+atompairs"]
+    expected = {
+        fp_type: fp.calculateFingerprints(smiles, "smiles", 1024, fp_type)
+        for fp_type in fp_types
+    }
+    morgan, valid = fp.calculateFingerprints(smiles, "smiles", 512, "morgan")
+    maccs, _ = fp.calculateFingerprints(smiles, "smiles", 512, "MACCS")
+    np.testing.assert_array_equal(
+        expected["morgan+MACCS"][0], np.concatenate([morgan, maccs], axis=1)
+    )
+    np.testing.assert_array_equal(expected["morgan+MACCS"][1], valid)
+
+    cache = FingerprintCache(str(tmp_path / "cache.sqlite"))
+    for calculate in [fp.calculateFingerprintSet, fp.calculateFingerprintSetParallel]:
+        fps, fps_valid = fp.cachedFingerprintSet(
+            smiles, "smiles", 1024, fp_types, cache, calculate=calculate
+        )
+        for fp_type, matrix in zip(fp_types, fps):
+            np.testing.assert_array_equal(matrix, expected[fp_type][0])
+        np.testing.assert_array_equal(fps_valid, valid)
+    assert cache.hits == len(fp_types) * (len(correct_smiles) + 2)
+
+    path = tmp_path / "smiles.csv"
+    pd.DataFrame({"smiles": smiles}).to_csv(path, index=False)
+    _, features = fp.importDataFile(
+        str(path), fp_size=1024, fp_type="morgan", extra_fp_types=["morgan+MACCS"]
+    )
+    np.testing.assert_array_equal(features["fp"], expected["morgan"][0])
+    np.testing.assert_array_equal(
+        features["fp:morgan+MACCS"], expected["morgan+MACCS"][0]
+    )
+
+
+def test_chunked_parallel_fingerprints(monkeypatch):
+    smiles = np.array(
+        ["C", "CC" * 20, np.nan, "CCO"] * 6 + correct_smiles, dtype=object
+    )
+    bounds = fp.chunkBounds(smiles, 4, by_length=True)
+    assert bounds[0] == 0 and bounds[-1] == len(smiles)
+    assert np.all(np.diff(bounds) > 0)
+    assert np.array_equal(fp.chunkBounds(smiles, 4), [0, 8, 16, 24, 32])
+    # the long structures at the end get smaller chunks than the short ones
+    assert bounds[-1] - bounds[-2] < bounds[1] - bounds[0]
+
+    expected = fp.calculateFingerprints(smiles, "smiles", 1024, "morgan")
+    monkeypatch.setattr(settings, "fp_min_chunk_rows", 3)
+    for by_length in [False, True]:
+        monkeypatch.setattr(settings, "fp_chunks_by_length", by_length)
+        for backend in ["process", "thread"]:
+            fps, valid = fp.calculateFingerprintsParallel(
+                smiles, "smiles", 1024, "morgan", backend=backend
+            )
+            np.testing.assert_array_equal(fps, expected[0])
+            np.testing.assert_array_equal(valid, expected[1])
+
+
+def test_failing_fingerprint_workers(monkeypatch, caplog):
+    fill = fp._fillFingerprint
+
+    def failing_fill(generator, mol, row, counts):
+        # the pool is forked after the patch, so its workers fail as well
+        if mol.HasSubstructMatch(Chem.MolFromSmarts("Cl")):
+            os.kill(os.getpid(), signal.SIGSEGV)
+        if mol.HasSubstructMatch(Chem.MolFromSmarts("C#C")):
+            time.sleep(60)
+        fill(generator, mol, row, counts)
+
+    smiles = np.array(correct_smiles * 2, dtype=object)
+    failing = np.array(["Cl" in s or "C#C" in s for s in smiles])
+    expected, valid = fp.calculateFingerprints(smiles, "smiles", 1024, "morgan")
+    monkeypatch.setattr(fp, "_fillFingerprint", failing_fill)
+    monkeypatch.setattr(settings, "fp_min_chunk_rows", 4)
+    monkeypatch.setattr(settings, "fp_structure_timeout", 0.5)
+    monkeypatch.setattr(fp, "_watchdog_interval", 0.1)
+    fps, fps_valid = fp.calculateFingerprintsParallel(
+        smiles, "smiles", 1024, "morgan", backend="process"
+    )
+    np.testing.assert_array_equal(fps_valid, valid & ~failing)
+    np.testing.assert_array_equal(fps[~failing], expected[~failing])
+    assert not fps[failing].any()
+    assert "retrying" in caplog.text and "took more than" in caplog.text
+
+
+def test_workers_dying_before_their_chunk(monkeypatch, caplog, tmp_path):
+    attach, open_store = fp._attachSharedMemory, fp.molecule_store
+
+    def die_once(name, function):
+        def dying(*args, **kwargs):
+            # the first worker that gets here dies, before it records its pid or
+            # before it starts its first structure
+            try:
+                os.close(os.open(tmp_path / name, os.O_CREAT | os.O_EXCL))
+            except FileExistsError:
+                return function(*args, **kwargs)
+            os.kill(os.getpid(), signal.SIGKILL)
+
+        return dying
+
+    smiles = np.array(correct_smiles * 2, dtype=object)
+    expected, valid = fp.calculateFingerprints(smiles, "smiles", 1024, "morgan")
+    monkeypatch.setattr(fp, "_attachSharedMemory", die_once("attach", attach))
+    monkeypatch.setattr(fp, "molecule_store", die_once("store", open_store))
+    monkeypatch.setattr(settings, "fp_min_chunk_rows", 4)
+    monkeypatch.setattr(settings, "fp_structure_timeout", 1.0)
+    monkeypatch.setattr(fp, "_watchdog_interval", 0.1)
+    fps, fps_valid = fp.calculateFingerprintsParallel(
+        smiles, "smiles", 1024, "morgan", backend="process"
+    )
+    np.testing.assert_array_equal(fps, expected)
+    np.testing.assert_array_equal(fps_valid, valid)
+    assert "No fingerprint worker took up" in caplog.text
+    assert "died before its first structure" in caplog.text
+
+
+def test_chunks_queued_on_a_shared_pool(monkeypatch, caplog):
+    smiles = np.array(correct_smiles * 2, dtype=object)
+    expected, valid = fp.calculateFingerprints(smiles, "smiles", 1024, "morgan")
+    monkeypatch.setattr(settings, "fp_min_chunk_rows", 4)
+    monkeypatch.setattr(settings, "fp_structure_timeout", 0.5)
+    monkeypatch.setattr(fp, "_watchdog_interval", 0.1)
+    with multiprocessing.Pool(1) as pool:
+        # the chunks wait longer than the timeout behind the task of another call
+        busy = pool.apply_async(time.sleep, (2,))
+        fps, fps_valid = fp.calculateFingerprintsParallel(
+            smiles, "smiles", 1024, "morgan", pool=pool
+        )
+        busy.get()
+    np.testing.assert_array_equal(fps, expected)
+    np.testing.assert_array_equal(fps_valid, valid)
+    assert "No fingerprint worker took up" not in caplog.text
+
+
+def test_fingerprint_backends(monkeypatch):
+    smiles = np.array(correct_smiles * 20 + [np.nan], dtype=object)
+    expected = fp.calculateFingerprintSet(smiles, "smiles", 1024, ["morgan", "MACCS"])
+    monkeypatch.setattr(settings, "fp_min_chunk_rows", 8)
+    fps, valid = fp.calculateFingerprintSetThreaded(
+        smiles, "smiles", 1024, ["morgan", "MACCS"], threads=3
+    )
+    for matrix, expected_matrix in zip(fps, expected[0]):
+        np.testing.assert_array_equal(matrix, expected_matrix)
+    np.testing.assert_array_equal(valid, expected[1])
+
+    # with backend auto, small batches are calculated in threads unless a process pool
+    # is given
+    def no_process_pool(*args, **kwargs):
+        raise AssertionError("process pool started")
+
+    monkeypatch.setattr(fp.multiprocessing, "Pool", no_process_pool)
+    fps, valid = fp.calculateFingerprintsParallel(
+        smiles, "smiles", 1024, "morgan", backend="auto"
+    )
+    np.testing.assert_array_equal(fps, expected[0][0])
+    # the default backend isolates crashing structures also in small batches
+    with pytest.raises(AssertionError):
+        fp.calculateFingerprintsParallel(smiles, "smiles", 1024, "morgan")
+    monkeypatch.setattr(settings, "fp_thread_max_rows", 10)
+    with pytest.raises(AssertionError):
+        fp.calculateFingerprintsParallel(
+            smiles, "smiles", 1024, "morgan", backend="auto"
+        )
+    with pytest.raises(ValueError):
+        fp.calculateFingerprintsParallel(
+            smiles, "smiles", 1024, "morgan", backend="gpu"
+        )
+
+
+def test_parse_profiles(tmp_path):
+    RDLogger.DisableLog("rdApp.*")
+    smiles = np.array(correct_smiles + incorrect_smiles + [np.nan], dtype=object)
+    strict, strict_valid = fp.calculateFingerprintSet(
+        smiles, "smiles", 2048, fp.fp_types
+    )
+    fast, fast_valid = fp.calculateFingerprintSet(
+        smiles, "smiles", 2048, fp.fp_types, profile="fast"
+    )
+    np.testing.assert_array_equal(fast_valid, strict_valid)
+    assert len(fast) == len(fp.fp_types)
+    for strict_fp, fast_fp in zip(strict, fast):
+        np.testing.assert_array_equal(fast_fp, strict_fp)
+
+    # the fast profile skips the valence checks
+    pentavalent = np.array(["CC(C)(C)(C)(C)C"], dtype=object)
+    assert not fp.calculateFingerprints(pentavalent, "smiles", 1024)[1][0]
+    assert fp.calculateFingerprints(pentavalent, "smiles", 1024, profile="fast")[1][0]
+    with pytest.raises(ValueError):
+        fp.calculateFingerprints(pentavalent, "smiles", 1024, profile="lenient")
+
+    # so its fingerprints are cached separately
+    cache = FingerprintCache(str(tmp_path / "cache.sqlite"))
+    df = pd.DataFrame({"smiles": pentavalent})
+    assert fp.addFPColumn(df, 1024, cache)["fp"][0] is None
+    assert fp.addFPColumn(df, 1024, cache, profile="fast")["fp"][0] is not None
+    cache.close()
+
+
+def test_target_columns():
+    df = pd.DataFrame(
+        columns=["ID", "smiles", "AR", "fp", "inchi", "ER", "fpcompressed", "cid"]
+    )
+    assert fp.targetColumns(df) == ["AR", "ER"]
+
+
+def test_fingerprint_record(tmp_path):
+    index = pd.RangeIndex(2)
+    morgan = FeatureStore(
+        index, np.zeros((2, 128), np.uint8), np.ones(2, bool), 1024, "morgan"
+    )
+    topological = FeatureStore(
+        index, np.zeros((2, 128), np.uint8), np.ones(2, bool), 1024, "topological"
+    )
+    # models without a record were trained on the fingerprints of the input kind
+    fp.checkFingerprintRecord([str(tmp_path)], morgan, "smiles")
+    with pytest.raises(ValueError):
+        fp.checkFingerprintRecord([str(tmp_path)], topological, "smiles")
+    fp.checkFingerprintRecord([str(tmp_path)], topological, "inchi")
+
+    fp.saveFingerprintRecord(str(tmp_path), topological)
+    fp.checkFingerprintRecord(
+        [str(tmp_path / "target"), str(tmp_path)], topological, "smiles"
+    )
+    with pytest.raises(ValueError):
+        fp.checkFingerprintRecord([str(tmp_path)], morgan, "smiles")
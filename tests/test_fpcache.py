@@ -0,0 +1,29 @@
+import pandas as pd
+from rdkit import RDLogger
+
+from dfpl import fingerprint as fp
+from dfpl.fpcache import FingerprintCache
+
+from test_fingerprint import correct_smiles, incorrect_smiles
+
+
+def test_fingerprint_cache(tmp_path):
+    RDLogger.DisableLog("rdApp.*")
+    structures = correct_smiles + incorrect_smiles
+    cache = FingerprintCache(str(tmp_path / "fp.sqlite"), max_entries=20)
+    first = fp.addFPColumn(pd.DataFrame(structures, columns=["smiles"]), 2048, cache)
+    assert cache.hits == 0 and cache.misses == len(structures)
+    # The least recently used entries were evicted, the remaining ones are hits
+    second = fp.addFPColumn(pd.DataFrame(structures, columns=["smiles"]), 2048, cache)
+    assert cache.hits == 20
+    for a, b in zip(first["fp"], second["fp"]):
+        assert (a is None and b is None) or (a == b).all()
+    assert cache.entries == 20
+    cache.close()
+    # The kept row count and the times of use are those of the file
+    cache = FingerprintCache(str(tmp_path / "fp.sqlite"), max_entries=20)
+    assert cache.entries == 20
+    assert cache.connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    fp.addFPColumn(pd.DataFrame(structures, columns=["smiles"]), 2048, cache)
+    assert cache.hits == 20 and cache.entries == 20
+    cache.close()
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+from rdkit import Chem
+
+from dfpl import fingerprint as fp
+from dfpl import utils
+from dfpl.molstore import MoleculeStore
+
+from test_fingerprint import correct_smiles, incorrect_smiles
+
+
+def test_molecule_store(tmp_path):
+    smiles = np.array(
+        correct_smiles * 10 + incorrect_smiles[:2] + [np.nan], dtype=object
+    )
+    expected, valid = fp.calculateFingerprints(smiles, "smiles", 1024, "morgan")
+    store = MoleculeStore(str(tmp_path / "molecules.sqlite"))
+    # the workers of the first run fill the store, the second run loads from it
+    for backend in ["process", "thread"]:
+        fps, fps_valid = fp.calculateFingerprintsParallel(
+            smiles, "smiles", 1024, "morgan", backend=backend, mol_store=store
+        )
+        np.testing.assert_array_equal(fps, expected)
+        np.testing.assert_array_equal(fps_valid, valid)
+    # unparsable structures are stored as well
+    binaries, found = store.lookup(smiles, "smiles")
+    np.testing.assert_array_equal(found, [True] * (len(smiles) - 1) + [False])
+    assert binaries[len(correct_smiles) * 10] is None
+
+    mols = store.molecules(correct_smiles, "smiles")
+    assert [Chem.MolToSmiles(m) for m in mols] == [
+        Chem.MolToSmiles(Chem.MolFromSmiles(s)) for s in correct_smiles
+    ]
+    df = pd.DataFrame({"smiles": correct_smiles})
+    train, _, test = utils.weight_split(df, "small", (0.5, 0.0, 0.5), mol_store=store)
+    assert train["mol_weight"].max() <= test["mol_weight"].min()
@@ -0,0 +1,76 @@
+import numpy as np
+from rdkit import Chem
+
+from dfpl import fingerprint as fp
+
+from test_fingerprint import correct_smiles
+
+
+def test_sdf_and_smi_input(tmp_path, caplog):
+    import gzip
+
+    records = [
+        f"{Chem.MolToMolBlock(Chem.MolFromSmiles(smiles))}>  <ID>  (1)\nE{i}\n\n"
+        f"> <AR>\n{'active' if i == 6 else i % 2}\n\n$$$$\n"
+        for i, smiles in enumerate(correct_smiles)
+    ]
+    # an atom count that does not match the atom block
+    records.insert(
+        3, "broken\n\n\n  2  0  0  0  0  0  0  0  0  0999 V2000\nM  END\n$$$$\n"
+    )
+    sdf = tmp_path / "library.sdf.gz"
+    sdf.write_bytes(gzip.compress("".join(records).encode()))
+    smi = tmp_path / "library.smi"
+    smi.write_text(
+        "".join(f"{smiles} E{i}\n" for i, smiles in enumerate(correct_smiles))
+    )
+    expected, _ = fp.calculateFingerprints(
+        np.array(correct_smiles, dtype=object), "smiles", 1024
+    )
+
+    import_function = fp.detectImportFunction(str(sdf))
+    chunks = list(
+        fp.iterDataFile(
+            str(sdf), import_function, fp_size=1024, chunk_size=4, backend="process"
+        )
+    )
+    df, features = fp.concatChunks(chunks)
+    assert len(chunks) == 3
+    empty_df, empty = fp.concatChunks([], fp_size=1024)
+    assert empty_df.empty and empty["fp"].shape == (0, 128)
+    assert list(df.columns) == ["molblock", "name", "ID", "AR"]
+    assert fp.targetColumns(df) == ["AR"]
+    assert df.index.tolist() == list(range(len(records)))
+    # the value of a later chunk that is no number is set to NaN
+    assert df["AR"].dtype.kind == "f" and df["AR"].isna().sum() == 2
+    assert "Setting 1 values of data field AR" in caplog.text
+    assert features.valid("fp").tolist() == [i != 3 for i in range(len(records))]
+    np.testing.assert_array_equal(np.delete(features["fp"], 3, axis=0), expected)
+
+    df, features = fp.importDataFile(
+        str(smi), fp.detectImportFunction(str(smi)), fp_size=1024
+    )
+    assert list(df.columns) == ["smiles", "name"]
+    assert fp.targetColumns(df) == []
+    assert df["name"].tolist() == [f"E{i}" for i in range(len(correct_smiles))]
+    np.testing.assert_array_equal(features["fp"], expected)
+
+    for empty_file, columns in [
+        ("empty.sdf", ["molblock", "name"]),
+        ("empty.smi", ["smiles", "name"]),
+    ]:
+        (tmp_path / empty_file).write_text("")
+        df, features = fp.importDataFile(
+            str(tmp_path / empty_file),
+            fp.detectImportFunction(empty_file),
+            fp_size=1024,
+        )
+        assert df.empty and list(df.columns) == columns
+        assert features["fp"].shape == (0, 128)
+
+    converted = fp.convert_all(
+        str(tmp_path), patterns=["*.sdf.gz"], chunk_size=4, fp_size=1024
+    )
+    assert converted == [str(sdf)]
+    df, features = fp.importDataFile(str(tmp_path / "library.dfpl"), fp_size=1024)
+    np.testing.assert_array_equal(np.delete(features["fp"], 3, axis=0), expected)
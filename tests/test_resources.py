@@ -0,0 +1,44 @@
+import os
+
+from dfpl import resources
+
+
+def write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def test_cgroup_quota(tmp_path, monkeypatch):
+    monkeypatch.setattr(resources, "cgroup_root", str(tmp_path))
+    monkeypatch.setattr(resources, "_cgroupPaths", lambda: [("", "/job")])
+    assert resources._cgroupQuota() is None
+    write(tmp_path / "cpu.max", "max 100000\n")
+    assert resources._cgroupQuota() is None
+    write(tmp_path / "job" / "cpu.max", "250000 100000\n")
+    assert resources._cgroupQuota() == 2.5
+    write(tmp_path / "cpu" / "cpu.cfs_quota_us", "100000\n")
+    write(tmp_path / "cpu" / "cpu.cfs_period_us", "100000\n")
+    assert resources._cgroupQuota() == 1.0
+
+
+def test_available_cpus(monkeypatch):
+    monkeypatch.setattr(resources, "_affinityCpus", lambda: 16)
+    monkeypatch.setattr(resources, "_cgroupQuota", lambda: 3.2)
+    monkeypatch.delenv("SLURM_CPUS_PER_TASK", raising=False)
+    assert resources.available_cpus() == 4
+    monkeypatch.setenv("SLURM_CPUS_PER_TASK", "2")
+    assert resources.available_cpus() == 2
+    monkeypatch.setattr(resources, "_cgroupQuota", lambda: None)
+    monkeypatch.setenv("SLURM_CPUS_PER_TASK", "32")
+    assert resources.available_cpus() == 16
+
+
+def test_configure_threads(monkeypatch):
+    monkeypatch.setattr(resources, "available_cpus", lambda: 6)
+    monkeypatch.setattr(resources, "_threads", 0)
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        monkeypatch.delenv(variable, raising=False)
+    assert resources.configure_threads(3) == 3
+    assert resources.cpu_count() == 3
+    assert os.environ["OMP_NUM_THREADS"] == "3"
+    assert resources.configure_threads(0) == 6
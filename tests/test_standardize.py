@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from dfpl import fingerprint as fp
+from dfpl import settings
+from dfpl.standardize import Standardizer
+
+from test_fingerprint import incorrect_smiles
+
+
+def test_standardization(tmp_path, monkeypatch):
+    smiles = [
+        "CC(=O)[O-].[Na+]",
+        "CC(=O)O",
+        "Oc1ccccn1",
+        "O=c1cccc[nH]1",
+        "C[NH3+].[Cl-]",
+        np.nan,
+        incorrect_smiles[0],
+        "CC(=O)O",
+    ]
+    standardized = ["CC(=O)O", "CC(=O)O", "O=c1cccc[nH]1", "O=c1cccc[nH]1", "CN"]
+    path = tmp_path / "smiles.csv"
+    pd.DataFrame({"smiles": smiles, "AR": range(len(smiles))}).to_csv(path, index=False)
+    cache_file = str(tmp_path / "standardized.sqlite")
+    standardizer = Standardizer(cache_file)
+    df, features = fp.importDataFile(str(path), fp_size=1024, standardizer=standardizer)
+    assert df["smiles"].tolist()[:5] == smiles[:5]
+    assert df[fp.standardized_column].tolist() == standardized + [None, None, "CC(=O)O"]
+    # the trainers take the targets of a standardized frame as numbers
+    assert fp.targetColumns(df) == ["AR"]
+    targets = np.array(
+        df[fp.targetColumns(df)], dtype=settings.nn_multi_target_numpy_type
+    )
+    assert targets.shape == (len(smiles), 1)
+    assert features.valid("fp").tolist() == [True] * 5 + [False, False, True]
+    expected, _ = fp.calculateFingerprints(
+        np.array(standardized, dtype=object), "smiles", 1024
+    )
+    np.testing.assert_array_equal(features["fp"][:5], expected)
+    assert (standardizer.hits, standardizer.misses) == (0, 6)
+    standardizer.close()
+
+    # the second run and the process pool take every result from the cache
+    monkeypatch.setattr(settings, "fp_thread_max_rows", 0)
+    standardizer = Standardizer(cache_file)
+    structures = fp.standardizeParallel(
+        np.array(smiles, dtype=object), "smiles", standardizer
+    )
+    assert structures.tolist() == df[fp.standardized_column].tolist()
+    assert (standardizer.hits, standardizer.misses) == (6, 0)
+    standardizer.close()
+
+    standardizer = Standardizer()
+    structures = fp.standardizeParallel(
+        np.array(smiles, dtype=object), "smiles", standardizer
+    )
+    assert structures.tolist() == df[fp.standardized_column].tolist()
+    assert (standardizer.hits, standardizer.misses) == (0, 6)